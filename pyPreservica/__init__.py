@@ -9,7 +9,8 @@ licence:    Apache License 2.0
 
 from .common import *
 from .contentAPI import ContentAPI, Field, SortOrder, Operator
-from .entityAPI import EntityAPI
+from .entityAPI import EntityAPI, EntityCache, TreeWalker, DownloadStatistics, ProgressTracker, ChangeFeed
+from .asyncEntityAPI import AsyncEntityAPI
 from .uploadAPI import (
     UploadAPI,
     simple_asset_package,
@@ -22,11 +23,13 @@ from .uploadAPI import (
     upload_config,
     multi_asset_package,
 )
-from .workflowAPI import WorkflowAPI, WorkflowContext, WorkflowInstance, ProcessAPI, Process
-from .retentionAPI import RetentionAPI, RetentionAssignment, RetentionPolicy
+from .workflowAPI import WorkflowAPI, WorkflowContext, WorkflowInstance, ProcessAPI, Process, WorkflowBatch, \
+    WorkflowJob, WorkflowBatchStatistics
+from .retentionAPI import RetentionAPI, RetentionAssignment, RetentionPolicy, RetentionReport, \
+    RetentionPolicyCatalogue
 from .parAPI import PreservationActionRegistry
 from .adminAPI import AdminAPI
-from .monitorAPI import MonitorAPI, MonitorCategory, MonitorStatus, MessageStatus
+from .monitorAPI import MonitorAPI, MonitorCategory, MonitorStatus, MessageStatus, MonitorWatcher
 from .webHooksAPI import WebHooksAPI, TriggerType, WebHookHandler, FlaskWebhookHandler
 from .authorityAPI import AuthorityAPI, Table
 from .mdformsAPI import MetadataGroupsAPI, Group, GroupField, GroupFieldType
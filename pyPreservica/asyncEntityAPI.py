@@ -0,0 +1,447 @@
+"""
+pyPreservica AsyncEntityAPI module definition
+
+An asyncio client for the read only parts of the Preservica Entity API
+https://us.preservica.com/api/entity/documentation.html
+
+Requires the optional httpx package
+
+author:     James Carr
+licence:    Apache License 2.0
+
+"""
+
+import asyncio
+from typing import AsyncGenerator, Awaitable, Callable, Iterable, Tuple, Union
+
+from pyPreservica.common import *
+from pyPreservica.entityAPI import EntityAPI
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+class AsyncEntityAPI:
+    """
+        An asyncio version of the read methods of the EntityAPI
+
+        Authentication, namespaces and XML parsing are shared with a normal EntityAPI client, the HTTP requests are
+        made with httpx so thousands of requests can be in flight from one process.
+        The number of concurrent requests is limited by max_concurrency.
+
+        The client should be closed after use, either with aclose() or by using it as an async context manager
+
+        .. code-block:: python
+
+            async with AsyncEntityAPI(max_concurrency=64) as client:
+                async for asset in client.map(client.asset, references):
+                    print(asset.title)
+
+    """
+
+    def __init__(self, username: str = None, password: str = None, tenant: str = None, server: str = None,
+                 use_shared_secret: bool = False, two_fa_secret_key: str = None,
+                 protocol: str = "https", credentials_path: str = 'credentials.properties',
+                 transport: TransportConfig = None, max_concurrency: int = 32, client: EntityAPI = None):
+
+        if httpx is None:
+            msg = "AsyncEntityAPI requires the httpx package, install it with: pip install httpx"
+            logger.error(msg)
+            raise RuntimeError(msg)
+
+        if client is None:
+            client = EntityAPI(username, password, tenant, server, use_shared_secret, two_fa_secret_key,
+                               protocol, None, credentials_path, transport)
+        self.client: EntityAPI = client
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._semaphore = None
+
+        transport = self.client.transport
+        timeout = httpx.Timeout(transport.read_timeout, connect=transport.connect_timeout)
+        limits = httpx.Limits(max_connections=self.max_concurrency,
+                              max_keepalive_connections=self.max_concurrency if transport.keep_alive else 0)
+        self.http = httpx.AsyncClient(timeout=timeout, limits=limits,
+                                      headers={'User-Agent': self.client.session.headers['User-Agent']})
+
+    def __str__(self):
+        return self.client.__str__()
+
+    def __repr__(self):
+        return self.__str__()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        Close the pooled connections
+        """
+        await self.http.aclose()
+
+    @property
+    def base_url(self) -> str:
+        return f'{self.client.protocol}://{self.client.server}/api/entity'
+
+    async def _get(self, url: str, method_name: str, reference=None, params: dict = None) -> bytes:
+        """
+        Make a GET request and return the response body.
+
+        The body is returned as bytes which are parsed directly, without decoding to a string first.
+
+        A 401 renews the token once, 429 and 5xx errors are retried with backoff.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        transport = self.client.transport
+        renewed = False
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                if self.client._token_expires is not None and time.monotonic() > self.client._token_expires:
+                    # log in on a worker thread rather than blocking the event loop
+                    await asyncio.to_thread(self.client._renew_token, self.client._token)
+                # the token property may log in itself, so read the attribute to keep the event loop unblocked
+                token = self.client._token
+                response = await self.http.get(url, params=params, headers={HEADER_TOKEN: token})
+                if response.status_code == requests.codes.ok:
+                    return response.content
+                if response.status_code == requests.codes.unauthorized and not renewed:
+                    renewed = True
+                    await asyncio.to_thread(self.client._renew_token, token)
+                    continue
+                if response.status_code in RETRY_STATUS_CODES and attempt < transport.total_retries:
+                    delay = transport.backoff_factor * (2 ** attempt)
+                    retry_after = response.headers.get('Retry-After')
+                    if transport.respect_retry_after and retry_after is not None and retry_after.isdigit():
+                        delay = max(delay, int(retry_after))
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                if response.status_code == requests.codes.not_found and reference is not None:
+                    exception = ReferenceNotFoundException(reference, response.status_code, str(response.url),
+                                                           method_name)
+                else:
+                    exception = HTTPException(reference, response.status_code, str(response.url), method_name,
+                                              response.content.decode('utf-8'))
+                logger.error(exception)
+                raise exception
+
+    async def map(self, function: Callable[..., Awaitable], items: Iterable,
+                  return_exceptions: bool = False) -> AsyncGenerator:
+        """
+        Call a coroutine function on every item and yield the results as they complete
+
+        Only a bounded number of calls are scheduled at a time so very large iterables can be used.
+        Calls still running when the generator is closed early, or when a call raises, are cancelled.
+
+        :param function: A coroutine function such as asset or identifiers_for_entity
+        :param items: The arguments to pass to the function
+        :param bool return_exceptions: Yield exceptions instead of raising them
+        :return: An async generator of results
+        """
+        window = self.max_concurrency * 2
+        pending = set()
+        iterator = iter(items)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < window:
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(asyncio.ensure_future(function(item)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    exception = task.exception()
+                    if exception is not None:
+                        if not return_exceptions:
+                            raise exception
+                        yield exception
+                    else:
+                        yield task.result()
+        finally:
+            # the caller stopped early or a call failed, do not leave requests running in the background
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def wait_for_progress(self, pids: Iterable[str]) -> dict:
+        """
+        Wait until all the asynchronous processes have finished without blocking the event loop
+
+        The processes are polled by the progress tracker thread of the underlying EntityAPI client.
+
+        :param pids: The progress IDs
+        :return: A dictionary of progress ID to final status
+        :rtype: dict
+        """
+        pids = list(pids)
+        statuses = await asyncio.gather(*(asyncio.wrap_future(self.client.track_progress(pid)) for pid in pids))
+        return dict(zip(pids, statuses))
+
+    async def asset(self, reference: str) -> Asset:
+        """
+         Returns an asset object back by its internal reference identifier
+
+        :param str reference: The unique identifier for the asset usually its uuid
+        :return: The Asset object
+        :rtype: Asset
+        """
+        xml_response = await self._get(f'{self.base_url}/{IO_PATH}/{reference}', "asset", reference)
+        return self.client._entity_from_xml(Asset, xml_response)
+
+    async def folder(self, reference: str) -> Folder:
+        """
+         Returns a folder object back by its internal reference identifier
+
+        :param str reference: The unique identifier for the folder usually its uuid
+        :return: The Folder object
+        :rtype: Folder
+        """
+        xml_response = await self._get(f'{self.base_url}/{SO_PATH}/{reference}', "folder", reference)
+        return self.client._entity_from_xml(Folder, xml_response)
+
+    async def content_object(self, reference: str) -> ContentObject:
+        """
+         Returns a content object back by its internal reference identifier
+
+        :param str reference: The unique identifier for the content object usually its uuid
+        :return: The content object
+        :rtype: ContentObject
+        """
+        xml_response = await self._get(f'{self.base_url}/{CO_PATH}/{reference}', "content_object", reference)
+        return self.client._entity_from_xml(ContentObject, xml_response)
+
+    async def entity(self, entity_type: EntityType, reference: str) -> EntityT:
+        """
+        Returns a generic entity based on its reference identifier
+
+        :param EntityType entity_type: The type of entity
+        :param str reference: The unique identifier for the entity
+        :return: The entity either Asset, Folder or ContentObject
+        :rtype: Entity
+        """
+        if entity_type is EntityType.CONTENT_OBJECT:
+            return await self.content_object(reference)
+        if entity_type is EntityType.FOLDER:
+            return await self.folder(reference)
+        if entity_type is EntityType.ASSET:
+            return await self.asset(reference)
+        return None
+
+    async def metadata(self, uri: str) -> str:
+        """
+        Fetch the metadata document by its identifier, this is the key from the entity metadata map
+
+        :param str uri: The metadata identifier
+        :return: An XML document as a string
+        :rtype: str
+        """
+        xml_response = await self._get(uri, "metadata", uri)
+        return self.client._metadata_from_xml(xml_response)
+
+    async def all_metadata(self, entity: Entity) -> AsyncGenerator[Tuple[str, str], None]:
+        """
+        Retrieve all metadata fragments on an entity, the fragments are requested concurrently
+
+        :param Entity entity: The entity with the metadata
+        :return: Tuples, the first value is the schema and the second is the metadata
+        :rtype: AsyncGenerator[Tuple[str, str]]
+        """
+        if entity.metadata is None:
+            entity = await self.entity(entity.entity_type, entity.reference)
+        uris = list(entity.metadata.items())
+        documents = await asyncio.gather(*[self.metadata(uri) for uri, schema in uris])
+        for (uri, schema), document in zip(uris, documents):
+            yield tuple((str(schema), document))
+
+    async def metadata_for_entity(self, entity: Entity, schema: str) -> Union[str, None]:
+        """
+        Fetch the first metadata document which matches the schema URI from an entity
+
+        :param Entity entity: The entity containing the metadata
+        :param str schema: The metadata schema URI
+        :return: The first XML document on the entity matching the schema URI
+        :rtype: str
+        """
+        if entity.metadata is None:
+            entity = await self.entity(entity.entity_type, entity.reference)
+        for uri, schema_name in entity.metadata.items():
+            if schema == schema_name:
+                return await self.metadata(uri)
+        return None
+
+    async def identifiers_for_entity(self, entity: Entity) -> set[Tuple]:
+        """
+        Return a set of identifiers which belong to the entity
+
+        :param Entity entity: The entity
+        :return: Set of identifiers as tuples
+        :rtype: set(Tuple)
+        """
+        xml_response = await self._get(f'{self.base_url}/{entity.path}/{entity.reference}/identifiers',
+                                       "identifiers_for_entity", entity.reference)
+        return self.client._identifiers_from_xml(xml_response)
+
+    async def identifier(self, identifier_type: str, identifier_value: str) -> set[EntityT]:
+        """
+        Return a set of entities with external identifiers which match the type and value
+
+        :param str identifier_type: The identifier type
+        :param str identifier_value: The identifier value
+        :return: Set of entity objects which have a reference and title attribute
+        :rtype: set(Entity)
+        """
+        params = {'type': identifier_type, 'value': identifier_value}
+        xml_response = await self._get(f'{self.base_url}/entities/by-identifier', "identifier", params=params)
+        return self.client._entities_by_identifier_from_xml(xml_response)
+
+    async def children(self, folder: Union[str, Folder] = None, maximum: int = 100, next_page: str = None) -> PagedSet:
+        """
+        Return the child entities of a folder one page at a time.
+
+        :param folder: The parent folder, None for the children of root folders
+        :param int maximum: The maximum size of the result set in each page
+        :param str next_page: A URL for the next page of results
+        :return: A page of entity objects
+        :rtype: PagedSet
+        """
+        folder_reference = folder.reference if hasattr(folder, "reference") else folder
+        if next_page is not None:
+            xml_response = await self._get(next_page, "children", folder_reference)
+        else:
+            params = {'start': str(0), 'max': str(maximum)}
+            if folder_reference is None:
+                url = f'{self.base_url}/root/children'
+            else:
+                url = f'{self.base_url}/{SO_PATH}/{folder_reference}/children'
+            xml_response = await self._get(url, "children", folder_reference, params=params)
+        return self.client._children_from_xml(xml_response, folder_reference)
+
+    async def descendants(self, folder: Union[str, Folder] = None) -> AsyncGenerator[Entity, None]:
+        """
+        Return the immediate child entities of a folder, the paging is done internally.
+
+        :param folder: The parent folder, None for the children of root folders
+        :return: An async generator of entity objects (Folders and Assets)
+        """
+        paged_set = await self.children(folder, maximum=100, next_page=None)
+        for entity in paged_set.results:
+            yield entity
+        while paged_set.has_more:
+            paged_set = await self.children(folder, maximum=100, next_page=paged_set.next_page)
+            for entity in paged_set.results:
+                yield entity
+
+    async def representations(self, asset: Asset) -> set[Representation]:
+        """
+        Return a set of representations for the asset
+
+        :param Asset asset: The asset containing the required representations
+        :return: Set of Representation objects
+        :rtype: set(Representation)
+        """
+        if not isinstance(asset, Asset):
+            return set()
+        xml_response = await self._get(f'{self.base_url}/{asset.path}/{asset.reference}/representations',
+                                       "representations", asset.reference)
+        return self.client._representations_from_xml(asset, xml_response)
+
+    async def content_objects(self, representation: Representation) -> list[ContentObject]:
+        """
+        Return a list of content objects for a representation
+
+        :param Representation representation: The representation
+        :return: List of content objects
+        :rtype: list(ContentObject)
+        """
+        if not isinstance(representation, Representation):
+            logger.warning("representation is not of type Representation")
+            return []
+        xml_response = await self._get(representation.url, "content_objects", representation.name)
+        references = self.client._content_object_refs_from_xml(xml_response)
+        results = await asyncio.gather(*[self.content_object(reference) for reference in references])
+        for content_object in results:
+            content_object.representation_type = representation.rep_type
+            content_object.asset = representation.asset
+        return list(results)
+
+    async def bitstream(self, url: str) -> Bitstream:
+        """
+        Fetch a bitstream object from the server using its URL
+
+        :param str url: The URL to the bitstream
+        :return: a bitstream object
+        :rtype: Bitstream
+        """
+        xml_response = await self._get(url, "bitstream", url)
+        return self.client._bitstream_from_xml(xml_response, url)
+
+    async def generation(self, url: str, content_ref: str = None) -> Generation:
+        """
+        Retrieve a generation and its bitstreams, the bitstreams are requested concurrently
+
+        :param str url: The URL to the generation
+        :param str content_ref: The content object reference
+        :return: Generation
+        :rtype: Generation
+        """
+        xml_response = await self._get(url, "generation", url)
+        generation, bitstream_urls = self.client._generation_from_xml(xml_response, url)
+        bitstreams = await asyncio.gather(*[self.bitstream(bitstream_url) for bitstream_url in bitstream_urls])
+        for bs in bitstreams:
+            bs.gen_index = generation.gen_index
+            if content_ref is not None:
+                bs.co_ref = content_ref
+            generation.bitstreams.append(bs)
+        return generation
+
+    async def generations(self, content_object: ContentObject) -> list[Generation]:
+        """
+        Return a list of Generation objects for a content object
+
+        :param ContentObject content_object: The content object
+        :return: list of generations
+        :rtype: list(Generation)
+        """
+        xml_response = await self._get(f'{self.base_url}/{CO_PATH}/{content_object.reference}/generations',
+                                       "generations", content_object.reference)
+        urls = self.client._generation_urls_from_xml(xml_response)
+        results = await asyncio.gather(*[self.generation(url, content_object.reference) for url in urls])
+        for generation in results:
+            generation.asset = content_object.asset
+            generation.content_object = content_object
+            generation.representation_type = content_object.representation_type
+        return list(results)
+
+    async def bitstreams_for_asset(self, asset: Union[Asset, Entity]) -> AsyncGenerator[Bitstream, None]:
+        """
+        Return all the active bitstreams within an asset.
+        This includes all the representations and content objects
+
+        :param Asset asset: The asset
+        :return: An async generator of bitstreams
+        """
+        for representation in await self.representations(asset):
+            for content_object in await self.content_objects(representation):
+                for generation in await self.generations(content_object):
+                    if generation.active:
+                        for bitstream in generation.bitstreams:
+                            bitstream.representation = representation
+                            bitstream.content_object = content_object
+                            bitstream.generation = generation
+                            yield bitstream
@@ -7,6 +7,9 @@ author:     James Carr
 licence:    Apache License 2.0
 
 """
+import array
+import collections
+import concurrent.futures
 import configparser
 import functools
 import hashlib
@@ -31,6 +34,7 @@ from typing import TypeVar
 from datetime import datetime
 from dateutil.parser import parse
 import dateutil.tz
+from pyPreservica.xmlparser import parse_xml, find_first, find_all, child_fields, text_of, use_lxml
 
 import pyPreservica
 
@@ -55,8 +59,17 @@ SO_PATH = "structural-objects"
 CO_PATH = "content-objects"
 
 HASH_BLOCK_SIZE = 65536
+# larger reads used when hashing preservation masters, hashlib releases the GIL on buffers this size
+FIXITY_BLOCK_SIZE = 1024 * 1024
 TIME_OUT = 62
 CHUNK_SIZE = 1024 * 4
+# ranged downloads fetch segments of this size on separate connections
+DOWNLOAD_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# default lifetime of an access token in minutes if the server does not say
+TOKEN_VALID_FOR = 15
+# renew the access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 60
 
 
 class FileHash:
@@ -81,6 +94,99 @@ class FileHash:
         return hash_algorithm.hexdigest()
 
 
+FIXITY_ALGORITHMS = {"MD5": hashlib.md5, "SHA1": hashlib.sha1, "SHA256": hashlib.sha256, "SHA512": hashlib.sha512}
+
+
+class MultiFileHash:
+    """
+    Compute several hash algorithms over a file in a single read.
+
+    The file can optionally be copied to a new path or writable file object during the same read, so the file is
+    only read once when it is both hashed and written into a package.
+    """
+
+    def __init__(self, algorithms=("SHA1",), block_size: int = FIXITY_BLOCK_SIZE):
+        self.algorithms = [str(a).upper().replace("-", "") for a in algorithms]
+        for algorithm in self.algorithms:
+            if algorithm not in FIXITY_ALGORITHMS:
+                logger.error(f"Unknown fixity algorithm {algorithm}")
+                raise RuntimeError(f"Unknown fixity algorithm {algorithm}")
+        self.block_size = block_size
+
+    def __call__(self, file, copy_to=None) -> dict:
+        hashes = [FIXITY_ALGORITHMS[algorithm]() for algorithm in self.algorithms]
+        buffer = bytearray(self.block_size)
+        view = memoryview(buffer)
+        with open(file, 'rb') as f:
+            out = open(copy_to, 'wb') if isinstance(copy_to, (str, os.PathLike)) else copy_to
+            try:
+                while True:
+                    length = f.readinto(buffer)
+                    if not length:
+                        break
+                    chunk = view[:length]
+                    for hash_algorithm in hashes:
+                        hash_algorithm.update(chunk)
+                    if out is not None:
+                        out.write(chunk)
+            finally:
+                if out is not None and out is not copy_to:
+                    out.close()
+        return {algorithm: hash_algorithm.hexdigest() for algorithm, hash_algorithm in zip(self.algorithms, hashes)}
+
+
+def concurrent_map(function, items, max_workers: int = 8, ordered: bool = False, exceptions: tuple = ()):
+    """
+    Call function on every item using a pool of worker threads and yield the results
+
+    Only a bounded number of items are submitted at a time, so very large iterables can be used.
+    If function raises one of the exception types in exceptions, the exception is yielded in place of the
+    result and the remaining items are still processed, any other exception is raised.
+
+    :param function: The function to call on each item
+    :param items: An iterable of arguments
+    :param int max_workers: The number of worker threads
+    :param bool ordered: Yield results in the same order as the items, otherwise as they complete
+    :param tuple exceptions: Exception types which are returned rather than raised
+    :return: A generator of results
+    """
+    window = max(1, int(max_workers)) * 2
+    iterator = iter(items)
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(max_workers)))
+
+    def outcome(future):
+        try:
+            return future.result()
+        except exceptions as exception:
+            return exception
+
+    try:
+        pending = collections.deque() if ordered else set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = pool.submit(function, item)
+                if ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+            if not pending:
+                return
+            if ordered:
+                yield outcome(pending.popleft())
+            else:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield outcome(future)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
 def identifiers_to_dict(identifiers: set) -> dict:
     """
         Convert a set of tuples to a dict
@@ -110,52 +216,6 @@ def strtobool(val) -> bool:
         raise ValueError("invalid truth value %r" % (val,))
 
 
-def _make_stored_zipfile(base_name, base_dir, owner, group, verbose=0, dry_run=0, logger=None):
-    """
-    Create a non compressed zip file from all the files under 'base_dir'.
-
-
-    The output zip file will be named 'base_name' + ".zip".  Returns the
-    name of the output zip file.
-    """
-    import zipfile  # late import for breaking circular dependency
-
-    zip_filename = base_name + ".zip"
-    archive_dir = os.path.dirname(base_name)
-
-    if archive_dir and not os.path.exists(archive_dir):
-        if logger is not None:
-            logger.info("creating %s", archive_dir)
-        if not dry_run:
-            os.makedirs(archive_dir)
-
-    if logger is not None:
-        logger.info("creating '%s' and adding '%s' to it",
-                    zip_filename, base_dir)
-
-    if not dry_run:
-        with zipfile.ZipFile(zip_filename, "w", compression=zipfile.ZIP_STORED) as zf:
-            path = os.path.normpath(base_dir)
-            if path != os.curdir:
-                zf.write(path, path)
-                if logger is not None:
-                    logger.info("adding '%s'", path)
-            for dirpath, dirnames, filenames in os.walk(base_dir):
-                for name in sorted(dirnames):
-                    path = os.path.normpath(os.path.join(dirpath, name))
-                    zf.write(path, path)
-                    if logger is not None:
-                        logger.info("adding '%s'", path)
-                for name in filenames:
-                    path = os.path.normpath(os.path.join(dirpath, name))
-                    if os.path.isfile(path):
-                        zf.write(path, path)
-                        if logger is not None:
-                            logger.info("adding '%s'", path)
-
-    return zip_filename
-
-
 class PagedSet:
     """
     Class to represent a page of results
@@ -181,22 +241,41 @@ class PagedSet:
         return self.has_more
 
 
-class Sha1FixityCallBack:
-    def __call__(self, filename, full_path):
-        sha = FileHash(hashlib.sha1)
-        return "SHA1", sha(full_path)
+class MultiFixityCallBack:
+    """
+    Fixity callback which creates a fixity value for each algorithm from a single read of the file
 
+    The package builders call copy() to write the file into the package while it is hashed.
+    """
 
-class Sha256FixityCallBack:
-    def __call__(self, filename, full_path):
-        sha = FileHash(hashlib.sha256)
-        return "SHA256", sha(full_path)
+    def __init__(self, algorithms=("SHA1", "SHA256"), block_size: int = FIXITY_BLOCK_SIZE):
+        self.file_hash = MultiFileHash(algorithms, block_size)
 
+    def _result(self, fixities: dict):
+        if len(fixities) == 1:
+            return next(iter(fixities.items()))
+        return fixities
 
-class Sha512FixityCallBack:
     def __call__(self, filename, full_path):
-        sha = FileHash(hashlib.sha512)
-        return "SHA512", sha(full_path)
+        return self._result(self.file_hash(full_path))
+
+    def copy(self, filename, full_path, copy_to):
+        return self._result(self.file_hash(full_path, copy_to))
+
+
+class Sha1FixityCallBack(MultiFixityCallBack):
+    def __init__(self):
+        super().__init__(("SHA1",))
+
+
+class Sha256FixityCallBack(MultiFixityCallBack):
+    def __init__(self):
+        super().__init__(("SHA256",))
+
+
+class Sha512FixityCallBack(MultiFixityCallBack):
+    def __init__(self):
+        super().__init__(("SHA512",))
 
 
 class ReportProgressConsoleCallback:
@@ -352,6 +431,9 @@ class Relationship:
     DCMI_requires = "http://purl.org/dc/terms/requires"
     DCMI_conformsTo = "http://purl.org/dc/terms/conformsTo"
 
+    __slots__ = ("api_id", "this_ref", "entity_type", "title", "other_ref", "direction", "relationship_type",
+                 "relationship_id")
+
     def __init__(self, relationship_id: str, relationship_type: str, direction: RelationshipDirection, other_ref: str,
                  title: str, entity_type: EntityType, this_ref: str, api_id: str):
         self.api_id = api_id
@@ -375,6 +457,8 @@ class IntegrityCheck:
     Class to hold information about completed integrity checks
     """
 
+    __slots__ = ("check_type", "success", "date", "adapter", "fixed", "reason")
+
     def __init__(self, check_type, success, date, adapter, fixed, reason):
         self.check_type = check_type
         self.success = bool(success)
@@ -404,6 +488,9 @@ class Bitstream:
         Class to represent the Bitstream Object or digital file in the Preservica data model
     """
 
+    __slots__ = ("filename", "length", "fixity", "content_url", "bs_index", "gen_index", "co_ref", "representation",
+                 "content_object", "generation")
+
     def __init__(self, filename: str, length: int, fixity: dict, content_url: str):
         self.filename = filename
         self.length = int(length)
@@ -412,6 +499,9 @@ class Bitstream:
         self.bs_index = None
         self.gen_index = None
         self.co_ref = None
+        self.representation = None
+        self.content_object = None
+        self.generation = None
 
     def __str__(self):
         return f"""
@@ -449,6 +539,9 @@ class Generation:
          Class to represent the Generation Object in the Preservica data model
     """
 
+    __slots__ = ("original", "active", "content_object", "format_group", "effective_date", "bitstreams",
+                 "properties", "formats", "gen_index", "asset", "representation_type")
+
     def __init__(self, original: bool, active: bool, format_group: str, effective_date: str, bitstreams: list):
         self.original = bool(original)
         self.active = bool(active)
@@ -458,6 +551,9 @@ class Generation:
         self.bitstreams = bitstreams
         self.properties = list()
         self.formats = list()
+        self.gen_index = None
+        self.asset = None
+        self.representation_type = None
 
     def __str__(self):
         return f"""
@@ -473,23 +569,42 @@ class Generation:
         return self.__str__()
 
 
+def _intern(value):
+    # security tags, parents and custom types repeat across thousands of entities, so share one copy of each
+    return sys.intern(value) if type(value) is str else value
+
+
 class Entity:
     """
         Base Class of Assets, Folders and Content Objects
+
+        Entities are equal when they have the same type and reference, so they can be used in sets and as
+        dictionary keys.
     """
 
+    __slots__ = ("reference", "title", "description", "security_tag", "parent", "metadata", "custom_type")
+
+    entity_type = None
+    path = None
+    tag = None
+
     def __init__(self, reference: str, title: str, description: str, security_tag: str, parent: str, metadata: dict):
         self.reference = reference
         self.title = title
         self.description = description
-        self.security_tag = security_tag
-        self.parent = parent
+        self.security_tag = _intern(security_tag)
+        self.parent = _intern(parent)
         self.metadata = metadata
-        self.entity_type = None
-        self.path = None
-        self.tag = None
         self.custom_type = None
 
+    def __eq__(self, other):
+        if not isinstance(other, Entity):
+            return NotImplemented
+        return self.reference == other.reference and self.entity_type is other.entity_type
+
+    def __hash__(self):
+        return hash(self.reference)
+
     def __str__(self):
         return f"""
             Entity:         {self.entity_type}
@@ -516,12 +631,15 @@ class Folder(Entity):
        Class to represent the Structural Object or Folder in the Preservica data model
     """
 
+    __slots__ = ()
+
+    entity_type = EntityType.FOLDER
+    path = SO_PATH
+    tag = "StructuralObject"
+
     def __init__(self, reference: str, title: str, description: str = None, security_tag: str = None,
                  parent: str = None, metadata: dict = None):
         super().__init__(reference, title, description, security_tag, parent, metadata)
-        self.entity_type = EntityType.FOLDER
-        self.path = SO_PATH
-        self.tag = "StructuralObject"
 
 
 class Asset(Entity):
@@ -529,12 +647,15 @@ class Asset(Entity):
         Class to represent the Information Object or Asset in the Preservica data model
     """
 
+    __slots__ = ()
+
+    entity_type = EntityType.ASSET
+    path = IO_PATH
+    tag = "InformationObject"
+
     def __init__(self, reference: str, title: str, description: str = None, security_tag: str = None,
                  parent: str = None, metadata: dict = None):
         super().__init__(reference, title, description, security_tag, parent, metadata)
-        self.entity_type = EntityType.ASSET
-        self.path = IO_PATH
-        self.tag = "InformationObject"
 
 
 class ContentObject(Entity):
@@ -542,14 +663,17 @@ class ContentObject(Entity):
        Class to represent the Content Object in the Preservica data model
     """
 
+    __slots__ = ("representation_type", "asset")
+
+    entity_type = EntityType.CONTENT_OBJECT
+    path = CO_PATH
+    tag = "ContentObject"
+
     def __init__(self, reference: str, title: str, description: str = None, security_tag: str = None,
                  parent: str = None, metadata: dict = None):
         super().__init__(reference, title, description, security_tag, parent, metadata)
-        self.entity_type = EntityType.CONTENT_OBJECT
         self.representation_type = None
         self.asset = None
-        self.path = CO_PATH
-        self.tag = "ContentObject"
 
 
 EntityT = TypeVar("EntityT", Folder, Asset, ContentObject, None)
@@ -575,6 +699,141 @@ class Representation:
         return self.__str__()
 
 
+class EntityTable:
+    """
+        A compact table of entities for walks over very large repositories
+
+        The reference, title, parent, security tag and type of each entity are held in columns rather than as
+        one object per entity. Folder, Asset and ContentObject objects are only created when rows are read back.
+        Adding an entity which is already in the table replaces its row.
+    """
+
+    _types = (EntityType.FOLDER, EntityType.ASSET, EntityType.CONTENT_OBJECT)
+    _classes = (Folder, Asset, ContentObject)
+
+    def __init__(self, entities=None):
+        self._index = {}
+        self._references = []
+        self._titles = []
+        self._parents = []
+        self._security_tags = []
+        self._entity_types = array.array('B')
+        if entities is not None:
+            self.extend(entities)
+
+    def add(self, entity: Entity):
+        """
+        Add an entity to the table
+
+        :param Entity entity: The Folder, Asset or ContentObject
+        """
+        entity_type = self._types.index(entity.entity_type)
+        row = self._index.get(entity.reference)
+        if row is None:
+            self._index[entity.reference] = len(self._references)
+            self._references.append(entity.reference)
+            self._titles.append(entity.title)
+            self._parents.append(_intern(entity.parent))
+            self._security_tags.append(_intern(entity.security_tag))
+            self._entity_types.append(entity_type)
+        else:
+            self._titles[row] = entity.title
+            self._parents[row] = _intern(entity.parent)
+            self._security_tags[row] = _intern(entity.security_tag)
+            self._entity_types[row] = entity_type
+
+    def extend(self, entities):
+        """
+        Add every entity from an iterable, such as the walker returned by parallel_descendants()
+
+        :param entities: An iterable of entities
+        """
+        for entity in entities:
+            self.add(entity)
+
+    def get(self, reference: str, default=None):
+        """
+        Return the entity with the reference, or default if it is not in the table
+
+        :param str reference: The entity reference
+        :return: A new Folder, Asset or ContentObject
+        """
+        row = self._index.get(reference)
+        if row is None:
+            return default
+        return self._entity(row)
+
+    def row(self, reference: str) -> tuple:
+        """
+        Return the row for a reference as a tuple of (reference, entity_type, title, parent, security_tag)
+        without creating an entity object
+
+        :param str reference: The entity reference
+        :rtype: tuple
+        """
+        row = self._index[reference]
+        return (self._references[row], self._types[self._entity_types[row]], self._titles[row], self._parents[row],
+                self._security_tags[row])
+
+    def rows(self):
+        """
+        Iterate over the rows in insertion order, each row is a tuple of
+        (reference, entity_type, title, parent, security_tag)
+        """
+        types = self._types
+        return zip(self._references, (types[t] for t in self._entity_types), self._titles, self._parents,
+                   self._security_tags)
+
+    def references(self):
+        """
+        Return a set like view of the references in the table
+        """
+        return self._index.keys()
+
+    def changed(self, other: "EntityTable") -> set:
+        """
+        Return the references of entities in both tables whose title, parent, security tag or type differ
+
+        :param EntityTable other: The table to compare against, for example an earlier inventory
+        :rtype: set
+        """
+        result = set()
+        for reference, row in self._index.items():
+            other_row = other._index.get(reference)
+            if other_row is None:
+                continue
+            if (self._titles[row] != other._titles[other_row] or
+                    self._parents[row] != other._parents[other_row] or
+                    self._security_tags[row] != other._security_tags[other_row] or
+                    self._entity_types[row] != other._entity_types[other_row]):
+                result.add(reference)
+        return result
+
+    def _entity(self, row: int) -> Entity:
+        entity_class = self._classes[self._entity_types[row]]
+        return entity_class(self._references[row], self._titles[row], None, self._security_tags[row],
+                            self._parents[row], None)
+
+    def __len__(self):
+        return len(self._references)
+
+    def __contains__(self, item):
+        if isinstance(item, Entity):
+            row = self._index.get(item.reference)
+            return row is not None and self._types[self._entity_types[row]] is item.entity_type
+        return item in self._index
+
+    def __iter__(self):
+        for row in range(len(self._references)):
+            yield self._entity(row)
+
+    def __str__(self):
+        return f"EntityTable size: {len(self)}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
 def only_assets(entity: Entity):
     return bool(entity.entity_type is EntityType.ASSET)
 
@@ -659,6 +918,125 @@ def sanitize(filename) -> str:
     return filename
 
 
+class TransportConfig:
+    """
+        HTTP transport settings shared by the API clients
+
+        Controls the size of the connection pool, request timeouts, the retry and backoff policy and keep-alive.
+
+        API clients created with the same TransportConfig share one connection pool, so connections opened by an
+        EntityAPI can be reused by a ContentAPI or UploadAPI without a new TLS handshake.
+
+        :param int pool_connections: The number of host connection pools to cache
+        :param int pool_maxsize: The maximum number of connections kept open to each host
+        :param bool pool_block: Wait for a free connection rather than opening an extra one when the pool is full
+        :param float connect_timeout: Seconds to wait for a connection, None to use read_timeout
+        :param float read_timeout: Seconds to wait for the server to send a response
+        :param int total_retries: The maximum number of retries for a request
+        :param float backoff_factor: The exponential backoff factor between retries
+        :param tuple status_forcelist: HTTP status codes which are retried
+        :param bool respect_retry_after: Wait for the period given in a Retry-After header (429 and 503)
+        :param bool keep_alive: Reuse connections between requests, False closes the connection after each request
+        :param bool tcp_keepalive: Enable TCP keep-alive probes on idle pooled connections
+    """
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 10, pool_block: bool = False,
+                 connect_timeout: float = None, read_timeout: float = TIME_OUT, total_retries: int = 3,
+                 backoff_factor: float = 0.1, status_forcelist: tuple = (429, 502, 503, 504),
+                 respect_retry_after: bool = True, keep_alive: bool = True, tcp_keepalive: bool = False):
+        self.pool_connections = int(pool_connections)
+        self.pool_maxsize = int(pool_maxsize)
+        self.pool_block = bool(pool_block)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_retries = int(total_retries)
+        self.backoff_factor = float(backoff_factor)
+        self.status_forcelist = tuple(status_forcelist)
+        self.respect_retry_after = bool(respect_retry_after)
+        self.keep_alive = bool(keep_alive)
+        self.tcp_keepalive = bool(tcp_keepalive)
+        self._adapter = None
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        """
+            The default timeout passed to each request
+        """
+        if self.connect_timeout is None:
+            return self.read_timeout
+        return self.connect_timeout, self.read_timeout
+
+    def retry(self) -> Retry:
+        """
+            The retry policy used by the connection pool
+        """
+        return Retry(
+            total=self.total_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            respect_retry_after_header=self.respect_retry_after
+        )
+
+    def adapter(self) -> HTTPAdapter:
+        """
+            The connection pool shared by every session using this configuration
+        """
+        with self._lock:
+            if self._adapter is None:
+                if self.tcp_keepalive:
+                    self._adapter = _KeepAliveAdapter(pool_connections=self.pool_connections,
+                                                      pool_maxsize=self.pool_maxsize, pool_block=self.pool_block,
+                                                      max_retries=self.retry())
+                else:
+                    self._adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                                                pool_block=self.pool_block, max_retries=self.retry())
+            return self._adapter
+
+    def session(self, protocol: str = "https") -> Session:
+        """
+            Create a new session which uses the shared connection pool
+        """
+        session = requests.Session()
+        session.mount(f'{protocol}://', self.adapter())
+        if not self.keep_alive:
+            session.headers.update({'Connection': 'close'})
+        return session
+
+    def close(self):
+        """
+            Close all the pooled connections
+        """
+        with self._lock:
+            if self._adapter is not None:
+                self._adapter.close()
+                self._adapter = None
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """
+        HTTPAdapter which turns on TCP keep-alive for pooled connections
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        from urllib3.connection import HTTPConnection
+        import socket
+        options = list(HTTPConnection.default_socket_options) + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        kwargs['socket_options'] = options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _can_replay(kwargs: dict) -> bool:
+    """
+    A request can only be sent again if its body has not been consumed by the first attempt
+    """
+    if kwargs.get('files'):
+        return False
+    data = kwargs.get('data')
+    return not hasattr(data, 'read') and not hasattr(data, '__next__')
+
+
 class AuthenticatedAPI:
     """
         Base class for authenticated calls which need an access token
@@ -738,30 +1116,28 @@ class AuthenticatedAPI:
         :param xml_data:
         :return: dict
         """
-        entity_response = xml.etree.ElementTree.fromstring(xml_data)
-        reference = entity_response.find(f'.//{{{self.xip_ns}}}Ref')
-        title = entity_response.find(f'.//{{{self.xip_ns}}}Title')
-        security_tag = entity_response.find(f'.//{{{self.xip_ns}}}SecurityTag')
-        description = entity_response.find(f'.//{{{self.xip_ns}}}Description')
-        parent = entity_response.find(f'.//{{{self.xip_ns}}}Parent')
-        custom_type = entity_response.find(f'.//{{{self.xip_ns}}}CustomType')
-
-        if hasattr(parent, 'text'):
-            parent = parent.text
-        else:
-            parent = None
+        xip = f'{{{self.xip_ns}}}'
+        entity_response = parse_xml(xml_data)
+        # the entity is the first XIP element in the response, its fields are direct children
+        record = entity_response
+        if not entity_response.tag.startswith(xip):
+            record = next((child for child in entity_response if isinstance(child.tag, str) and
+                           child.tag.startswith(xip)), entity_response)
+        fields = child_fields(record, (f'{xip}Ref', f'{xip}Title', f'{xip}SecurityTag', f'{xip}Description',
+                                       f'{xip}Parent', f'{xip}CustomType'))
 
-        fragments = entity_response.findall(f'.//{{{self.entity_ns}}}Metadata/{{{self.entity_ns}}}Fragment')
         metadata = {}
-        for fragment in fragments:
-            metadata[fragment.text] = fragment.attrib['schema']
+        for metadata_element in find_all(entity_response, f'{{{self.entity_ns}}}Metadata'):
+            for fragment in metadata_element.findall(f'{{{self.entity_ns}}}Fragment'):
+                metadata[fragment.text] = fragment.attrib['schema']
 
-        entity_dict = {'reference': reference.text, 'title': title.text if hasattr(title, 'text') else None,
-                       'description': description.text if hasattr(description, 'text') else None,
-                       'security_tag': security_tag.text, 'parent': parent, 'metadata': metadata}
+        entity_dict = {'reference': fields[f'{xip}Ref'].text, 'title': text_of(fields[f'{xip}Title']),
+                       'description': text_of(fields[f'{xip}Description']),
+                       'security_tag': fields[f'{xip}SecurityTag'].text, 'parent': text_of(fields[f'{xip}Parent']),
+                       'metadata': metadata}
 
-        if hasattr(custom_type, 'text'):
-            entity_dict['CustomType'] = custom_type.text
+        if fields[f'{xip}CustomType'] is not None:
+            entity_dict['CustomType'] = fields[f'{xip}CustomType'].text
 
         return entity_dict
 
@@ -869,12 +1245,100 @@ class AuthenticatedAPI:
             RuntimeError(response.status_code, "Could not generate valid manager approval token")
             return ""
 
+    @property
+    def token(self) -> str:
+        """
+            The current API token, this is renewed automatically shortly before it expires
+        """
+        if self._token_expires is not None and time.monotonic() > self._token_expires:
+            self._renew_token(self._token)
+        return self._token
+
+    @token.setter
+    def token(self, value: str):
+        self._token = value
+
     def __token__(self) -> str:
         """
             Generate am API token to use to authenticate calls
+
+            After a request made by this thread was refused with a 401 the token it used is replaced, unless another
+            thread has already logged in, otherwise the current token is returned.
+            Only one thread logs in at a time, threads which were waiting while
+            another thread logged in use the new token instead of logging in again.
+
+            :return: API Token
+        """
+        if self._token is None:
+            return self._renew_token(None)
+        rejected = getattr(self._auth_state, 'rejected', None)
+        if rejected is None:
+            return self.token
+        self._auth_state.rejected = None
+        token = self._renew_token(rejected)
+        # the request is sent again with this token, a second 401 is raised by _session_request
+        self._auth_state.renewed = token
+        return token
+
+    def _renew_token(self, stale_token: str) -> str:
+        """
+            Replace stale_token with a new API token unless another thread has already done so
+            :return: API Token
+        """
+        with self._token_lock:
+            if self._token is not None and self._token != stale_token:
+                return self._token
+            token = self._login()
+            self._token = token
+            self._token_expires = time.monotonic() + (self._token_valid_for * 60) - TOKEN_REFRESH_MARGIN
+            return token
+
+    def _session_request(self, request, method, url, **kwargs):
+        """
+            Wrapper around the session request method which adds the default timeout.
+
+            If an authenticated request fails with a 401 the token is renewed and the request is sent again once.
+            A request whose body cannot be sent again is left to the caller, which renews the token with __token__
+            and sends it once more. A request which is refused again with the renewed token raises HTTPException.
+        """
+        kwargs.setdefault('timeout', self.transport.timeout)
+        response = request(method, url, **kwargs)
+        if response.status_code != requests.codes.unauthorized:
+            self._auth_state.renewed = None
+            return response
+        headers = kwargs.get('headers')
+        if not headers or HEADER_TOKEN not in headers:
+            return response
+        token = headers[HEADER_TOKEN]
+        if token == getattr(self._auth_state, 'renewed', None):
+            self._auth_state.renewed = None
+            self._refused(method, url, response)
+        if not _can_replay(kwargs):
+            self._auth_state.rejected = token
+            return response
+        token = self._renew_token(token)
+        kwargs['headers'] = {**headers, HEADER_TOKEN: token}
+        response.close()
+        logger.debug(f"Replaying {method} {url} with a new token")
+        response = request(method, url, **kwargs)
+        if response.status_code == requests.codes.unauthorized:
+            self._refused(method, url, response)
+        return response
+
+    @staticmethod
+    def _refused(method, url, response):
+        exception = HTTPException(None, response.status_code, url, "_session_request",
+                                  f"{method} was refused after renewing the access token")
+        logger.error(exception)
+        raise exception
+
+    def _login(self) -> str:
+        """
+            Request a new API token from the server
             :return: API Token
         """
         logger.debug("Token Expired Requesting New Token")
+        self._token_valid_for = TOKEN_VALID_FOR
         if self.shared_secret is False:
             if self.tenant is None:
                 data = {'username': self.username, 'password': self.password, 'includeUserDetails': 'true'}
@@ -884,6 +1348,7 @@ class AuthenticatedAPI:
             if response.status_code == requests.codes.ok:
                 if self.tenant is None:
                     self.tenant = response.json()['tenant']
+                self._token_valid_for = int(response.json().get('validFor', TOKEN_VALID_FOR))
                 return response.json()['token']
             else:
                 if 'message' in response.json():
@@ -903,6 +1368,7 @@ class AuthenticatedAPI:
                                 f'{self.protocol}://{self.server}/api/accesstoken/complete-2fa',
                                 data=data, headers=header)
                             if response_2fa.status_code == requests.codes.ok:
+                                self._token_valid_for = int(response_2fa.json().get('validFor', TOKEN_VALID_FOR))
                                 return response_2fa.json()['token']
                             else:
                                 msg = "Failed to create a 2FA authentication token. Check your credentials are correct"
@@ -942,29 +1408,27 @@ class AuthenticatedAPI:
 
     def __init__(self, username: str = None, password: str = None, tenant: str = None, server: str = None,
                  use_shared_secret: bool = False, two_fa_secret_key: str = None,
-                 protocol: str = "https", request_hook=None, credentials_path: str = 'credentials.properties'):
+                 protocol: str = "https", request_hook=None, credentials_path: str = 'credentials.properties',
+                 transport: TransportConfig = None):
 
         config = configparser.ConfigParser(interpolation=configparser.Interpolation())
         config.read(os.path.relpath(credentials_path), encoding='utf-8')
-        self.session: Session = requests.Session()
-
-        if request_hook is not None:
-            self.session.hooks['response'].append(request_hook)
-
-        retries = Retry(
-            total=3,
-            backoff_factor=0.1,
-            status_forcelist=[502, 503, 504],
-            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS
-        )
-
+        self._token = None
+        self._token_expires = None
+        self._token_valid_for = TOKEN_VALID_FOR
+        self._token_lock = threading.Lock()
+        self._auth_state = threading.local()
         self.shared_secret: bool = bool(use_shared_secret)
         self.protocol = protocol
         self.two_fa_secret_key = two_fa_secret_key
 
-        self.session.mount(f'{self.protocol}://', HTTPAdapter(max_retries=retries))
+        self.transport: TransportConfig = transport if transport is not None else TransportConfig()
+        self.session: Session = self.transport.session(self.protocol)
+
+        if request_hook is not None:
+            self.session.hooks['response'].append(request_hook)
 
-        self.session.request = functools.partial(self.session.request, timeout=TIME_OUT)
+        self.session.request = functools.partial(self._session_request, self.session.request)
 
         if not two_fa_secret_key:
             two_fa_secret_key = os.environ.get('PRESERVICA_2FA_TOKEN')
@@ -14,8 +14,18 @@ from io import BytesIO
 from typing import Generator, Callable, Optional, Union
 from pyPreservica.common import *
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 logger = logging.getLogger(__name__)
 
+LIST_FIELDS = ("xip.parent_hierarchy", "xip.identifier", "xip.set")
+DATE_FIELDS = ("xip.created",)
+
 class SortOrder(Enum):
     asc = 1
     desc = 2
@@ -46,10 +56,11 @@ class ContentAPI(AuthenticatedAPI):
 
     def __init__(self, username: str = None, password: str = None, tenant: str = None, server: str = None,
                  use_shared_secret: bool = False, two_fa_secret_key: str = None,
-                 protocol: str = "https", request_hook: Callable = None, credentials_path: str = 'credentials.properties'):
+                 protocol: str = "https", request_hook: Callable = None, credentials_path: str = 'credentials.properties',
+                 transport: TransportConfig = None):
 
         super().__init__(username, password, tenant, server, use_shared_secret, two_fa_secret_key,
-                         protocol, request_hook, credentials_path)
+                         protocol, request_hook, credentials_path, transport)
         self.callback = None
 
     class SearchResult:
@@ -63,6 +74,49 @@ class ContentAPI(AuthenticatedAPI):
     def search_callback(self, fn):
         self.callback = fn
 
+    def _search_pages(self, search: Callable, page_size: int, prefetch: int) -> Generator:
+        """
+        Return the results of every page of a search
+
+        The total number of hits is known after the first page, so the remaining pages are requested by a pool of
+        prefetch threads while the results are returned in order.
+        The search callback is called from the calling thread as each page is returned, in page order.
+
+        :param search: A function which returns the SearchResult starting at an index
+        :param page_size: The number of results requested per page
+        :param prefetch: The number of pages requested at the same time
+        """
+        def report(start_index: int, result):
+            if self.callback is not None:
+                value = str(f'{len(result.results_list) + start_index}:{result.hits}')
+                self.callback(value)
+
+        search_result = search(0)
+        report(0, search_result)
+        for e in search_result.results_list:
+            yield e
+        # the server may return fewer results per page than were asked for
+        page_length = len(search_result.results_list)
+        if page_length == 0 or search_result.hits <= page_length:
+            return
+        if prefetch > 1:
+            starts = range(page_length, search_result.hits, page_length)
+            for start_index, search_result in zip(starts, concurrent_map(search, starts, max_workers=prefetch,
+                                                                         ordered=True)):
+                report(start_index, search_result)
+                for e in search_result.results_list:
+                    yield e
+        else:
+            found = page_length
+            while search_result.hits > found:
+                search_result = search(found)
+                report(found, search_result)
+                for e in search_result.results_list:
+                    yield e
+                if len(search_result.results_list) == 0:
+                    break
+                found = found + len(search_result.results_list)
+
     def user_security_tags(self, with_permissions: bool = False):
         """
              Return available security tags
@@ -227,7 +281,7 @@ class ContentAPI(AuthenticatedAPI):
             raise RuntimeError(results.status_code, f"indexed_fields failed with error code: {results.status_code}")
 
     def simple_search_csv(self, query: str = "%", page_size: int = 50, csv_file="search.csv",
-                          list_indexes: list = None):
+                          list_indexes: list = None, prefetch: int = 4):
         if list_indexes is None or len(list_indexes) == 0:
             metadata_fields = ["xip.reference", "xip.title", "xip.description", "xip.document_type",
                                "xip.parent_ref", "xip.security_descriptor"]
@@ -238,18 +292,104 @@ class ContentAPI(AuthenticatedAPI):
         with open(csv_file, newline='', mode="wt", encoding="utf-8") as csv_file:
             writer = csv.DictWriter(csv_file, fieldnames=metadata_fields)
             writer.writeheader()
-            writer.writerows(self.simple_search_list(query, page_size, metadata_fields))
+            writer.writerows(self.simple_search_list(query, page_size, metadata_fields, prefetch))
 
-    def simple_search_list(self, query: str = "%", page_size: int = 50, list_indexes: list = None):
-        search_result = self._simple_search(query, 0, page_size, list_indexes)
-        for e in search_result.results_list:
-            yield e
-        found = len(search_result.results_list)
-        while search_result.hits > found:
-            search_result = self._simple_search(query, found, page_size, list_indexes)
-            for e in search_result.results_list:
-                yield e
-            found = found + len(search_result.results_list)
+    def simple_search_parquet(self, query: str = "%", parquet_file: str = "search.parquet", page_size: int = 50,
+                              list_indexes: list = None, prefetch: int = 4, batch_size: int = 10000) -> int:
+        """
+        Run a search query and write the results to a Parquet file, or a Feather file if the name ends in .feather
+
+        The results are written in batches of batch_size rows, so very large result sets use a fixed amount of memory.
+        Requires the pyarrow package.
+
+        :param query: The main search query.
+        :param parquet_file: The output file
+        :param page_size:  The default search page size
+        :param list_indexes:  The indexed fields which are the file columns
+        :param prefetch:  The number of pages requested at the same time
+        :param batch_size:  The number of rows in each record batch
+        :return: The number of rows written
+        """
+        if list_indexes is None or len(list_indexes) == 0:
+            metadata_fields = ["xip.reference", "xip.title", "xip.description", "xip.document_type",
+                               "xip.parent_ref", "xip.security_descriptor"]
+        else:
+            metadata_fields = list(list_indexes)
+        if "xip.reference" not in metadata_fields:
+            metadata_fields.insert(0, "xip.reference")
+        return self._write_columnar(self.simple_search_list(query, page_size, metadata_fields, prefetch),
+                                    metadata_fields, parquet_file, batch_size)
+
+    @staticmethod
+    def _column_type(field: str):
+        if field in LIST_FIELDS or field.startswith("xip.bitstream_names"):
+            return pyarrow.list_(pyarrow.string())
+        if field in DATE_FIELDS:
+            return pyarrow.timestamp("ms", tz="UTC")
+        return pyarrow.string()
+
+    @staticmethod
+    def _column_value(value, column_type):
+        if value is None or value == "":
+            return None
+        if pyarrow.types.is_list(column_type):
+            return [str(v) for v in value] if isinstance(value, list) else [str(value)]
+        if isinstance(value, list):
+            if len(value) == 0:
+                return None
+            value = value[0] if len(value) == 1 else ",".join(str(v) for v in value)
+        if pyarrow.types.is_timestamp(column_type):
+            try:
+                date = parse(str(value))
+            except (ValueError, OverflowError):
+                return None
+            return date if date.tzinfo is not None else date.replace(tzinfo=dateutil.tz.UTC)
+        return str(value)
+
+    def _write_columnar(self, rows, fields: list, filename: str, batch_size: int = 10000) -> int:
+        """
+        Write search results to a Parquet or Feather file one record batch at a time
+        """
+        if pyarrow is None:
+            msg = "Parquet export requires the pyarrow package, install it with: pip install pyarrow"
+            logger.error(msg)
+            raise RuntimeError(msg)
+        schema = pyarrow.schema([(field, self._column_type(field)) for field in fields])
+        if filename.lower().endswith((".feather", ".arrow")):
+            writer = pyarrow.ipc.new_file(filename, schema)
+            write = writer.write_batch
+        else:
+            writer = pyarrow.parquet.ParquetWriter(filename, schema)
+            write = writer.write_batch if hasattr(writer, 'write_batch') else \
+                lambda batch: writer.write_table(pyarrow.Table.from_batches([batch]))
+        columns = [[] for _ in fields]
+        count = 0
+
+        def flush():
+            write(pyarrow.RecordBatch.from_arrays([pyarrow.array(column, type=schema.field(i).type)
+                                                   for i, column in enumerate(columns)], schema=schema))
+            for column in columns:
+                column.clear()
+
+        try:
+            for row in rows:
+                for i, field in enumerate(fields):
+                    columns[i].append(self._column_value(row.get(field), schema.field(i).type))
+                count += 1
+                if count % batch_size == 0:
+                    flush()
+            if count == 0 or count % batch_size:
+                flush()
+        finally:
+            writer.close()
+        return count
+
+    def simple_search_list(self, query: str = "%", page_size: int = 50, list_indexes: list = None,
+                           prefetch: int = 4):
+        def search(start_index: int):
+            return self._simple_search(query, start_index, page_size, list_indexes)
+
+        return self._search_pages(search, page_size, prefetch)
 
     def _simple_search(self, query: str = "%", start_index: int = 0, page_size: int = 10, list_indexes: list = None):
         start_from = str(start_index)
@@ -277,10 +417,6 @@ class ContentAPI(AuthenticatedAPI):
                 results_list.append(results_map)
             next_start = start_index + page_size
 
-            if self.callback is not None:
-                value = str(f'{len(results_list) + start_index}:{hits}')
-                self.callback(value)
-
             search_results = self.SearchResult(metadata, refs, hits, results_list, next_start)
             return search_results
         elif results.status_code == requests.codes.unauthorized:
@@ -292,7 +428,7 @@ class ContentAPI(AuthenticatedAPI):
 
     def search_index_filter_csv(self, query: str = "%", csv_file="search.csv", page_size: int = 50,
                                 filter_values: dict = None,
-                                sort_values: dict = None):
+                                sort_values: dict = None, prefetch: int = 4):
         if filter_values is None:
             filter_values = {}
         if "xip.reference" not in filter_values:
@@ -304,30 +440,57 @@ class ContentAPI(AuthenticatedAPI):
         with open(csv_file, newline='', mode="wt", encoding="utf-8") as csv_file:
             writer = csv.DictWriter(csv_file, fieldnames=header_fields)
             writer.writeheader()
-            writer.writerows(self.search_index_filter_list(query, page_size, filter_values, sort_values))
+            writer.writerows(self.search_index_filter_list(query, page_size, filter_values, sort_values, prefetch))
+
+    def search_index_filter_parquet(self, query: str = "%", parquet_file: str = "search.parquet",
+                                    page_size: int = 50, filter_values: dict = None, sort_values: dict = None,
+                                    prefetch: int = 4, batch_size: int = 10000) -> int:
+        """
+        Run a search query with optional filters and write the results to a Parquet file, or a Feather file if
+        the name ends in .feather
+
+        The results are written in batches of batch_size rows, so very large result sets use a fixed amount of memory.
+        Requires the pyarrow package.
+
+        :param query: The main search query.
+        :param parquet_file: The output file
+        :param page_size:  The default search page size
+        :param filter_values:  Dictionary of index names and values
+        :param sort_values:    Dictionary of sort index names and values
+        :param prefetch:  The number of pages requested at the same time
+        :param batch_size:  The number of rows in each record batch
+        :return: The number of rows written
+        """
+        if filter_values is None:
+            filter_values = {}
+        if "xip.reference" not in filter_values:
+            filter_values["xip.reference"] = ""
 
-    def search_fields(self, query: str = "%",  fields: list[Field]=None,  page_size: int = 25) -> Generator:
+        header_fields = list(filter_values.keys())
+        index = header_fields.index("xip.reference")
+        header_fields.insert(0, header_fields.pop(index))
+        return self._write_columnar(self.search_index_filter_list(query, page_size, filter_values, sort_values,
+                                                                  prefetch), header_fields, parquet_file, batch_size)
+
+    def search_fields(self, query: str = "%",  fields: list[Field]=None,  page_size: int = 25,
+                      prefetch: int = 4) -> Generator:
         """
         Run a search query with multiple fields
 
         :param query: The main search query.
         :param fields:  List of search fields
         :param page_size:  The default search page size
+        :param prefetch:  The number of pages requested at the same time
         :return: search result
         """
 
         if self.major_version < 7 and self.minor_version < 5:
             raise RuntimeError("search_fields API call is not available when connected to a v7.5 System")
 
-        search_result = self._search_fields(query=query, fields=fields, start_index=0, page_size=page_size)
-        for e in search_result.results_list:
-            yield e
-        found = len(search_result.results_list)
-        while search_result.hits > found:
-            search_result = self._search_fields(query=query, fields=fields, start_index=found, page_size=page_size)
-            for e in search_result.results_list:
-                yield e
-            found = found + len(search_result.results_list)
+        def search(start_index: int):
+            return self._search_fields(query=query, fields=fields, start_index=start_index, page_size=page_size)
+
+        yield from self._search_pages(search, page_size, prefetch)
 
     def _search_fields(self, query: str = "%", fields: list[Field]=None, start_index: int = 0, page_size: int = 25):
 
@@ -397,10 +560,6 @@ class ContentAPI(AuthenticatedAPI):
                 results_list.append(results_map)
             next_start = start_index + page_size
 
-            if self.callback is not None:
-                value = str(f'{len(results_list) + start_index}:{hits}')
-                self.callback(value)
-
             search_results = self.SearchResult(metadata, refs, hits, results_list, next_start)
             return search_results
         elif results.status_code == requests.codes.unauthorized:
@@ -411,7 +570,7 @@ class ContentAPI(AuthenticatedAPI):
             raise RuntimeError(results.status_code, f"search_index_filter failed")
 
     def search_index_filter_list(self, query: str = "%", page_size: int = 25, filter_values: dict = None,
-                                 sort_values: dict = None) -> Generator:
+                                 sort_values: dict = None, prefetch: int = 4) -> Generator:
         """
         Run a search query with optional filters
 
@@ -419,17 +578,13 @@ class ContentAPI(AuthenticatedAPI):
         :param page_size:  The default search page size
         :param filter_values:  Dictionary of index names and values
         :param sort_values:    Dictionary of sort index names and values
+        :param prefetch:  The number of pages requested at the same time
         :return: search result
         """
-        search_result = self._search_index_filter(query, 0, page_size, filter_values, sort_values)
-        for e in search_result.results_list:
-            yield e
-        found = len(search_result.results_list)
-        while search_result.hits > found:
-            search_result = self._search_index_filter(query, found, page_size, filter_values, sort_values)
-            for e in search_result.results_list:
-                yield e
-            found = found + len(search_result.results_list)
+        def search(start_index: int):
+            return self._search_index_filter(query, start_index, page_size, filter_values, sort_values)
+
+        return self._search_pages(search, page_size, prefetch)
 
     def search_index_filter_hits(self, query: str = "%", filter_values: dict = None) -> int:
         """
@@ -524,15 +679,11 @@ class ContentAPI(AuthenticatedAPI):
                 results_list.append(results_map)
             next_start = start_index + page_size
 
-            if self.callback is not None:
-                value = str(f'{len(results_list) + start_index}:{hits}')
-                self.callback(value)
-
             search_results = self.SearchResult(metadata, refs, hits, results_list, next_start)
             return search_results
         elif results.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
-            return self._search_index_filter(query, start_index, page_size, filter_values)
+            return self._search_index_filter(query, start_index, page_size, filter_values, sort_values)
         else:
             logger.error(f"search failed with error code: {results.status_code}")
             raise RuntimeError(results.status_code, f"search_index_filter failed")
@@ -9,9 +9,16 @@ licence:    Apache License 2.0
 
 """
 
+import copy
+import csv
+import heapq
 import os.path
+import queue
+import random
+import sqlite3
 import uuid
 import xml.etree.ElementTree
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, timezone
 from io import BytesIO
 from time import sleep
@@ -20,8 +27,814 @@ from typing import Any, Generator, Tuple, Iterable, Union, Callable
 
 from pyPreservica.common import *
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 logger = logging.getLogger(__name__)
 
+EVENT_FIELDS = ('eventType', 'Date', 'User', 'Ref', 'WorkflowName', 'WorkflowInstanceId', 'SerialisedCommand')
+
+
+class TreeWalker:
+    """
+        A multithreaded breadth first walk of the folder hierarchy
+
+        Many folders have their children pages requested at the same time using a bounded pool of worker threads.
+        Entities are passed back to the caller through a bounded queue, so the workers pause when the caller
+        falls behind.
+
+        If ordered is True the entities are returned in the same depth first order as all_descendants(), each
+        folder is returned before its children, and the children lists of upcoming folders are prefetched.
+
+        The walk can be resumed by passing the list returned by checkpoint() back in as the pending argument.
+        Folders which were part way through when the checkpoint was taken are walked again, so some entities may
+        be returned twice after a resume.
+    """
+
+    _DONE = object()
+
+    def __init__(self, client, folder: Union[str, Entity] = None, max_workers: int = 8, max_queued: int = 1000,
+                 ordered: bool = False, pending: list = None, page_size: int = 100):
+        self.client = client
+        self.max_workers = max(1, int(max_workers))
+        self.max_queued = max(1, int(max_queued))
+        self.ordered = bool(ordered)
+        self.page_size = int(page_size)
+        if pending is not None:
+            self.roots = list(pending)
+        elif hasattr(folder, "reference"):
+            self.roots = [folder.reference]
+        else:
+            self.roots = [folder]
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def checkpoint(self) -> list:
+        """
+        Return the references of the folders which have not yet been completely walked.
+
+        None in the list refers to the root of the repository.
+
+        :return: A list of folder references
+        :rtype: list
+        """
+        if self.ordered:
+            raise RuntimeError("checkpoint() is only available for unordered walks")
+        with self._lock:
+            return list(self._pending.keys())
+
+    def _list_children(self, reference: str) -> list:
+        results = []
+        paged_set = self.client.children(reference, maximum=self.page_size, next_page=None)
+        results.extend(paged_set.results)
+        while paged_set.has_more:
+            paged_set = self.client.children(reference, maximum=self.page_size, next_page=paged_set.next_page)
+            results.extend(paged_set.results)
+        return results
+
+    def _put(self, output: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                output.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self) -> Generator[Entity, None, None]:
+        self._stop.clear()
+        if self.ordered:
+            return self._ordered_walk()
+        return self._unordered_walk()
+
+    def _unordered_walk(self) -> Generator[Entity, None, None]:
+        output = queue.Queue(maxsize=self.max_queued)
+        outstanding = [0]
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        walked = set()
+
+        def submit(reference):
+            with self._lock:
+                # a resumed walk can reach the same folder from two pending references
+                if reference in walked:
+                    return
+                walked.add(reference)
+                self._pending[reference] = [0, False]
+                outstanding[0] += 1
+            pool.submit(walk_folder, reference)
+
+        def consumed(reference, finished: bool = False):
+            # a folder stays pending until its listing is complete and all its children have been consumed
+            with self._lock:
+                state = self._pending.get(reference)
+                if state is not None:
+                    if finished:
+                        state[1] = True
+                    else:
+                        state[0] -= 1
+                    if state[1] and state[0] == 0:
+                        del self._pending[reference]
+
+        def walk_folder(reference):
+            try:
+                if self._stop.is_set():
+                    return
+                paged_set = self.client.children(reference, maximum=self.page_size, next_page=None)
+                while True:
+                    for entity in paged_set.results:
+                        with self._lock:
+                            self._pending[reference][0] += 1
+                        if not self._put(output, (reference, entity)):
+                            return
+                        if entity.entity_type == EntityType.FOLDER:
+                            submit(entity.reference)
+                    if not paged_set.has_more or self._stop.is_set():
+                        break
+                    paged_set = self.client.children(reference, maximum=self.page_size,
+                                                     next_page=paged_set.next_page)
+                consumed(reference, finished=True)
+            except Exception as exception:
+                self._put(output, exception)
+            finally:
+                with self._lock:
+                    outstanding[0] -= 1
+                    finished = outstanding[0] == 0
+                if finished:
+                    self._put(output, TreeWalker._DONE)
+
+        if not self.roots:
+            return
+        try:
+            for root in self.roots:
+                submit(root)
+            while True:
+                item = output.get()
+                if item is TreeWalker._DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                reference, entity = item
+                consumed(reference)
+                yield entity
+        finally:
+            self._stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _ordered_walk(self) -> Generator[Entity, None, None]:
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        prefetched = {}
+
+        def fetch(reference):
+            future = prefetched.pop(reference, None)
+            if future is None:
+                future = pool.submit(self._list_children, reference)
+            children = future.result()
+            for child in children:
+                if len(prefetched) >= self.max_queued:
+                    break
+                if child.entity_type == EntityType.FOLDER and child.reference not in prefetched:
+                    prefetched[child.reference] = pool.submit(self._list_children, child.reference)
+            return iter(children)
+
+        try:
+            for root in self.roots:
+                stack = [fetch(root)]
+                while stack:
+                    entity = next(stack[-1], None)
+                    if entity is None:
+                        stack.pop()
+                        continue
+                    yield entity
+                    if entity.entity_type == EntityType.FOLDER:
+                        stack.append(fetch(entity.reference))
+        finally:
+            self._stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _RangedDownload:
+    """
+        Downloads a URL in segments using HTTP Range requests on a pool of worker threads
+
+        Finished segments are recorded in a sidecar state file next to the partial download, so an interrupted
+        download carries on from where it stopped. Servers which ignore Range requests are read as a single stream.
+    """
+
+    def __init__(self, client, url: str, name: str, method_name: str, length: int = None, max_workers: int = 4,
+                 segment_size: int = DOWNLOAD_SEGMENT_SIZE, chunk_size: int = CHUNK_SIZE, retries: int = 5):
+        self.client = client
+        self.url = url
+        self.name = name
+        self.method_name = method_name
+        self.length = length
+        self.max_workers = max(1, int(max_workers))
+        self.segment_size = max(1024 * 1024, int(segment_size))
+        # small reads make the download CPU bound, the chunk size is only a lower limit
+        self.chunk_size = max(int(chunk_size), FIXITY_BLOCK_SIZE)
+        self.retries = retries
+
+    def _get(self, start: int = None, end: int = None):
+        headers = {HEADER_TOKEN: self.client.token}
+        if start is not None:
+            headers['Range'] = f'bytes={start}-{end}'
+        response = self.client.session.get(self.url, headers=headers, stream=True)
+        if response.status_code not in (requests.codes.ok, requests.codes.partial_content):
+            exception = HTTPException(self.name, response.status_code, response.url, self.method_name,
+                                      response.content.decode('utf-8'))
+            response.close()
+            logger.error(exception)
+            raise exception
+        return response
+
+    def _probe(self) -> Tuple[Union[int, None], bool]:
+        """
+        Return the length of the content and whether the server accepts Range requests
+        """
+        with self._get(0, 0) as response:
+            if response.status_code == requests.codes.partial_content:
+                total = response.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+                if total.isdigit():
+                    return int(total), True
+            content_length = response.headers.get('Content-Length', '')
+            return (int(content_length) if content_length.isdigit() else self.length), False
+
+    def _retry(self, attempt: int, ex: Exception) -> int:
+        attempt = attempt + 1
+        if attempt > self.retries:
+            logger.error(ex)
+            raise ex
+        logger.warning(f"Retrying download of {self.name}: {ex}")
+        sleep(min(2 ** attempt, 60))
+        return attempt
+
+    def _segment(self, target, index: int, start: int, end: int) -> int:
+        """
+        Download the bytes start to end inclusive into a file path or memoryview, continuing after dropped connections
+        """
+        position = start
+        attempt = 0
+        handle = open(target, 'r+b') if isinstance(target, str) else None
+        try:
+            while position <= end:
+                try:
+                    with self._get(position, end) as response:
+                        if response.status_code != requests.codes.partial_content:
+                            raise RuntimeError(f"The server did not accept a Range request for {self.name}")
+                        if handle is not None:
+                            handle.seek(position)
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if handle is not None:
+                                handle.write(chunk)
+                            else:
+                                target[position:position + len(chunk)] = chunk
+                            position = position + len(chunk)
+                    if position <= end:
+                        raise requests.exceptions.ChunkedEncodingError(f"Segment {index} of {self.name} ended early")
+                except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.Timeout) as ex:
+                    attempt = self._retry(attempt, ex)
+        finally:
+            if handle is not None:
+                handle.close()
+        return index
+
+    def _segments(self, total: int, done: set) -> list:
+        return [(index, start, min(start + self.segment_size, total) - 1)
+                for index, start in enumerate(range(0, total, self.segment_size)) if index not in done]
+
+    def _stream(self, file) -> int:
+        """
+        Download the content in one request for servers which do not accept Range requests
+        """
+        attempt = 0
+        while True:
+            try:
+                file.seek(0)
+                file.truncate()
+                with self._get() as response:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        file.write(chunk)
+                return file.tell()
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as ex:
+                attempt = self._retry(attempt, ex)
+
+    def to_file(self, filename: str) -> int:
+        """
+        Download into a local file, resuming a previous partial download of the same URL
+
+        :return: The number of bytes downloaded
+        """
+        part_file = f"{filename}.part"
+        state_file = f"{filename}.part.json"
+        state = None
+        if os.path.isfile(state_file) and os.path.isfile(part_file):
+            with open(state_file, 'rt', encoding='utf-8') as fd:
+                state = json.load(fd)
+            if (state.get('url') != self.url or state.get('segment_size') != self.segment_size or
+                    os.path.getsize(part_file) != state.get('length')):
+                state = None
+        if state is None:
+            if self.length == 0:
+                open(filename, 'wb').close()
+                return 0
+            total, ranged = self._probe()
+            if not ranged or total is None:
+                with open(part_file, 'wb') as fd:
+                    total = self._stream(fd)
+                os.replace(part_file, filename)
+                return total
+            state = {'url': self.url, 'length': total, 'segment_size': self.segment_size, 'done': []}
+            with open(part_file, 'wb') as fd:
+                fd.truncate(total)
+        else:
+            logger.info(f"Resuming download of {self.name} into {filename}")
+
+        total = state['length']
+        done = set(state['done'])
+        lock = threading.Lock()
+
+        def save_state():
+            state['done'] = sorted(done)
+            with open(f"{state_file}.tmp", 'wt', encoding='utf-8') as fd:
+                json.dump(state, fd)
+            os.replace(f"{state_file}.tmp", state_file)
+
+        save_state()
+        download = functools.partial(self._segment, part_file)
+        for index in concurrent_map(lambda segment: download(*segment), self._segments(total, done),
+                                    max_workers=self.max_workers):
+            with lock:
+                done.add(index)
+                save_state()
+        os.replace(part_file, filename)
+        os.remove(state_file)
+        return total
+
+    def to_bytes(self) -> BytesIO:
+        """
+        Download into memory
+        """
+        if self.length == 0:
+            return BytesIO()
+        total, ranged = self._probe()
+        if not ranged or total is None:
+            file_bytes = BytesIO()
+            self._stream(file_bytes)
+            file_bytes.seek(0)
+            return file_bytes
+        file_bytes = BytesIO()
+        file_bytes.seek(total - 1)
+        file_bytes.write(b"\0")
+        view = file_bytes.getbuffer()
+        try:
+            download = functools.partial(self._segment, view)
+            for _ in concurrent_map(lambda segment: download(*segment), self._segments(total, set()),
+                                    max_workers=self.max_workers):
+                pass
+        finally:
+            view.release()
+        file_bytes.seek(0)
+        return file_bytes
+
+
+class EntityCache:
+    """
+        A thread safe LRU cache of entities with a time to live
+
+        Entries are kept for ttl seconds, after which they are revalidated with the server using their ETag when the
+        server provided one. The least recently used entries are dropped when the cache holds more than max_size
+        entries.
+
+        The hits, misses, revalidations and evictions counters can be used to tune the size and ttl.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300):
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __str__(self):
+        return f"EntityCache size: {len(self)} hits: {self.hits} misses: {self.misses} " \
+               f"revalidations: {self.revalidations} evictions: {self.evictions}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    @staticmethod
+    def _copy(value):
+        # callers are free to modify the objects they are given, so never hand out the cached instance
+        if isinstance(value, Entity):
+            value = copy.copy(value)
+            if value.metadata is not None:
+                value.metadata = dict(value.metadata)
+            return value
+        if isinstance(value, Bitstream):
+            return copy.copy(value)
+        if isinstance(value, Generation):
+            value = copy.copy(value)
+            value.bitstreams = [copy.copy(bitstream) for bitstream in value.bitstreams]
+            return value
+        if isinstance(value, set):
+            return {EntityCache._copy(v) for v in value}
+        return value
+
+    def stats(self) -> dict:
+        """
+        Return the cache counters
+
+        :return: dict of counters
+        :rtype: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'revalidations': self.revalidations, 'evictions': self.evictions,
+                    'hit_ratio': (self.hits / lookups) if lookups else 0.0}
+
+    def get(self, key: tuple):
+        """
+        Return a copy of the cached value if it has not expired, otherwise None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() > entry[2]:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._copy(entry[0])
+
+    def etag(self, key: tuple) -> Union[str, None]:
+        """
+        Return the ETag of an expired entry so it can be revalidated
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def revalidate(self, key: tuple):
+        """
+        Mark an expired entry as current again after the server returned 304 Not Modified
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry[2] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            self.revalidations += 1
+            return self._copy(entry[0])
+
+    def put(self, key: tuple, value, etag: str = None):
+        """
+        Add a value to the cache
+        """
+        with self._lock:
+            self._entries[key] = [self._copy(value), etag, time.monotonic() + self.ttl]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, reference: str):
+        """
+        Remove an entity from the cache
+        """
+        with self._lock:
+            for path in (IO_PATH, SO_PATH, CO_PATH):
+                self._entries.pop((path, reference), None)
+
+    def invalidate_kind(self, kind: str):
+        """
+        Remove every entry of one kind, for example all the identifier lookups
+        """
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == kind]:
+                del self._entries[key]
+
+    def clear(self):
+        """
+        Remove every entry from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+FINISHED_PROGRESS = ("COMPLETED", "ABORTED", "FAILED", "FINISHED_MIXED_OUTCOME")
+
+
+class ProgressTracker:
+    """
+        Waits for many asynchronous processes at once using a single background thread
+
+        Each process ID is polled with an exponential backoff, starting at initial_delay seconds and growing by
+        backoff up to max_delay seconds, with random jitter so processes started together are not polled together.
+        The polling thread is started when the first process is tracked and stops when there is nothing to wait for.
+        A process which is waited on with different sets of final statuses is still polled only once at a time.
+    """
+
+    def __init__(self, client, initial_delay: float = 0.5, max_delay: float = 30.0, backoff: float = 1.5,
+                 jitter: float = 0.25):
+        self.client = client
+        self.initial_delay = float(initial_delay)
+        self.max_delay = float(max_delay)
+        self.backoff = float(backoff)
+        self.jitter = float(jitter)
+        self.polls = 0
+        self._futures = {}
+        self._schedule = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        with self._condition:
+            return len(self._futures)
+
+    def __str__(self):
+        return f"ProgressTracker waiting: {len(self)} polls: {self.polls}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def _push(self, pid: str, delay: float):
+        self._sequence += 1
+        due = time.monotonic() + delay * random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+        heapq.heappush(self._schedule, (due, self._sequence, pid, delay))
+        self._condition.notify()
+
+    def track(self, pid: str, until: Iterable[str] = None) -> concurrent.futures.Future:
+        """
+        Start waiting for a process to finish
+
+        The returned future is resolved with the final status of the process, or with the exception raised while
+        checking it. Tracking a process ID which is already being tracked with the same statuses returns the same
+        future, tracking it with different statuses returns a new future which shares the polling of the process.
+
+        :param str pid: The progress ID
+        :param until: The statuses which end the wait, by default any status other than ACTIVE
+        :return: A future for the final status
+        :rtype: concurrent.futures.Future
+        """
+        until = None if until is None else frozenset(until)
+        with self._condition:
+            waiting = self._futures.get(pid)
+            if waiting is None:
+                waiting = {}
+                self._futures[pid] = waiting
+                self._push(pid, self.initial_delay)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="ProgressTracker", daemon=True)
+                    self._thread.start()
+            future = waiting.get(until)
+            if future is None:
+                future = concurrent.futures.Future()
+                waiting[until] = future
+            return future
+
+    def wait(self, pids: Iterable[str], timeout: float = None) -> dict:
+        """
+        Block until all the processes have finished
+
+        :param pids: The progress IDs
+        :param float timeout: The maximum number of seconds to wait, None to wait forever
+        :return: A dictionary of progress ID to final status
+        :rtype: dict
+        """
+        futures = {pid: self.track(pid) for pid in pids}
+        deadline = None if timeout is None else time.monotonic() + timeout
+        results = {}
+        for pid, future in futures.items():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            results[pid] = future.result(timeout=remaining)
+        return results
+
+    def _finish(self, pid: str, status: str = None) -> list:
+        """
+        Remove and return the futures of a process which are waiting for status, all of them if status is None
+        """
+        with self._condition:
+            waiting = self._futures[pid]
+            finished = [until for until, future in waiting.items() if future.cancelled() or status is None or
+                        (status != "ACTIVE" if until is None else status in until)]
+            futures = [waiting.pop(until) for until in finished]
+            if not waiting:
+                del self._futures[pid]
+            return [future for future in futures if not future.cancelled()]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._schedule and self._schedule[0][0] > time.monotonic():
+                    self._condition.wait(self._schedule[0][0] - time.monotonic())
+                if not self._schedule:
+                    self._thread = None
+                    return
+                due, sequence, pid, delay = heapq.heappop(self._schedule)
+                waiting = list(self._futures[pid].values())
+            if all(future.cancelled() for future in waiting):
+                self._finish(pid)
+                continue
+            try:
+                status = self.client.get_async_progress(pid)
+                self.polls += 1
+            except Exception as exception:
+                # the exception belongs to whoever is waiting on the future, the poller must keep running
+                for future in self._finish(pid):
+                    future.set_exception(exception)
+                continue
+            logger.debug(f"{pid} {status}")
+            with self._condition:
+                finished = self._finish(pid, status)
+                if pid in self._futures:
+                    self._push(pid, min(delay * self.backoff, self.max_delay))
+            for future in finished:
+                future.set_result(status)
+
+
+class ChangeFeed:
+    """
+        Returns the entities which have changed since the last time the feed was read
+
+        The time of the last complete read is kept as a watermark in a local SQLite file. Each read asks the server
+        only for the entities updated since the watermark, less a small overlap to allow for clock differences, so a
+        regular sync does not download the same window again. The watermark is only moved forward once every change
+        has been returned, and the references returned by an unfinished read are remembered so an interrupted sync
+        carries on without repeating them.
+
+        An entity may be returned again by the next read if it changed during the overlap.
+    """
+
+    def __init__(self, client, path: str, overlap: float = 300, page_size: int = 250, initial_days: int = 1,
+                 enrich: bool = False, max_workers: int = 8):
+        self.client = client
+        self.overlap = timedelta(seconds=overlap)
+        self.page_size = max(1, int(page_size))
+        self.initial_days = initial_days
+        self.enrich = enrich
+        self.max_workers = max_workers
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS watermark (id INTEGER PRIMARY KEY, since TEXT, "
+                                    "started TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS delivered (reference TEXT PRIMARY KEY)")
+            self.connection.execute("INSERT OR IGNORE INTO watermark (id) VALUES (0)")
+
+    def __iter__(self):
+        return self.changes()
+
+    def __str__(self):
+        return f"ChangeFeed watermark: {self.watermark}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def watermark(self) -> Union[datetime, None]:
+        """
+        The time of the last complete read, None if the feed has never been read
+        """
+        row = self.connection.execute("SELECT since FROM watermark WHERE id = 0").fetchone()
+        return datetime.fromisoformat(row[0]) if row[0] else None
+
+    def reset(self, since: datetime = None):
+        """
+        Move the watermark, the next read returns the entities changed since this time
+
+        :param datetime since: The new watermark, None to start again from initial_days ago
+        """
+        if since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        with self.connection:
+            self.connection.execute("UPDATE watermark SET since = ?, started = NULL WHERE id = 0",
+                                    (since.isoformat() if since else None,))
+            self.connection.execute("DELETE FROM delivered")
+
+    def close(self):
+        self.connection.close()
+
+    def _entities(self, since: datetime) -> Generator[Entity, None, None]:
+        seen = set(row[0] for row in self.connection.execute("SELECT reference FROM delivered"))
+        paged_set = self.client._updated_entities_page(maximum=self.page_size, since=since)
+        while True:
+            for entity in paged_set.results:
+                # the paging is by offset, so entities which change during the read can appear on two pages
+                if entity.reference not in seen:
+                    seen.add(entity.reference)
+                    yield entity
+            if not paged_set.has_more:
+                return
+            paged_set = self.client._updated_entities_page(maximum=self.page_size, since=since,
+                                                           next_page=paged_set.next_page)
+
+    def _details(self, entity: Entity) -> Entity:
+        try:
+            return self.client.entity(entity.entity_type, entity.reference)
+        except ReferenceNotFoundException:
+            return entity
+
+    def changes(self) -> Generator[Entity, None, None]:
+        """
+        Return the entities changed since the watermark and move the watermark forward once they have all been read
+
+        If enrich is set the full entity is fetched for each change using max_workers threads, otherwise the
+        entities only have a reference, title and type.
+
+        :return: A generator of entities
+        :rtype: Generator
+        """
+        since, started = self.connection.execute("SELECT since, started FROM watermark WHERE id = 0").fetchone()
+        if started is None:
+            # a new read, anything already in delivered belongs to a previous read which finished
+            started = datetime.now(timezone.utc).isoformat()
+            with self.connection:
+                self.connection.execute("UPDATE watermark SET started = ? WHERE id = 0", (started,))
+                self.connection.execute("DELETE FROM delivered")
+        if since is None:
+            since = datetime.fromisoformat(started) - timedelta(days=self.initial_days)
+        else:
+            since = datetime.fromisoformat(since) - self.overlap
+
+        entities = self._entities(since)
+        if self.enrich:
+            entities = concurrent_map(self._details, entities, max_workers=self.max_workers, ordered=True)
+        pending = []
+        try:
+            for entity in entities:
+                yield entity
+                pending.append((entity.reference,))
+                if len(pending) >= self.page_size:
+                    with self.connection:
+                        self.connection.executemany("INSERT OR IGNORE INTO delivered VALUES (?)", pending)
+                    pending = []
+        finally:
+            with self.connection:
+                self.connection.executemany("INSERT OR IGNORE INTO delivered VALUES (?)", pending)
+        with self.connection:
+            self.connection.execute("UPDATE watermark SET since = ?, started = NULL WHERE id = 0", (started,))
+            self.connection.execute("DELETE FROM delivered")
+
+
+class DownloadStatistics:
+    """
+        Counters for a folder download, updated by the worker threads while the download runs
+    """
+
+    def __init__(self):
+        self.folders = 0
+        self.assets = 0
+        self.bitstreams = 0
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_downloaded = 0
+        self.bytes_skipped = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    @property
+    def elapsed(self) -> float:
+        """
+        The number of seconds since the download started
+        """
+        return time.monotonic() - self.start
+
+    @property
+    def throughput(self) -> float:
+        """
+        The number of bytes downloaded per second
+        """
+        elapsed = self.elapsed
+        return self.bytes_downloaded / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f"Folders: {self.folders} Assets: {self.assets} Bitstreams: {self.bitstreams} " \
+               f"Downloaded: {self.downloaded} Skipped: {self.skipped} Failed: {self.failed} " \
+               f"Bytes: {self.bytes_downloaded} ({self.throughput / (1024 * 1024):.1f} MB/s)"
+
+    def __repr__(self):
+        return self.__str__()
+
 
 class EntityAPI(AuthenticatedAPI):
     """
@@ -36,14 +849,306 @@ class EntityAPI(AuthenticatedAPI):
 
     def __init__(self, username: str = None, password: str = None, tenant: str = None, server: str = None,
                  use_shared_secret: bool = False, two_fa_secret_key: str = None,
-                 protocol: str = "https", request_hook: Callable = None, credentials_path: str = 'credentials.properties'):
+                 protocol: str = "https", request_hook: Callable = None, credentials_path: str = 'credentials.properties',
+                 transport: TransportConfig = None):
 
         super().__init__(username, password, tenant, server, use_shared_secret, two_fa_secret_key,
-                         protocol, request_hook, credentials_path)
+                         protocol, request_hook, credentials_path, transport)
 
         xml.etree.ElementTree.register_namespace("oai_dc", "http://www.openarchives.org/OAI/2.0/oai_dc/")
         xml.etree.ElementTree.register_namespace("ead", "urn:isbn:1-931666-22-9")
 
+        self.cache: Union[EntityCache, None] = None
+        # the bitstream at a URL never changes, so bitstreams are always cached and never expire
+        self.bitstream_cache = EntityCache(max_size=10000, ttl=float('inf'))
+        self.progress_tracker = ProgressTracker(self)
+
+    def enable_cache(self, max_size: int = 10000, ttl: float = 300) -> EntityCache:
+        """
+        Cache the results of asset(), folder(), content_object(), entity() and identifier() lookups
+
+        Cached entities are removed when they are changed through this client, for example by save(), move(),
+        security_tag_sync(), add_metadata() or delete_asset(). Changes made by other clients are only seen after
+        the entry expires.
+
+        :param int max_size: The maximum number of cached entries
+        :param float ttl: The number of seconds before an entry is checked with the server again
+        :return: The cache, which holds the hit and miss counters
+        :rtype: EntityCache
+        """
+        self.cache = EntityCache(max_size=max_size, ttl=ttl)
+        return self.cache
+
+    def disable_cache(self):
+        """
+        Stop caching entity lookups
+        """
+        self.cache = None
+
+    @staticmethod
+    def _fetch_all(function: Callable, items: Iterable, max_workers: int = 8) -> list:
+        """
+        Call function on each item concurrently and return the results in the same order
+        """
+        items = list(items)
+        if len(items) < 2 or max_workers < 2:
+            return [function(item) for item in items]
+        return list(concurrent_map(function, items, max_workers=max_workers, ordered=True))
+
+    @staticmethod
+    def _split_workers(max_workers: int, count: int) -> tuple:
+        """
+        Share max_workers between a fan-out over count items and the requests made for each item
+        """
+        outer = max(1, min(max_workers, count))
+        return outer, max(1, max_workers // outer)
+
+    def _invalidate_cache(self, entity: Entity):
+        if self.cache is not None and entity is not None:
+            self.cache.invalidate(entity.reference)
+
+    def _invalidate_identifiers(self):
+        if self.cache is not None:
+            self.cache.invalidate_kind('identifier')
+
+    def _invalidate_when_done(self, pid: str, entity: Entity = None, kind: str = None, until: Iterable[str] = None):
+        """
+        Remove cached entries now and again when an asynchronous process has finished
+
+        The server applies the change after the request returns, so an entry read back into the cache while the
+        process is running would otherwise be served until it expires.
+        """
+        cache = self.cache
+        if cache is None:
+            return
+
+        def invalidate(future=None):
+            if entity is not None:
+                cache.invalidate(entity.reference)
+            if kind is not None:
+                cache.invalidate_kind(kind)
+
+        invalidate()
+        self.progress_tracker.track(pid, until).add_done_callback(invalidate)
+
+    def _fetch_entity(self, entity_class, path: str, reference: str, method_name: str) -> EntityT:
+        """
+        Fetch a single entity by reference, using the cache if it is enabled
+        """
+        cache = self.cache
+        key = (path, reference)
+        headers = {HEADER_TOKEN: self.token}
+        if cache is not None:
+            entity = cache.get(key)
+            if entity is not None:
+                return entity
+            etag = cache.etag(key)
+            if etag is not None:
+                headers['If-None-Match'] = etag
+        request = self.session.get(f'{self.protocol}://{self.server}/api/entity/{path}/{reference}', headers=headers)
+        if request.status_code == requests.codes.not_modified and cache is not None:
+            entity = cache.revalidate(key)
+            if entity is not None:
+                return entity
+            return self._fetch_entity(entity_class, path, reference, method_name)
+        if request.status_code == requests.codes.ok:
+            entity = self._entity_from_xml(entity_class, request.content)
+            if cache is not None:
+                cache.put(key, entity, request.headers.get('ETag'))
+            return entity
+        elif request.status_code == requests.codes.unauthorized:
+            self.token = self.__token__()
+            return self._fetch_entity(entity_class, path, reference, method_name)
+        elif request.status_code == requests.codes.not_found:
+            exception = ReferenceNotFoundException(reference, request.status_code, request.url, method_name)
+            logger.error(exception)
+            raise exception
+        else:
+            exception = HTTPException(reference, request.status_code, request.url, method_name,
+                                      request.content.decode('utf-8'))
+            logger.error(exception)
+            raise exception
+
+    def _entity_from_xml(self, entity_class, xml_response: Union[bytes, str]) -> EntityT:
+        """
+        Build an Asset, Folder or ContentObject from an entity XML document
+        """
+        entity = self.entity_from_string(xml_response)
+        result = entity_class(entity['reference'], entity['title'], entity['description'],
+                              entity['security_tag'], entity['parent'], entity['metadata'])
+        if 'CustomType' in entity:
+            result.custom_type = entity['CustomType']
+        return result
+
+    def _identifiers_from_xml(self, xml_response: Union[bytes, str]) -> set[Tuple]:
+        """
+        Parse the identifiers of an entity into a set of (type, value) tuples
+        """
+        entity_response = parse_xml(xml_response)
+        identifier_list = find_all(entity_response, f'{{{self.xip_ns}}}Identifier')
+        result = set()
+        for identifier in identifier_list:
+            identifier_value = identifier_type = ""
+            for child in identifier:
+                if child.tag.endswith("Type"):
+                    identifier_type = child.text
+                if child.tag.endswith("Value"):
+                    identifier_value = child.text
+            result.add(tuple((identifier_type, identifier_value)))
+        return result
+
+    def _entities_by_identifier_from_xml(self, xml_response: Union[bytes, str]) -> set[EntityT]:
+        """
+        Parse the lightweight entities returned by an identifier lookup
+        """
+        entity_response = parse_xml(xml_response)
+        entity_list = find_all(entity_response, f'{{{self.entity_ns}}}Entity')
+        result = set()
+        for entity in entity_list:
+            if entity.attrib['type'] == EntityType.FOLDER.value:
+                folder = Folder(entity.attrib['ref'], entity.attrib['title'], None, None, None, None)
+                result.add(folder)
+            elif entity.attrib['type'] == EntityType.ASSET.value:
+                asset = Asset(entity.attrib['ref'], entity.attrib['title'], None, None, None, None)
+                result.add(asset)
+            elif entity.attrib['type'] == EntityType.CONTENT_OBJECT.value:
+                co = ContentObject(entity.attrib['ref'], entity.attrib['title'], None, None, None, None)
+                result.add(co)
+        return result
+
+    def _children_from_xml(self, xml_response: Union[bytes, str], folder_reference: str) -> PagedSet:
+        """
+        Parse a page of folder children
+        """
+        entity_response = parse_xml(xml_response)
+        children = find_all(entity_response, f'{{{self.entity_ns}}}Child')
+        result = set()
+        next_url = find_first(entity_response, f'{{{self.entity_ns}}}Next')
+        total_hits = find_first(entity_response, f'{{{self.entity_ns}}}TotalResults')
+        for child in children:
+            if child.attrib['type'] == EntityType.FOLDER.value:
+                folder = Folder(child.attrib['ref'], child.attrib['title'], None, None, folder_reference, None)
+                result.add(folder)
+            else:
+                asset = Asset(child.attrib['ref'], child.attrib['title'], None, None, folder_reference, None)
+                result.add(asset)
+        has_more = True
+        url = None
+        if next_url is None:
+            has_more = False
+        else:
+            url = next_url.text
+        return PagedSet(result, has_more, int(total_hits.text), url)
+
+    def _representations_from_xml(self, asset: Asset, xml_response: Union[bytes, str]) -> set[Representation]:
+        """
+        Parse the representations of an asset
+        """
+        entity_response = parse_xml(xml_response)
+        representations = find_all(entity_response, f'{{{self.entity_ns}}}Representation')
+        result = set()
+        for r in representations:
+            representation = Representation(asset, r.get('type'), r.get("name", None), r.text)
+            result.add(representation)
+        return result
+
+    def _content_object_refs_from_xml(self, xml_response: Union[bytes, str]) -> list[str]:
+        """
+        Parse the content object references of a representation
+        """
+        entity_response = parse_xml(xml_response)
+        return [content_object.text
+                for representation in find_all(entity_response, f'{{{self.xip_ns}}}Representation')
+                for content_objects in representation.findall(f'{{{self.xip_ns}}}ContentObjects')
+                for content_object in content_objects.findall(f'{{{self.xip_ns}}}ContentObject')]
+
+    def _generation_urls_from_xml(self, xml_response: Union[bytes, str]) -> list[str]:
+        """
+        Parse the generation URLs of a content object
+        """
+        entity_response = parse_xml(xml_response)
+        return [g.text for g in find_all(entity_response, f'{{{self.entity_ns}}}Generation')]
+
+    def _generation_from_xml(self, xml_response: Union[bytes, str], url: str) -> Tuple[Generation, list[str]]:
+        """
+        Parse a generation document
+
+        Returns the generation with an empty bitstream list and the URLs of its bitstreams
+        """
+        xip = f'{{{self.xip_ns}}}'
+        entity_response = parse_xml(xml_response)
+        ge = find_first(entity_response, f'{xip}Generation')
+        fields = child_fields(ge, (f'{xip}FormatGroup', f'{xip}EffectiveDate'))
+        format_group = fields[f'{xip}FormatGroup']
+        effective_date = fields[f'{xip}EffectiveDate']
+
+        format_tags = (f'{xip}PUID', f'{xip}Priority', f'{xip}IdentificationMethod', f'{xip}FormatName',
+                       f'{xip}FormatVersion')
+        formats_list = []
+        for formats in find_all(entity_response, f'{xip}Formats'):
+            for tech_format in formats.findall(f'{xip}Format'):
+                format_fields = child_fields(tech_format, format_tags)
+                format_dict = {'Valid': tech_format.attrib['valid'],
+                               'PUID': text_of(format_fields[f'{xip}PUID']),
+                               'Priority': text_of(format_fields[f'{xip}Priority']),
+                               'IdentificationMethod': text_of(format_fields[f'{xip}IdentificationMethod']),
+                               'FormatName': text_of(format_fields[f'{xip}FormatName']),
+                               'FormatVersion': text_of(format_fields[f'{xip}FormatVersion'])}
+                formats_list.append(format_dict)
+
+        index = int(url.rsplit("/", 1)[-1])
+
+        property_tags = (f'{xip}PUID', f'{xip}PropertyName', f'{xip}Value')
+        property_set = []
+        for properties in find_all(entity_response, f'{xip}Properties'):
+            for tech_props in properties.findall(f'{xip}Property'):
+                property_fields = child_fields(tech_props, property_tags)
+                tech_props_dict = {'PUID': text_of(property_fields[f'{xip}PUID']),
+                                   'PropertyName': text_of(property_fields[f'{xip}PropertyName']),
+                                   'Value': text_of(property_fields[f'{xip}Value'])}
+                property_set.append(tech_props_dict)
+
+        bitstreams = [bitstream for bitstreams in entity_response.findall(f'{{{self.entity_ns}}}Bitstreams')
+                      for bitstream in bitstreams.findall(f'{{{self.entity_ns}}}Bitstream')]
+        generation = Generation(strtobool(ge.attrib['original']), strtobool(ge.attrib['active']),
+                                text_of(format_group), text_of(effective_date), [])
+        generation.formats = formats_list
+        generation.properties = property_set
+        generation.gen_index = index
+        return generation, [bit.text for bit in bitstreams]
+
+    def _bitstream_from_xml(self, xml_response: Union[bytes, str], url: str) -> Bitstream:
+        """
+        Parse a bitstream document
+        """
+        xip = f'{{{self.xip_ns}}}'
+        entity_response = parse_xml(xml_response)
+        record = find_first(entity_response, f'{xip}Bitstream')
+        fields = child_fields(record if record is not None else entity_response, (f'{xip}Filename', f'{xip}FileSize'))
+        filename = fields[f'{xip}Filename']
+        filesize = fields[f'{xip}FileSize']
+        fixity_values = find_all(entity_response, f'{xip}Fixity')
+        content = find_first(entity_response, f'{{{self.entity_ns}}}Content')
+
+        index = int(url.rsplit("/", 1)[-1])
+
+        fixity = {}
+        for f in fixity_values:
+            fixity[f[0].text] = f[1].text
+        bitstream = Bitstream(text_of(filename), int(filesize.text) if filesize is not None else None, fixity,
+                              text_of(content))
+
+        bitstream.bs_index = index
+        return bitstream
+
+    def _metadata_from_xml(self, xml_response: str) -> str:
+        """
+        Extract the metadata fragment from a metadata document
+        """
+        entity_response = xml.etree.ElementTree.fromstring(xml_response)
+        content = entity_response.find(f'.//{{{self.xip_ns}}}Content')
+        return xml.etree.ElementTree.tostring(content[0], encoding='utf-8', method='xml').decode('utf-8')
+
     def user_security_tags(self, with_permissions: bool = False) -> dict:
         """
              Return  security tags available for the  current user
@@ -85,16 +1190,22 @@ class EntityAPI(AuthenticatedAPI):
                 logger.error(exception)
                 raise exception
 
-    def bitstream_bytes(self, bitstream: Bitstream, chunk_size: int = CHUNK_SIZE) -> Union[BytesIO, None]:
+    def bitstream_bytes(self, bitstream: Bitstream, chunk_size: int = CHUNK_SIZE, max_workers: int = 4,
+                        segment_size: int = DOWNLOAD_SEGMENT_SIZE, verify_fixity: bool = False) -> Union[BytesIO, None]:
         """
         Download a file represented as a Bitstream to a byteIO array
 
+        Large bitstreams are downloaded in segments of segment_size bytes using up to max_workers connections.
+
         Returns the byteIO
-        Returns None if the file does not contain the correct number of bytes (default 2k)
+        Returns None if the file does not contain the correct number of bytes or the fixity does not match
 
         :param chunk_size: The buffer copy chunk size in bytes default
         :param bitstream: A Bitstream object
         :type bitstream: Bitstream
+        :param max_workers: The number of segments to download at the same time
+        :param segment_size: The size in bytes of each segment
+        :param verify_fixity: Check the downloaded bytes against the fixity values held by Preservica
 
         :return: The file in bytes
         :rtype: byteIO
@@ -102,26 +1213,39 @@ class EntityAPI(AuthenticatedAPI):
         if not isinstance(bitstream, Bitstream):
             logger.error("bitstream_content argument is not a Bitstream object")
             raise RuntimeError("bitstream_bytes argument is not a Bitstream object")
-        with self.session.get(bitstream.content_url, headers={HEADER_TOKEN: self.token}, stream=True) as response:
-            if response.status_code == requests.codes.unauthorized:
-                self.token = self.__token__()
-                return self.bitstream_bytes(bitstream)
-            elif response.status_code == requests.codes.ok:
-                file_bytes = BytesIO()
-                for chunk in response.iter_content(chunk_size=chunk_size):
-                    file_bytes.write(chunk)
-                file_bytes.seek(0)
-                if file_bytes.getbuffer().nbytes == bitstream.length:
-                    logger.debug(f"Downloaded {bitstream.length} bytes from {bitstream.filename}")
-                    return file_bytes
-                else:
-                    logger.error("Downloaded file size did not match the Preservica held value")
-                    return None
-            else:
-                exception = HTTPException(bitstream.filename, response.status_code, response.url, "bitstream_bytes",
-                                          response.content.decode('utf-8'))
-                logger.error(exception)
-                raise exception
+        download = _RangedDownload(self, bitstream.content_url, bitstream.filename, "bitstream_bytes", bitstream.length,
+                                   max_workers=max_workers, segment_size=segment_size, chunk_size=chunk_size)
+        file_bytes = download.to_bytes()
+        if file_bytes.getbuffer().nbytes != bitstream.length:
+            logger.error("Downloaded file size did not match the Preservica held value")
+            return None
+        if verify_fixity and not self._fixity_matches(bitstream, file_bytes):
+            return None
+        logger.debug(f"Downloaded {bitstream.length} bytes from {bitstream.filename}")
+        return file_bytes
+
+    def _fixity_matches(self, bitstream: Bitstream, content: Union[str, BytesIO]) -> bool:
+        """
+        Check a downloaded file or buffer against the fixity values of the bitstream in a single read
+        """
+        fixity = {str(k).upper().replace("-", ""): str(v).lower() for k, v in (bitstream.fixity or {}).items()}
+        algorithms = [algorithm for algorithm in fixity if algorithm in FIXITY_ALGORITHMS]
+        if not algorithms:
+            logger.warning(f"No supported fixity values to check for {bitstream.filename}")
+            return True
+        if isinstance(content, BytesIO):
+            buffer = content.getbuffer()
+            try:
+                values = {algorithm: FIXITY_ALGORITHMS[algorithm](buffer).hexdigest() for algorithm in algorithms}
+            finally:
+                buffer.release()
+        else:
+            values = MultiFileHash(algorithms)(content)
+        for algorithm in algorithms:
+            if values[algorithm] != fixity[algorithm]:
+                logger.error(f"{algorithm} fixity of {bitstream.filename} did not match the Preservica held value")
+                return False
+        return True
 
     def bitstream_location(self, bitstream: Bitstream) -> list:
         """"
@@ -161,12 +1285,18 @@ class EntityAPI(AuthenticatedAPI):
 
 
 
-    def bitstream_content(self, bitstream: Bitstream, filename: str, chunk_size: int = CHUNK_SIZE) -> Union[int, None]:
+    def bitstream_content(self, bitstream: Bitstream, filename: str, chunk_size: int = CHUNK_SIZE,
+                          max_workers: int = 4, segment_size: int = DOWNLOAD_SEGMENT_SIZE,
+                          verify_fixity: bool = False) -> Union[int, None]:
         """
         Download a file represented as a Bitstream to a local filename
 
+        Large bitstreams are downloaded in segments of segment_size bytes using up to max_workers connections.
+        The download is written to filename.part and the finished segments are recorded in filename.part.json, if
+        the download is interrupted calling this method again continues from the last finished segment.
+
         Returns the number of bytes written to the file
-        Returns None if the file does not contain the correct number of bytes
+        Returns None if the file does not contain the correct number of bytes or the fixity does not match
 
         :param chunk_size: The buffer copy chunk size in bytes default
         :param bitstream: A Bitstream object
@@ -175,6 +1305,10 @@ class EntityAPI(AuthenticatedAPI):
         :param filename: The filename to write the bytes to
         :type filename: str
 
+        :param max_workers: The number of segments to download at the same time
+        :param segment_size: The size in bytes of each segment
+        :param verify_fixity: Check the downloaded file against the fixity values held by Preservica
+
         :return: The size of the file in bytes
         :rtype: int
 
@@ -183,32 +1317,25 @@ class EntityAPI(AuthenticatedAPI):
         if not isinstance(bitstream, Bitstream):
             logger.error("bitstream_content argument is not a Bitstream object")
             raise RuntimeError("bitstream_content argument is not a Bitstream object")
-        with self.session.get(bitstream.content_url, headers={HEADER_TOKEN: self.token}, stream=True) as request:
-            if request.status_code == requests.codes.unauthorized:
-                self.token = self.__token__()
-                return self.bitstream_content(bitstream, filename)
-            elif request.status_code == requests.codes.ok:
-                with open(filename, 'wb') as file:
-                    for chunk in request.iter_content(chunk_size=chunk_size):
-                        file.write(chunk)
-                    file.flush()
-                if os.path.getsize(filename) == bitstream.length:
-                    logger.debug(f"Downloaded {bitstream.length} bytes into {filename}")
-                    return bitstream.length
-                else:
-                    logger.error("Download file size did not match the Preservica held value")
-                    os.remove(filename)
-                    return None
-            else:
-                exception = HTTPException(bitstream.filename, request.status_code, request.url, "bitstream_content",
-                                          request.content.decode('utf-8'))
-                logger.error(exception)
-                raise exception
+        download = _RangedDownload(self, bitstream.content_url, bitstream.filename, "bitstream_content",
+                                   bitstream.length, max_workers=max_workers, segment_size=segment_size,
+                                   chunk_size=chunk_size)
+        download.to_file(filename)
+        if os.path.getsize(filename) != bitstream.length:
+            logger.error("Download file size did not match the Preservica held value")
+            os.remove(filename)
+            return None
+        if verify_fixity and not self._fixity_matches(bitstream, filename):
+            os.remove(filename)
+            return None
+        logger.debug(f"Downloaded {bitstream.length} bytes into {filename}")
+        return bitstream.length
 
     def download_opex(self, pid: str) -> str:
         """
         Download a completed OPEX export using the workflow process ID
 
+        Large exports are downloaded in segments on several connections and an interrupted download is resumed.
 
         :param pid: A process id which identifiers the export workflow
         :type pid: str
@@ -217,24 +1344,11 @@ class EntityAPI(AuthenticatedAPI):
         :rtype: str
 
         """
-        headers = {HEADER_TOKEN: self.__token__(), 'Content-Type': 'application/xml;charset=UTF-8'}
-        download = self.session.get(f'{self.protocol}://{self.server}/api/entity/actions/exports/{pid}/content',
-                                    stream=True, headers=headers)
-        if download.status_code == requests.codes.ok:
-            with open(f'{pid}.zip', 'wb') as file:
-                for chunk in download.iter_content(chunk_size=CHUNK_SIZE):
-                    file.write(chunk)
-                file.flush()
-            logger.debug(f"Downloaded open package into {pid}.zip")
-            return f'{pid}.zip'
-        elif download.status_code == requests.codes.unauthorized:
-            self.token = self.__token__()
-            return self.download_opex(pid)
-        else:
-            exception = HTTPException(pid, download.status_code, download.url, "download_opex",
-                                      download.content.decode('utf-8'))
-            logger.error(exception)
-            raise exception
+        download = _RangedDownload(self, f'{self.protocol}://{self.server}/api/entity/actions/exports/{pid}/content',
+                                   pid, "download_opex")
+        download.to_file(f'{pid}.zip')
+        logger.debug(f"Downloaded open package into {pid}.zip")
+        return f'{pid}.zip'
 
     def __export_opex_start__(self, entity: Entity, **kwargs) -> str:
         """
@@ -360,11 +1474,8 @@ class EntityAPI(AuthenticatedAPI):
         :rtype: str
 
         """
-        status = "ACTIVE"
         pid = self.__export_opex_start__(entity, **kwargs)
-        while status == "ACTIVE":
-            status = self.get_async_progress(pid)
-            logger.debug(status)
+        status = self.track_progress(pid).result()
         if status == "COMPLETED":
             return self.download_opex(pid)
         else:
@@ -464,7 +1575,6 @@ class EntityAPI(AuthenticatedAPI):
         :return: entity
         :rtype: Entity
         """
-
         if (self.major_version < 7) and (self.minor_version < 1):
             raise RuntimeError("delete_identifiers API call is not available when connected to a v6.0 System")
 
@@ -495,7 +1605,7 @@ class EntityAPI(AuthenticatedAPI):
                         self.token = self.__token__()
                         return self.delete_identifiers(entity, identifier_type, identifier_value)
                     if del_req.status_code == requests.codes.no_content:
-                        pass
+                        self._invalidate_identifiers()
                     else:
                         return None
             return entity
@@ -567,20 +1677,10 @@ class EntityAPI(AuthenticatedAPI):
             f'{self.protocol}://{self.server}/api/entity/{entity.path}/{entity.reference}/identifiers',
             headers=headers)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            identifier_list = entity_response.findall(f'.//{{{self.xip_ns}}}Identifier')
-            result = set()
-            for identifier in identifier_list:
-                identifier_value = identifier_type = ""
-                for child in identifier:
-                    if child.tag.endswith("Type"):
-                        identifier_type = child.text
-                    if child.tag.endswith("Value"):
-                        identifier_value = child.text
-                result.add(tuple((identifier_type, identifier_value)))
-            return result
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            xml_response = request.content
+            return self._identifiers_from_xml(xml_response)
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.identifiers_for_entity(entity)
@@ -599,27 +1699,24 @@ class EntityAPI(AuthenticatedAPI):
         :return: Set of entity objects which have a reference and title attribute
         :rtype: set(Entity)
           """
+        cache = self.cache
+        key = ('identifier', identifier_type, identifier_value)
+        if cache is not None:
+            entities = cache.get(key)
+            if entities is not None:
+                return entities
         headers = {HEADER_TOKEN: self.token}
         payload = {'type': identifier_type, 'value': identifier_value}
         request = self.session.get(f'{self.protocol}://{self.server}/api/entity/entities/by-identifier', params=payload,
                                    headers=headers)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            entity_list = entity_response.findall(f'.//{{{self.entity_ns}}}Entity')
-            result = set()
-            for entity in entity_list:
-                if entity.attrib['type'] == EntityType.FOLDER.value:
-                    folder = Folder(entity.attrib['ref'], entity.attrib['title'], None, None, None, None)
-                    result.add(folder)
-                elif entity.attrib['type'] == EntityType.ASSET.value:
-                    asset = Asset(entity.attrib['ref'], entity.attrib['title'], None, None, None, None)
-                    result.add(asset)
-                elif entity.attrib['type'] == EntityType.CONTENT_OBJECT.value:
-                    co = ContentObject(entity.attrib['ref'], entity.attrib['title'], None, None, None, None)
-                    result.add(co)
-            return result
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            xml_response = request.content
+            entities = self._entities_by_identifier_from_xml(xml_response)
+            if cache is not None:
+                cache.put(key, entities)
+            return entities
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.identifier(identifier_type, identifier_value)
@@ -639,7 +1736,6 @@ class EntityAPI(AuthenticatedAPI):
         :return: An internal id for this external identifier
         :rtype: str
         """
-
         if self.major_version < 7 and self.minor_version < 1:
             raise RuntimeError("add_identifier API call is not available when connected to a v6.0 System")
 
@@ -655,6 +1751,7 @@ class EntityAPI(AuthenticatedAPI):
         request = self.session.post(f'{self.protocol}://{self.server}/api/entity{end_point}', data=xml_request,
                                     headers=headers)
         if request.status_code == requests.codes.ok:
+            self._invalidate_identifiers()
             xml_string = str(request.content.decode("utf-8"))
             identifier_response = xml.etree.ElementTree.fromstring(xml_string)
             aip_id = identifier_response.find(f'.//{{{self.xip_ns}}}ApiId')
@@ -681,7 +1778,6 @@ class EntityAPI(AuthenticatedAPI):
              :param identifier_type: The type of the identifier to delete.
              :param identifier_value: The value of the identifier to delete.
           """
-
         if (self.major_version < 7) and (self.minor_version < 1):
             raise RuntimeError("update_identifiers API call is not available when connected to a v6.0 System")
 
@@ -719,6 +1815,7 @@ class EntityAPI(AuthenticatedAPI):
                         f'{self.protocol}://{self.server}/api/entity/{entity.path}/{entity.reference}/identifiers/{_aipid}',
                         headers=headers, data=xml_request)
                     if put_response.status_code == requests.codes.ok:
+                        self._invalidate_identifiers()
                         xml_string = str(put_response.content.decode("utf-8"))
                         identifier_response = xml.etree.ElementTree.fromstring(xml_string)
                         aip_id = identifier_response.find(f'.//{{{self.xip_ns}}}ApiId')
@@ -730,7 +1827,7 @@ class EntityAPI(AuthenticatedAPI):
                         self.token = self.__token__()
                         return self.update_identifiers(entity, identifier_type, identifier_value)
                     if put_response.status_code == requests.codes.no_content:
-                        pass
+                        self._invalidate_identifiers()
                     else:
                         return None
             return entity
@@ -936,13 +2033,12 @@ class EntityAPI(AuthenticatedAPI):
         :return: The updated Entity
         :rtype: Entity
         """
-
         headers = {HEADER_TOKEN: self.token}
         for url in entity.metadata:
             if schema == entity.metadata[url]:
                 request = self.session.delete(url, headers=headers)
                 if request.status_code == requests.codes.no_content:
-                    pass
+                    self._invalidate_cache(entity)
                 elif request.status_code == requests.codes.unauthorized:
                     self.token = self.__token__()
                     return self.delete_metadata(entity, schema)
@@ -1028,6 +2124,7 @@ class EntityAPI(AuthenticatedAPI):
                                               request.content.decode('utf-8'))
                     logger.error(exception)
                     raise exception
+        self._invalidate_cache(entity)
         return self.entity(entity.entity_type, entity.reference)
 
     def add_metadata_as_fragment(self, entity: EntityT, schema: str, xml_fragment: str) -> EntityT:
@@ -1056,6 +2153,7 @@ class EntityAPI(AuthenticatedAPI):
         request = self.session.post(f'{self.protocol}://{self.server}/api/entity{end_point}', data=xml_doc,
                                     headers=headers)
         if request.status_code == requests.codes.ok:
+            self._invalidate_cache(entity)
             return self.entity(entity_type=entity.entity_type, reference=entity.reference)
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
@@ -1096,6 +2194,7 @@ class EntityAPI(AuthenticatedAPI):
         request = self.session.post(f'{self.protocol}://{self.server}/api/entity{end_point}', data=xml_request,
                                     headers=headers)
         if request.status_code == requests.codes.ok:
+            self._invalidate_cache(entity)
             return self.entity(entity_type=entity.entity_type, reference=entity.reference)
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
@@ -1116,7 +2215,6 @@ class EntityAPI(AuthenticatedAPI):
         :return: The updated entity
         :rtype: Entity
         """
-
         headers = {HEADER_TOKEN: self.token, 'Content-Type': 'application/xml;charset=UTF-8'}
 
         xml_object = xml.etree.ElementTree.Element(entity.tag, {"xmlns": self.xip_ns})
@@ -1136,6 +2234,7 @@ class EntityAPI(AuthenticatedAPI):
         request = self.session.put(f'{self.protocol}://{self.server}/api/entity/{entity.path}/{entity.reference}',
                                    data=xml_request, headers=headers)
         if request.status_code == requests.codes.ok:
+            self._invalidate_cache(entity)
             xml_response = str(request.content.decode('utf-8'))
             response = self.entity_from_string(xml_response)
             if isinstance(entity, Asset):
@@ -1196,7 +2295,9 @@ class EntityAPI(AuthenticatedAPI):
             f'{self.protocol}://{self.server}/api/entity/{entity.path}/{entity.reference}/parent-ref',
             data=data, headers=headers)
         if request.status_code == requests.codes.accepted:
-            return request.content.decode()
+            pid = request.content.decode()
+            self._invalidate_when_done(pid, entity)
+            return pid
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.move_async(entity, dest_folder)
@@ -1206,6 +2307,29 @@ class EntityAPI(AuthenticatedAPI):
             logger.error(exception)
             raise exception
 
+    def track_progress(self, pid: str) -> concurrent.futures.Future:
+        """
+        Return a future which is resolved with the final status of an asynchronous process
+
+        All tracked processes are polled by a single background thread with an increasing delay between checks.
+
+        :param str pid: The progress ID
+        :return: A future for the final status
+        :rtype: concurrent.futures.Future
+        """
+        return self.progress_tracker.track(pid)
+
+    def wait_for_progress(self, pids: Iterable[str], timeout: float = None) -> dict:
+        """
+        Block until all the asynchronous processes have finished
+
+        :param pids: The progress IDs returned by calls such as move_async() or security_tag_async()
+        :param float timeout: The maximum number of seconds to wait, None to wait forever
+        :return: A dictionary of progress ID to final status
+        :rtype: dict
+        """
+        return self.progress_tracker.wait(pids, timeout=timeout)
+
     def get_progress(self, pid: str) -> AsyncProgress:
         return AsyncProgress[self.get_async_progress(pid)]
 
@@ -1257,14 +2381,9 @@ class EntityAPI(AuthenticatedAPI):
             f'{self.protocol}://{self.server}/api/entity/{entity.path}/{entity.reference}/parent-ref',
             data=data, headers=headers)
         if request.status_code == requests.codes.accepted:
-            sleep_sec = 1
-            while True:
-                status = self.get_async_progress(request.content.decode("utf-8"))
-                if status != "ACTIVE":
-                    return self.entity(entity.entity_type, entity.reference)
-                else:
-                    sleep(sleep_sec)
-                    sleep_sec = sleep_sec + 1
+            self.track_progress(request.content.decode("utf-8")).result()
+            self._invalidate_cache(entity)
+            return self.entity(entity.entity_type, entity.reference)
 
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
@@ -1401,14 +2520,9 @@ class EntityAPI(AuthenticatedAPI):
         request = self.session.put(f'{self.protocol}://{self.server}/api/entity{end_point}?includeDescendants=false',
                                    data=new_tag, headers=headers)
         if request.status_code == requests.codes.accepted:
-            sleep_sec = 1
-            while True:
-                status = self.get_async_progress(request.content.decode("utf-8"))
-                if status != "ACTIVE":
-                    return self.entity(entity.entity_type, entity.reference)
-                else:
-                    sleep(sleep_sec)
-                    sleep_sec = sleep_sec + 1
+            self.track_progress(request.content.decode("utf-8")).result()
+            self._invalidate_cache(entity)
+            return self.entity(entity.entity_type, entity.reference)
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.security_tag_sync(entity, new_tag)
@@ -1435,7 +2549,9 @@ class EntityAPI(AuthenticatedAPI):
         request = self.session.put(f'{self.protocol}://{self.server}/api/entity{end_point}?includeDescendants=false',
                                    data=new_tag, headers=headers)
         if request.status_code == requests.codes.accepted:
-            return request.content.decode("utf-8")
+            pid = request.content.decode("utf-8")
+            self._invalidate_when_done(pid, entity)
+            return pid
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.security_tag_async(entity, new_tag)
@@ -1457,9 +2573,7 @@ class EntityAPI(AuthenticatedAPI):
         if request.status_code == requests.codes.ok:
             xml_response = str(request.content.decode('utf-8'))
             logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            content = entity_response.find(f'.//{{{self.xip_ns}}}Content')
-            return xml.etree.ElementTree.tostring(content[0], encoding='utf-8', method='xml').decode('utf-8')
+            return self._metadata_from_xml(xml_response)
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.metadata(uri)
@@ -1664,29 +2778,7 @@ class EntityAPI(AuthenticatedAPI):
         :raises RuntimeError: if the identifier is incorrect
 
          """
-        headers = {HEADER_TOKEN: self.token}
-        request = self.session.get(f'{self.protocol}://{self.server}/api/entity/{IO_PATH}/{reference}', headers=headers)
-        if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity = self.entity_from_string(xml_response)
-            asset = Asset(entity['reference'], entity['title'], entity['description'],
-                          entity['security_tag'], entity['parent'],
-                          entity['metadata'])
-            if 'CustomType' in entity:
-                asset.custom_type = entity['CustomType']
-            return asset
-        elif request.status_code == requests.codes.unauthorized:
-            self.token = self.__token__()
-            return self.asset(reference)
-        elif request.status_code == requests.codes.not_found:
-            exception = ReferenceNotFoundException(reference, request.status_code, request.url, "asset")
-            logger.error(exception)
-            raise exception
-        else:
-            exception = HTTPException(reference, request.status_code, request.url, "asset",
-                                      request.content.decode('utf-8'))
-            logger.error(exception)
-            raise exception
+        return self._fetch_entity(Asset, IO_PATH, reference, "asset")
 
     def folder(self, reference: str) -> Folder:
         """
@@ -1698,29 +2790,7 @@ class EntityAPI(AuthenticatedAPI):
         :rtype: Folder
         :raises RuntimeError: if the identifier is incorrect
          """
-        headers = {HEADER_TOKEN: self.token}
-        request = self.session.get(f'{self.protocol}://{self.server}/api/entity/{SO_PATH}/{reference}', headers=headers)
-        if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity = self.entity_from_string(xml_response)
-            folder = Folder(entity['reference'], entity['title'], entity['description'],
-                            entity['security_tag'], entity['parent'],
-                            entity['metadata'])
-            if 'CustomType' in entity:
-                folder.custom_type = entity['CustomType']
-            return folder
-        elif request.status_code == requests.codes.unauthorized:
-            self.token = self.__token__()
-            return self.folder(reference)
-        elif request.status_code == requests.codes.not_found:
-            exception = ReferenceNotFoundException(reference, request.status_code, request.url, "folder")
-            logger.error(exception)
-            raise exception
-        else:
-            exception = HTTPException(reference, request.status_code, request.url, "folder",
-                                      request.content.decode('utf-8'))
-            logger.error(exception)
-            raise exception
+        return self._fetch_entity(Folder, SO_PATH, reference, "folder")
 
     def content_object(self, reference: str) -> ContentObject:
         """
@@ -1732,36 +2802,66 @@ class EntityAPI(AuthenticatedAPI):
         :rtype: ContentObject
         :raises RuntimeError: if the identifier is incorrect
          """
-        headers = {HEADER_TOKEN: self.token}
-        request = self.session.get(f'{self.protocol}://{self.server}/api/entity/{CO_PATH}/{reference}', headers=headers)
-        if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity = self.entity_from_string(xml_response)
-            content_object = ContentObject(entity['reference'], entity['title'], entity['description'],
-                                           entity['security_tag'], entity['parent'],
-                                           entity['metadata'])
-            if 'CustomType' in entity:
-                content_object.custom_type = entity['CustomType']
-            return content_object
-        elif request.status_code == requests.codes.unauthorized:
-            self.token = self.__token__()
-            return self.content_object(reference)
-        elif request.status_code == requests.codes.not_found:
-            exception = ReferenceNotFoundException(reference, request.status_code, request.url, "content_object")
-            logger.error(exception)
-            raise exception
-        else:
-            exception = HTTPException(reference, request.status_code, request.url, "content_object",
-                                      request.content.decode('utf-8'))
-            logger.error(exception)
-            raise exception
+        return self._fetch_entity(ContentObject, CO_PATH, reference, "content_object")
+
+    def entities(self, entity_type: EntityType, references: Iterable[str], max_workers: int = 8,
+                 ordered: bool = False) -> Generator[Union[EntityT, ReferenceNotFoundException], None, None]:
+        """
+        Fetch many entities of the same type using a pool of worker threads
 
-    def content_objects(self, representation: Representation) -> list[ContentObject]:
+        Entities are returned as they arrive, or in the same order as the references if ordered is True.
+        A reference which does not exist does not stop the batch, a ReferenceNotFoundException is
+        returned in its place. Other errors are raised.
+
+        :param EntityType entity_type: The type of the entities
+        :param references: An iterable of entity references
+        :param int max_workers: The maximum number of concurrent requests
+        :param bool ordered: Return the entities in the same order as the references
+        :return: A generator of entities or ReferenceNotFoundException
+        :rtype: Generator
+        """
+        return concurrent_map(functools.partial(self.entity, entity_type), references, max_workers=max_workers,
+                              ordered=ordered, exceptions=(ReferenceNotFoundException,))
+
+    def assets(self, references: Iterable[str], max_workers: int = 8,
+               ordered: bool = False) -> Generator[Union[Asset, ReferenceNotFoundException], None, None]:
+        """
+        Fetch many assets using a pool of worker threads
+
+        A reference which does not exist does not stop the batch, a ReferenceNotFoundException is
+        returned in its place.
+
+        :param references: An iterable of asset references
+        :param int max_workers: The maximum number of concurrent requests
+        :param bool ordered: Return the assets in the same order as the references
+        :return: A generator of Assets or ReferenceNotFoundException
+        :rtype: Generator
+        """
+        return self.entities(EntityType.ASSET, references, max_workers=max_workers, ordered=ordered)
+
+    def folders(self, references: Iterable[str], max_workers: int = 8,
+                ordered: bool = False) -> Generator[Union[Folder, ReferenceNotFoundException], None, None]:
+        """
+        Fetch many folders using a pool of worker threads
+
+        A reference which does not exist does not stop the batch, a ReferenceNotFoundException is
+        returned in its place.
+
+        :param references: An iterable of folder references
+        :param int max_workers: The maximum number of concurrent requests
+        :param bool ordered: Return the folders in the same order as the references
+        :return: A generator of Folders or ReferenceNotFoundException
+        :rtype: Generator
+        """
+        return self.entities(EntityType.FOLDER, references, max_workers=max_workers, ordered=ordered)
+
+    def content_objects(self, representation: Representation, max_workers: int = 8) -> list[ContentObject]:
         """
          Return a list of content objects for a representation
 
         :param  representation: The representation
         :type  representation: Representation
+        :param int max_workers: The number of concurrent requests
         :return: List of content objects
         :rtype: list(ContentObject)
 
@@ -1773,96 +2873,64 @@ class EntityAPI(AuthenticatedAPI):
         request = self.session.get(f'{representation.url}', headers=headers)
         if request.status_code == requests.codes.ok:
             results = []
-            xml_response = str(request.content.decode('utf-8'))
-            logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            content_objects = entity_response.findall(f'.//{{{self.xip_ns}}}Representation/'
-                                                      f'{{{self.xip_ns}}}ContentObjects/{{{self.xip_ns}}}ContentObject')
-            for co in content_objects:
-                content_object = self.content_object(co.text)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            xml_response = request.content
+            for content_object in self._fetch_all(self.content_object,
+                                                  self._content_object_refs_from_xml(xml_response), max_workers):
                 content_object.representation_type = representation.rep_type
                 content_object.asset = representation.asset
                 results.append(content_object)
             return results
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
-            return self.content_objects(representation)
+            return self.content_objects(representation, max_workers)
         else:
             exception = HTTPException(representation.name, request.status_code, request.url, "content_objects",
                                       request.content.decode('utf-8'))
             logger.error(exception)
             raise exception
 
-    def generation(self, url: str, content_ref: str = None) -> Generation:
+    def generation(self, url: str, content_ref: str = None, max_workers: int = 8) -> Generation:
         """
         Retrieve a list of generation objects
 
+        The bitstreams of the generation are fetched concurrently.
+
         :param url:
         :param content_ref:
+        :param int max_workers: The number of concurrent requests
 
         :return: Generation
         :rtype:  Generation
         """
+        cache = self.cache
+        if cache is not None:
+            generation = cache.get(('generation', url))
+            if generation is not None:
+                if content_ref is not None:
+                    for bs in generation.bitstreams:
+                        bs.co_ref = content_ref
+                return generation
 
         headers = {HEADER_TOKEN: self.token}
         request = self.session.get(url, headers=headers)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            ge = entity_response.find(f'.//{{{self.xip_ns}}}Generation')
-            format_group = entity_response.find(f'.//{{{self.xip_ns}}}FormatGroup')
-            effective_date = entity_response.find(f'.//{{{self.xip_ns}}}EffectiveDate')
-
-            formats = entity_response.findall(f'.//{{{self.xip_ns}}}Formats/{{{self.xip_ns}}}Format')
-            formats_list = []
-            for tech_format in formats:
-                format_dict = {'Valid': tech_format.attrib['valid']}
-                puid = tech_format.find(f'.//{{{self.xip_ns}}}PUID')
-                format_dict['PUID'] = puid.text if hasattr(puid, 'text') else None
-                priority = tech_format.find(f'.//{{{self.xip_ns}}}Priority')
-                format_dict['Priority'] = priority.text if hasattr(priority, 'text') else None
-                method = tech_format.find(f'.//{{{self.xip_ns}}}IdentificationMethod')
-                format_dict['IdentificationMethod'] = method.text if hasattr(method, 'text') else None
-                name = tech_format.find(f'.//{{{self.xip_ns}}}FormatName')
-                format_dict['FormatName'] = name.text if hasattr(name, 'text') else None
-                version = tech_format.find(f'.//{{{self.xip_ns}}}FormatVersion')
-                format_dict['FormatVersion'] = version.text if hasattr(version, 'text') else None
-                formats_list.append(format_dict)
-
-            index = int(url.rsplit("/", 1)[-1])
-
-            properties = entity_response.findall(f'.//{{{self.xip_ns}}}Properties/{{{self.xip_ns}}}Property')
-            property_set = []
-            for tech_props in properties:
-                tech_props_dict = {}
-                puid = tech_props.find(f'.//{{{self.xip_ns}}}PUID')
-                tech_props_dict['PUID'] = puid.text if hasattr(puid, 'text') else None
-                name = tech_props.find(f'.//{{{self.xip_ns}}}PropertyName')
-                tech_props_dict['PropertyName'] = name.text if hasattr(name, 'text') else None
-                value = tech_props.find(f'.//{{{self.xip_ns}}}Value')
-                tech_props_dict['Value'] = value.text if hasattr(value, 'text') else None
-                property_set.append(tech_props_dict)
-
-            bitstreams = entity_response.findall(f'./{{{self.entity_ns}}}Bitstreams/{{{self.entity_ns}}}Bitstream')
-            bitstream_list = []
-            for bit in bitstreams:
-                bs: Bitstream = self.bitstream(bit.text)
-                bs.gen_index = index
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            xml_response = request.content
+            generation, bitstream_urls = self._generation_from_xml(xml_response, url)
+            for bs in self._fetch_all(self.bitstream, bitstream_urls, max_workers):
+                bs.gen_index = generation.gen_index
                 if content_ref is not None:
                     bs.co_ref = content_ref
-                bitstream_list.append(bs)
-            generation = Generation(strtobool(ge.attrib['original']), strtobool(ge.attrib['active']),
-                                    format_group.text if hasattr(format_group, 'text') else None,
-                                    effective_date.text if hasattr(effective_date, 'text') else None,
-                                    bitstream_list)
-            generation.formats = formats_list
-            generation.properties = property_set
-            generation.gen_index = index
+                generation.bitstreams.append(bs)
+            if cache is not None:
+                cache.put(('generation', url), generation)
             return generation
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
-            return self.generation(url)
+            return self.generation(url, content_ref, max_workers)
         else:
             exception = HTTPException(url, request.status_code, request.url, "generation",
                                       request.content.decode('utf-8'))
@@ -1943,27 +3011,17 @@ class EntityAPI(AuthenticatedAPI):
         :return: a bitstream object
         :rtype: Bitstream
          """
+        bitstream = self.bitstream_cache.get(('bitstream', url))
+        if bitstream is not None:
+            return bitstream
         headers = {HEADER_TOKEN: self.token}
         request = self.session.get(url, headers=headers)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            logger.debug(xml_response)
-            filename = entity_response.find(f'.//{{{self.xip_ns}}}Filename')
-            filesize = entity_response.find(f'.//{{{self.xip_ns}}}FileSize')
-            fixity_values = entity_response.findall(f'.//{{{self.xip_ns}}}Fixity')
-            content = entity_response.find(f'.//{{{self.entity_ns}}}Content')
-
-            index = int(url.rsplit("/", 1)[-1])
-
-            fixity = {}
-            for f in fixity_values:
-                fixity[f[0].text] = f[1].text
-            bitstream = Bitstream(filename.text if hasattr(filename, 'text') else None,
-                                  int(filesize.text) if hasattr(filesize, 'text') else None, fixity,
-                                  content.text if hasattr(content, 'text') else None)
-
-            bitstream.bs_index = index
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            xml_response = request.content
+            bitstream = self._bitstream_from_xml(xml_response, url)
+            self.bitstream_cache.put(('bitstream', url), bitstream)
             return bitstream
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
@@ -1990,15 +3048,10 @@ class EntityAPI(AuthenticatedAPI):
 
         """
 
-        status = "ACTIVE"
-
         pid = self.replace_generation_async(content_object=content_object, file_name=file_name,
                                             fixity_algorithm=fixity_algorithm, fixity_value=fixity_value)
 
-        while status == "ACTIVE":
-            status = self.get_async_progress(pid)
-
-        return status
+        return self.track_progress(pid).result()
 
     def replace_generation_async(self, content_object: ContentObject, file_name, fixity_algorithm=None,
                                  fixity_value=None) -> str:
@@ -2054,7 +3107,9 @@ class EntityAPI(AuthenticatedAPI):
                 params=params, data=f, headers=headers)
 
         if request.status_code == requests.codes.ok:
-            return str(request.content.decode('utf-8'))
+            pid = str(request.content.decode('utf-8'))
+            self._invalidate_when_done(pid, kind='generation')
+            return pid
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.replace_generation_async(content_object=content_object, file_name=file_name,
@@ -2065,12 +3120,13 @@ class EntityAPI(AuthenticatedAPI):
             logger.error(exception)
             raise exception
 
-    def generations(self, content_object: ContentObject) -> list[Generation]:
+    def generations(self, content_object: ContentObject, max_workers: int = 8) -> list[Generation]:
         """
         Return a list of Generation objects for a content object
 
         :param  content_object: The content object
         :type  content_object: ContentObject
+        :param int max_workers: The number of concurrent requests
         :return: list of generations
         :rtype: list(Generation)
         """
@@ -2079,45 +3135,183 @@ class EntityAPI(AuthenticatedAPI):
             f'{self.protocol}://{self.server}/api/entity/{CO_PATH}/{content_object.reference}/generations',
             headers=headers)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            generations = entity_response.findall(f'.//{{{self.entity_ns}}}Generation')
+            xml_response = request.content
             result = []
-            for g in generations:
-                if hasattr(g, 'text'):
-                    generation = self.generation(g.text, content_object.reference)
-                    generation.asset = content_object.asset
-                    generation.content_object = content_object
-                    generation.representation_type = content_object.representation_type
-                    result.append(generation)
+            generation_urls = [url for url in self._generation_urls_from_xml(xml_response) if url is not None]
+            outer, inner = self._split_workers(max_workers, len(generation_urls))
+            for generation in self._fetch_all(functools.partial(self.generation, content_ref=content_object.reference,
+                                                                max_workers=inner), generation_urls, outer):
+                generation.asset = content_object.asset
+                generation.content_object = content_object
+                generation.representation_type = content_object.representation_type
+                result.append(generation)
             return result
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
-            return self.generations(content_object)
+            return self.generations(content_object, max_workers)
         else:
             exception = HTTPException(content_object.reference, request.status_code, request.url,
                                       "generations", request.content.decode('utf-8'))
             logger.error(exception)
             raise exception
 
-    def bitstreams_for_asset(self, asset: Union[Asset, Entity]) -> Iterable[Bitstream]:
+    def bitstreams_for_asset(self, asset: Union[Asset, Entity], max_workers: int = 8) -> Iterable[Bitstream]:
         """
         Return all the active bitstreams within an asset.
         This includes all the representations and content objects
 
+        The content objects and generations of all the representations are requested concurrently, with no more than
+        max_workers requests at the same time. The bitstreams are returned in the same order as a sequential walk.
+
         :param asset:               The asset
+        :param int max_workers:     The number of concurrent requests
         :return: Iterable
         """
 
-        for representation in self.representations(asset):
-            for content_object in self.content_objects(representation):
-                for generation in self.generations(content_object):
-                    if generation.active:
-                        for bitstream in generation.bitstreams:
-                            bitstream.representation = representation
-                            bitstream.content_object = content_object
-                            bitstream.generation = generation
-                            yield bitstream
+        representations = list(self.representations(asset))
+        outer, inner = self._split_workers(max_workers, len(representations))
+        content_objects = [(representation, content_object)
+                           for representation, objects in zip(representations,
+                                                              self._fetch_all(functools.partial(self.content_objects,
+                                                                                                max_workers=inner),
+                                                                              representations, outer))
+                           for content_object in objects]
+        outer, inner = self._split_workers(max_workers, len(content_objects))
+        generations = self._fetch_all(functools.partial(self.generations, max_workers=inner),
+                                      [content_object for _, content_object in content_objects], outer)
+        for (representation, content_object), content_generations in zip(content_objects, generations):
+            for generation in content_generations:
+                if generation.active:
+                    for bitstream in generation.bitstreams:
+                        bitstream.representation = representation
+                        bitstream.content_object = content_object
+                        bitstream.generation = generation
+                        yield bitstream
+
+    def download_folder(self, folder: Union[Folder, str], target_directory: str, max_workers: int = 8,
+                        rep_type: str = None, verify_fixity: bool = True, segment_workers: int = 2,
+                        manifest: str = None, callback: Callable = None) -> DownloadStatistics:
+        """
+        Download the active bitstreams of every asset below a folder into a local directory
+
+        The folder hierarchy is recreated using the entity titles, each asset is a directory containing a
+        directory for each representation. Assets are downloaded by a pool of max_workers threads.
+
+        Files which already exist with the correct size and fixity are skipped. Completed files are recorded in a
+        manifest file, by default export-manifest.jsonl in the target directory, so a download which is stopped
+        can be run again and only the missing files are fetched.
+
+        :param folder: The folder to download
+        :param str target_directory: The local directory to write to
+        :param int max_workers: The number of assets to download at the same time
+        :param str rep_type: Only download "Preservation" or "Access" representations, None for both
+        :param bool verify_fixity: Check the fixity of each file against the value held by Preservica
+        :param int segment_workers: The number of connections used for each large bitstream
+        :param str manifest: The path of the manifest file
+        :param Callable callback: Called with the DownloadStatistics after each bitstream
+        :return: The download counters
+        :rtype: DownloadStatistics
+        """
+        if isinstance(folder, str):
+            folder = self.folder(folder)
+        if manifest is None:
+            manifest = os.path.join(target_directory, "export-manifest.jsonl")
+        os.makedirs(target_directory, exist_ok=True)
+
+        directories = {}
+        completed = {}
+        if os.path.isfile(manifest):
+            with open(manifest, 'rt', encoding='utf-8') as fd:
+                for line in fd:
+                    if line.strip():
+                        record = json.loads(line)
+                        if 'entity' in record:
+                            directories[record['entity']] = record['path']
+                        else:
+                            completed[record['path']] = record
+        manifest_file = open(manifest, 'at', encoding='utf-8')
+        manifest_lock = threading.Lock()
+        statistics = DownloadStatistics()
+        used_paths = set(directories.values())
+
+        def write_manifest(record: dict):
+            with manifest_lock:
+                manifest_file.write(json.dumps(record) + "\n")
+                manifest_file.flush()
+
+        def directory_for(entity: Entity, parent_path: str) -> str:
+            # titles are not unique, so later entities with the same title get their reference appended
+            path = directories.get(entity.reference)
+            if path is None:
+                name = sanitize(entity.title or "") or entity.reference
+                path = os.path.join(parent_path, name)
+                if path in used_paths:
+                    path = os.path.join(parent_path, f"{name} ({entity.reference})")
+                used_paths.add(path)
+                directories[entity.reference] = path
+                write_manifest({'entity': entity.reference, 'path': path})
+            return path
+
+        def is_complete(bitstream: Bitstream, path: str) -> bool:
+            full_path = os.path.join(target_directory, path)
+            if not os.path.isfile(full_path) or os.path.getsize(full_path) != bitstream.length:
+                return False
+            record = completed.get(path)
+            if record is not None and record.get('fixity') == bitstream.fixity and \
+                    record.get('mtime') == os.path.getmtime(full_path):
+                return True
+            return not verify_fixity or self._fixity_matches(bitstream, full_path)
+
+        def download_asset(job):
+            asset, path = job
+            for bitstream in self.bitstreams_for_asset(asset):
+                if rep_type is not None and bitstream.representation.rep_type != rep_type:
+                    continue
+                representation = sanitize(bitstream.representation.name or bitstream.representation.rep_type or "")
+                file_path = os.path.join(path, representation, sanitize(bitstream.filename))
+                full_path = os.path.join(target_directory, file_path)
+                statistics.add(bitstreams=1)
+                if is_complete(bitstream, file_path):
+                    statistics.add(skipped=1, bytes_skipped=bitstream.length)
+                else:
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    try:
+                        length = self.bitstream_content(bitstream, full_path, max_workers=segment_workers,
+                                                        verify_fixity=verify_fixity)
+                    except (HTTPException, RuntimeError, OSError) as ex:
+                        logger.error(f"Failed to download {bitstream.filename} from {asset.reference}: {ex}")
+                        length = None
+                    if length is None:
+                        statistics.add(failed=1)
+                        continue
+                    write_manifest({'path': file_path, 'reference': asset.reference, 'length': length,
+                                    'fixity': bitstream.fixity, 'mtime': os.path.getmtime(full_path)})
+                    statistics.add(downloaded=1, bytes_downloaded=length)
+                if callback is not None:
+                    callback(statistics)
+            statistics.add(assets=1)
+            return asset
+
+        def assets():
+            root = directory_for(folder, "")
+            os.makedirs(os.path.join(target_directory, root), exist_ok=True)
+            for entity in self.parallel_descendants(folder, ordered=True):
+                path = directory_for(entity, directories.get(entity.parent, root))
+                if isinstance(entity, Folder):
+                    os.makedirs(os.path.join(target_directory, path), exist_ok=True)
+                    statistics.add(folders=1)
+                elif isinstance(entity, Asset):
+                    yield entity, path
+
+        try:
+            for result in concurrent_map(download_asset, assets(), max_workers=max_workers,
+                                         exceptions=(HTTPException, ReferenceNotFoundException)):
+                if isinstance(result, Exception):
+                    logger.error(result)
+                    statistics.add(failed=1)
+        finally:
+            manifest_file.close()
+        return statistics
 
     def representations(self, asset: Asset) -> set[Representation]:
         """
@@ -2137,14 +3331,7 @@ class EntityAPI(AuthenticatedAPI):
             f'{self.protocol}://{self.server}/api/entity/{asset.path}/{asset.reference}/representations',
             headers=headers)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            representations = entity_response.findall(f'.//{{{self.entity_ns}}}Representation')
-            result = set()
-            for r in representations:
-                representation = Representation(asset, r.get('type'), r.get("name", None), r.text)
-                result.add(representation)
-            return result
+            return self._representations_from_xml(asset, request.content)
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.representations(asset)
@@ -2292,10 +3479,51 @@ class EntityAPI(AuthenticatedAPI):
         :rtype: set(Entity)
 
          """
-        for entity in self.descendants(folder=folder):
+        stack = [self.descendants(folder=folder)]
+        while stack:
+            entity = next(stack[-1], None)
+            if entity is None:
+                stack.pop()
+                continue
             yield entity
             if entity.entity_type == EntityType.FOLDER:
-                yield from self.all_descendants(folder=entity)
+                stack.append(self.descendants(folder=entity))
+
+    def parallel_descendants(self, folder: Union[Folder, Entity, str] = None, max_workers: int = 8,
+                             max_queued: int = 1000, ordered: bool = False, pending: list = None) -> TreeWalker:
+        """
+        Return all child entities recursively of a folder or repository down to the assets.
+
+        Unlike all_descendants() the children of many folders are requested at the same time using a pool of
+        worker threads, so large hierarchies are walked much more quickly.
+
+        The returned TreeWalker is iterable, call checkpoint() on it to save the folders still to be walked
+        and pass them back as the pending argument to resume.
+
+        :param folder: The parent folder, None for the whole repository
+        :param int max_workers: The maximum number of concurrent requests
+        :param int max_queued: The maximum number of entities waiting to be returned to the caller
+        :param bool ordered: Return entities in the same depth first order as all_descendants()
+        :param list pending: A list of folder references from a previous checkpoint() to resume from
+        :return: An iterable of entity objects (Folders and Assets)
+        :rtype: TreeWalker
+        """
+        return TreeWalker(self, folder, max_workers=max_workers, max_queued=max_queued, ordered=ordered,
+                          pending=pending)
+
+    def entity_table(self, folder: Union[Folder, Entity, str] = None, max_workers: int = 8) -> EntityTable:
+        """
+        Walk a folder or the whole repository into a compact EntityTable
+
+        The table uses much less memory than a set of entity objects, so inventories of millions of entities
+        can be held and compared in memory.
+
+        :param folder: The parent folder, None for the whole repository
+        :param int max_workers: The maximum number of concurrent requests
+        :return: A table of the Folders and Assets below the folder
+        :rtype: EntityTable
+        """
+        return EntityTable(self.parallel_descendants(folder, max_workers=max_workers))
 
     def descendants(self, folder: Union[str, Folder] = None) -> Generator[Entity, None, None]:
 
@@ -2356,27 +3584,10 @@ class EntityAPI(AuthenticatedAPI):
             request = self.session.get(next_page, headers=headers)
         logger.debug(request.url)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            children = entity_response.findall(f'.//{{{self.entity_ns}}}Child')
-            result = set()
-            next_url = entity_response.find(f'.//{{{self.entity_ns}}}Next')
-            total_hits = entity_response.find(f'.//{{{self.entity_ns}}}TotalResults')
-            for child in children:
-                if child.attrib['type'] == EntityType.FOLDER.value:
-                    folder = Folder(child.attrib['ref'], child.attrib['title'], None, None, folder_reference, None)
-                    result.add(folder)
-                else:
-                    asset = Asset(child.attrib['ref'], child.attrib['title'], None, None, folder_reference, None)
-                    result.add(asset)
-            has_more = True
-            url = None
-            if next_url is None:
-                has_more = False
-            else:
-                url = next_url.text
-            return PagedSet(result, has_more, int(total_hits.text), url)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            xml_response = request.content
+            return self._children_from_xml(xml_response, folder_reference)
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.children(folder_reference, maximum=maximum, next_page=next_page)
@@ -2429,6 +3640,181 @@ class EntityAPI(AuthenticatedAPI):
             for entity in paged_set.results:
                 yield entity
 
+    @staticmethod
+    def _event_date(event: dict) -> datetime:
+        try:
+            date = parse(event['Date'])
+        except (TypeError, ValueError, OverflowError):
+            return datetime.min.replace(tzinfo=timezone.utc)
+        return date if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+
+    @staticmethod
+    def _event_shards(from_date: datetime, to_date: datetime, shard_days: float) -> list:
+        if from_date.tzinfo is None:
+            from_date = from_date.replace(tzinfo=timezone.utc)
+        if to_date is None:
+            to_date = datetime.now(timezone.utc)
+        elif to_date.tzinfo is None:
+            to_date = to_date.replace(tzinfo=timezone.utc)
+        step = timedelta(days=shard_days)
+        shards = []
+        start = from_date
+        while start < to_date:
+            end = min(start + step, to_date)
+            shards.append((start, end))
+            start = end
+        return shards
+
+    def _event_shard(self, shard: tuple, page_size: int, **kwargs) -> list:
+        start, end = shard
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+        paged_set = self._all_events_page(maximum=page_size, from_date=start.isoformat(), to_date=end.isoformat(),
+                                          **kwargs)
+        events = list(paged_set.results)
+        while paged_set.has_more:
+            paged_set = self._all_events_page(maximum=page_size, next_page=paged_set.next_page, **kwargs)
+            events.extend(paged_set.results)
+        events.sort(key=self._event_date)
+        return events
+
+    def _events_by_shard(self, shards: list, event_type: str = None, username: str = None, max_workers: int = 8,
+                         page_size: int = 250, boundary: Iterable[str] = ()) -> Generator[Tuple[int, list, set],
+                                                                                          None, None]:
+        """
+        Fetch the shards in parallel and return the events of each shard in time order, without the events which
+        were already returned by the previous shard
+        """
+        fetch = functools.partial(self._event_shard, page_size=page_size, type=event_type, username=username)
+        previous = set(boundary)
+        for index, (shard, events) in enumerate(zip(shards, concurrent_map(fetch, shards, max_workers=max_workers,
+                                                                           ordered=True))):
+            # the date range of a shard includes its end, so an event at the boundary is in both shards
+            events = [event for event in events if event.get('Ref') is None or event['Ref'] not in previous]
+            previous = set(event['Ref'] for event in events if event.get('Ref') and self._event_date(event) >= shard[1])
+            yield index, events, previous
+
+    def events_between(self, from_date: datetime, to_date: datetime = None, event_type: str = None,
+                       username: str = None, shard_days: float = 7, max_workers: int = 8,
+                       page_size: int = 250) -> Generator[dict, None, None]:
+        """
+        Returns the events for the user's tenancy between two dates in time order
+
+        The date range is split into shards of shard_days days which are fetched in parallel, so long date ranges
+        are returned much more quickly than with all_events().
+
+        :param datetime from_date: The start of the date range
+        :param datetime to_date: The end of the date range, None for now
+        :param str event_type: Only return events of this type, for example "Ingest"
+        :param str username: Only return events performed by this user
+        :param float shard_days: The number of days in each shard
+        :param int max_workers: The number of shards fetched at the same time
+        :param int page_size: The number of events requested per page
+        :return: A generator of events
+        :rtype: Generator
+        """
+        shards = self._event_shards(from_date, to_date, shard_days)
+        for index, events, boundary in self._events_by_shard(shards, event_type, username, max_workers, page_size):
+            for event in events:
+                yield event
+
+    def export_events(self, filename: str, from_date: datetime, to_date: datetime = None, event_type: str = None,
+                      username: str = None, output_format: str = None, shard_days: float = 7, max_workers: int = 8,
+                      page_size: int = 250) -> int:
+        """
+        Write the events for the user's tenancy between two dates to a file in time order
+
+        The format is one of "jsonl", "csv" or "parquet" and by default is taken from the file extension.
+        A parquet export is a directory holding one file for each shard and needs the pyarrow package.
+
+        The progress is saved after each shard, calling export_events() again with the same arguments after
+        an interruption carries on from the last complete shard.
+
+        :param str filename: The output file or directory
+        :param datetime from_date: The start of the date range
+        :param datetime to_date: The end of the date range, None for now
+        :param str event_type: Only return events of this type, for example "Ingest"
+        :param str username: Only return events performed by this user
+        :param str output_format: "jsonl", "csv" or "parquet"
+        :param float shard_days: The number of days in each shard
+        :param int max_workers: The number of shards fetched at the same time
+        :param int page_size: The number of events requested per page
+        :return: The number of events written
+        :rtype: int
+        """
+        if output_format is None:
+            output_format = os.path.splitext(filename)[1].lstrip(".").lower() or "jsonl"
+        if output_format == "json":
+            output_format = "jsonl"
+        if output_format not in ("jsonl", "csv", "parquet"):
+            raise RuntimeError(f"Unknown event export format {output_format}")
+        if output_format == "parquet" and pyarrow is None:
+            msg = "Parquet export requires the pyarrow package, install it with: pip install pyarrow"
+            logger.error(msg)
+            raise RuntimeError(msg)
+
+        shards = self._event_shards(from_date, to_date, shard_days)
+        query = {'from': shards[0][0].isoformat() if shards else None,
+                 'to': shards[-1][1].isoformat() if shards else None, 'type': event_type, 'username': username,
+                 'shard_days': shard_days, 'format': output_format}
+        progress_file = f"{filename.rstrip(os.sep)}.progress.json"
+        progress = {'query': query, 'shards': 0, 'offset': 0, 'count': 0, 'boundary': []}
+        if os.path.isfile(progress_file):
+            with open(progress_file, 'rt', encoding='utf-8') as fd:
+                saved = json.load(fd)
+            saved_query = saved.get('query', {})
+            if to_date is None:
+                # an export up to now carries on up to the end date of the interrupted export, so the shards line up
+                query = {**query, 'to': saved_query.get('to')}
+            if saved_query == query and query['to'] is not None:
+                progress = saved
+                shards = self._event_shards(datetime.fromisoformat(query['from']),
+                                            datetime.fromisoformat(query['to']), shard_days)
+
+        def save_progress():
+            with open(f"{progress_file}.tmp", 'wt', encoding='utf-8') as fd:
+                json.dump(progress, fd)
+            os.replace(f"{progress_file}.tmp", progress_file)
+
+        done = progress['shards']
+        if output_format == "parquet":
+            os.makedirs(filename, exist_ok=True)
+            schema = pyarrow.schema([(field, pyarrow.string()) for field in EVENT_FIELDS])
+            output = None
+        else:
+            output = open(filename, 'r+' if done and os.path.isfile(filename) else 'w', encoding='utf-8', newline='')
+            output.seek(progress['offset'])
+            output.truncate()
+        try:
+            writer = csv.DictWriter(output, fieldnames=EVENT_FIELDS) if output_format == "csv" else None
+            if writer is not None and done == 0:
+                writer.writeheader()
+            for index, events, boundary in self._events_by_shard(shards[done:], event_type, username, max_workers,
+                                                                 page_size, progress['boundary']):
+                if output_format == "parquet":
+                    part = os.path.join(filename, f"part-{done + index:05d}.parquet")
+                    table = pyarrow.Table.from_pylist([{field: event.get(field) for field in EVENT_FIELDS}
+                                                       for event in events], schema=schema)
+                    pyarrow.parquet.write_table(table, f"{part}.tmp")
+                    os.replace(f"{part}.tmp", part)
+                else:
+                    for event in events:
+                        if writer is not None:
+                            writer.writerow({field: event.get(field) for field in EVENT_FIELDS})
+                        else:
+                            output.write(json.dumps(event) + "\n")
+                    output.flush()
+                    progress['offset'] = output.tell()
+                progress['shards'] = done + index + 1
+                progress['count'] += len(events)
+                progress['boundary'] = list(boundary)
+                save_progress()
+        finally:
+            if output is not None:
+                output.close()
+        if os.path.isfile(progress_file):
+            os.remove(progress_file)
+        return progress['count']
+
     def _entity_from_event_page(self, event_id: str, maximum: int = 25, next_page: str = None):
         headers = {HEADER_TOKEN: self.token, 'Content-Type': 'application/xml;charset=UTF-8'}
         if next_page is None:
@@ -2506,35 +3892,24 @@ class EntityAPI(AuthenticatedAPI):
             request = self.session.get(next_page, headers=headers)
 
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            events = entity_response.findall(f'.//{{{self.xip_ns}}}Event')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            xip = f'{{{self.xip_ns}}}'
+            entity_response = parse_xml(request.content)
+            events = find_all(entity_response, f'{xip}Event')
+            optional_tags = ('WorkflowName', 'WorkflowInstanceId', 'SerialisedCommand')
+            event_tags = [f'{xip}{tag}' for tag in ('Date', 'User', 'Ref') + optional_tags]
             result_list = []
             for event in events:
-                result = {'eventType': event.attrib['type']}
-                date_node = event.find(f'.//{{{self.xip_ns}}}Date')
-                result['Date'] = date_node.text if hasattr(date_node, 'text') else None
-                user_node = event.find(f'.//{{{self.xip_ns}}}User')
-                result['User'] = user_node.text if hasattr(user_node, 'text') else None
-                ref_node = event.find(f'.//{{{self.xip_ns}}}Ref')
-                result['Ref'] = ref_node.text if hasattr(ref_node, 'text') else None
-
-                workflow_name = event.find(f'.//{{{self.xip_ns}}}WorkflowName')
-                if workflow_name is not None:
-                    result['WorkflowName'] = workflow_name.text
-
-                workflow_instance_id = event.find(f'.//{{{self.xip_ns}}}WorkflowInstanceId')
-                if workflow_instance_id is not None:
-                    result['WorkflowInstanceId'] = workflow_instance_id.text
-
-                serialised_command = event.find(f'.//{{{self.xip_ns}}}SerialisedCommand')
-                if serialised_command is not None:
-                    result['SerialisedCommand'] = serialised_command.text
-
+                fields = child_fields(event, event_tags)
+                result = {'eventType': event.attrib['type'], 'Date': text_of(fields[f'{xip}Date']),
+                          'User': text_of(fields[f'{xip}User']), 'Ref': text_of(fields[f'{xip}Ref'])}
+                for tag in optional_tags:
+                    if fields[f'{xip}{tag}'] is not None:
+                        result[tag] = fields[f'{xip}{tag}'].text
                 result_list.append(result)
-            next_url = entity_response.find(f'.//{{{self.entity_ns}}}Next')
-            total_hits = entity_response.find(f'.//{{{self.entity_ns}}}TotalResults')
+            next_url = find_first(entity_response, f'{{{self.entity_ns}}}Next')
+            total_hits = find_first(entity_response, f'{{{self.entity_ns}}}TotalResults')
             has_more = True
             url = None
             if next_url is None:
@@ -2670,10 +4045,31 @@ class EntityAPI(AuthenticatedAPI):
             for entity in paged_set.results:
                 yield entity
 
-    def _updated_entities_page(self, previous_days: int = 1, maximum: int = 50, next_page: str = None) -> PagedSet:
+    def change_feed(self, path: str = "change-feed.db", overlap: float = 300, page_size: int = 250,
+                    initial_days: int = 1, enrich: bool = False, max_workers: int = 8) -> ChangeFeed:
+        """
+        Return a feed of the entities which have changed since the feed was last read
+
+        The watermark is kept in a local SQLite file so each sync only asks for the changes since the previous one.
+
+        :param str path: The file which holds the watermark
+        :param float overlap: The number of seconds before the watermark to include, to allow for clock differences
+        :param int page_size: The number of entities requested per page
+        :param int initial_days: The number of days to look back the first time the feed is read
+        :param bool enrich: Fetch the full entity for each change
+        :param int max_workers: The number of threads used to fetch the full entities
+        :return: The change feed, iterate over it to get the changed entities
+        :rtype: ChangeFeed
+        """
+        return ChangeFeed(self, path, overlap=overlap, page_size=page_size, initial_days=initial_days,
+                          enrich=enrich, max_workers=max_workers)
+
+    def _updated_entities_page(self, previous_days: int = 1, maximum: int = 50, next_page: str = None,
+                               since: datetime = None) -> PagedSet:
         headers = {HEADER_TOKEN: self.token}
-        x = datetime.utcnow() - timedelta(days=previous_days)
-        today = x.replace(tzinfo=timezone.utc).isoformat()
+        if since is None:
+            since = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(days=previous_days)
+        today = since.isoformat()
         if next_page is None:
             params = {'date': today, 'start': '0', 'max': str(maximum)}
             request = self.session.get(f'{self.protocol}://{self.server}/api/entity/entities/updated-since',
@@ -2681,10 +4077,10 @@ class EntityAPI(AuthenticatedAPI):
         else:
             request = self.session.get(next_page, headers=headers)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            entities = entity_response.findall(f'.//{{{self.entity_ns}}}Entity')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            entity_response = parse_xml(request.content)
+            entities = find_all(entity_response, f'{{{self.entity_ns}}}Entity')
             result = []
             for entity in entities:
                 if 'type' in entity.attrib:
@@ -2697,8 +4093,8 @@ class EntityAPI(AuthenticatedAPI):
                     elif entity.attrib['type'] == EntityType.CONTENT_OBJECT.value:
                         co = ContentObject(entity.attrib['ref'], entity.attrib['title'], None, None, None, None)
                         result.append(co)
-            next_url = entity_response.find(f'.//{{{self.entity_ns}}}Next')
-            total_hits = entity_response.find(f'.//{{{self.entity_ns}}}TotalResults')
+            next_url = find_first(entity_response, f'{{{self.entity_ns}}}Next')
+            total_hits = find_first(entity_response, f'{{{self.entity_ns}}}TotalResults')
             has_more = True
             url = None
             if next_url is None:
@@ -2709,7 +4105,7 @@ class EntityAPI(AuthenticatedAPI):
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self._updated_entities_page(previous_days=previous_days, maximum=maximum,
-                                               next_page=next_page)
+                                               next_page=next_page, since=since)
         else:
             exception = HTTPException(previous_days, request.status_code, request.url,
                                       "_updated_entities_page", request.content.decode('utf-8'))
@@ -2756,7 +4152,6 @@ class EntityAPI(AuthenticatedAPI):
         :param entity:            The entity
         :param operator_comment: The comment on the deletion
         """
-
         # check manager password is available:
         config = configparser.ConfigParser()
         config.read(credentials_path, encoding='utf-8')
@@ -2782,35 +4177,31 @@ class EntityAPI(AuthenticatedAPI):
         logger.debug(request.content.decode("utf-8"))
         if request.status_code == requests.codes.accepted:
             progress = request.content.decode("utf-8")
-            req = self.session.get(f"{self.protocol}://{self.server}/api/entity/progress/{progress}", headers=headers)
-            while True:
-                if req.status_code == requests.codes.ok:
-                    entity_response = xml.etree.ElementTree.fromstring(req.content.decode("utf-8"))
-                    status = entity_response.find(".//{http://status.preservica.com}Status")
-                    if hasattr(status, 'text'):
-                        if status.text == "COMPLETED":
-                            return entity.reference
-                        if status.text == "PENDING":
-                            headers = {HEADER_TOKEN: self.manager_token(manager_username, manager_password),
-                                       'Content-Type': 'application/xml;charset=UTF-8'}
-                            xml_object = xml.etree.ElementTree.Element('DeletionAction ', {"xmlns:xip": self.xip_ns,
-                                                                                           "xmlns": self.entity_ns})
-                            approval_el = xml.etree.ElementTree.SubElement(xml_object, "Approval")
-                            xml.etree.ElementTree.SubElement(approval_el, "Approved").text = "true"
-                            xml.etree.ElementTree.SubElement(approval_el, "Comment").text = supervisor_comment
-                            xml_request = xml.etree.ElementTree.tostring(xml_object, encoding='utf-8')
-                            logger.debug(xml_request)
-                            approve = self.session.put(
-                                f"{self.protocol}://{self.server}/api/entity/actions/deletions/{progress}",
-                                data=xml_request, headers=headers)
-                            if approve.status_code == requests.codes.accepted:
-                                return entity.reference
-                            else:
-                                logger.error(approve.content.decode('utf-8'))
-                                raise RuntimeError(approve.status_code, "delete_asset failed during approval")
-                        sleep(2.0)
-                req = self.session.get(f"{self.protocol}://{self.server}/api/entity/progress/{progress}",
-                                       headers=headers)
+            status = self.progress_tracker.track(progress, until=("PENDING",) + FINISHED_PROGRESS).result()
+            if status not in ("COMPLETED", "PENDING"):
+                logger.error(f"Deletion of {entity.reference} finished with status {status}")
+                raise RuntimeError(status, "delete_asset failed")
+            if status == "PENDING":
+                headers = {HEADER_TOKEN: self.manager_token(manager_username, manager_password),
+                           'Content-Type': 'application/xml;charset=UTF-8'}
+                xml_object = xml.etree.ElementTree.Element('DeletionAction ', {"xmlns:xip": self.xip_ns,
+                                                                               "xmlns": self.entity_ns})
+                approval_el = xml.etree.ElementTree.SubElement(xml_object, "Approval")
+                xml.etree.ElementTree.SubElement(approval_el, "Approved").text = "true"
+                xml.etree.ElementTree.SubElement(approval_el, "Comment").text = supervisor_comment
+                xml_request = xml.etree.ElementTree.tostring(xml_object, encoding='utf-8')
+                logger.debug(xml_request)
+                approve = self.session.put(
+                    f"{self.protocol}://{self.server}/api/entity/actions/deletions/{progress}",
+                    data=xml_request, headers=headers)
+                if approve.status_code != requests.codes.accepted:
+                    logger.error(approve.content.decode('utf-8'))
+                    raise RuntimeError(approve.status_code, "delete_asset failed during approval")
+                self._invalidate_when_done(progress, entity, 'identifier', until=FINISHED_PROGRESS)
+            else:
+                self._invalidate_cache(entity)
+                self._invalidate_identifiers()
+            return entity.reference
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self._delete_entity(entity, operator_comment, supervisor_comment, credentials_path)
@@ -9,7 +9,7 @@ licence:    Apache License 2.0
 
 """
 
-from typing import Generator
+from typing import Generator, Callable
 
 from pyPreservica.common import *
 
@@ -36,6 +36,211 @@ class MessageStatus(Enum):
     ERROR = 'Error'
 
 
+class MonitorWatcher:
+    """
+        Polls the process monitors and reports what has changed since the last poll
+
+        The monitor list is polled every min_interval seconds while monitors are changing, the interval grows up to
+        max_interval seconds while nothing changes. Only the messages added since the last poll are requested for each
+        monitor, and the timeseries of a monitor is only requested again when the monitor changes.
+
+        Subscribers are called from the polling thread with (event, monitor_id, data) where event is one of
+        "added", "changed" or "removed" with the monitor as data, or "message" with a new message as data.
+    """
+
+    running_states = (MonitorStatus.PENDING.value, MonitorStatus.RUNNING.value)
+
+    def __init__(self, client, status: MonitorStatus = None, category: MonitorCategory = None,
+                 min_interval: float = 2, max_interval: float = 60, backoff: float = 2.0, history: int = 720,
+                 replay: bool = False, timeseries: bool = True, page_size: int = 100, max_workers: int = 8):
+        self.client = client
+        self.status = status
+        self.category = category
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.history = history
+        self.replay = replay
+        self.timeseries = timeseries
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.interval = min_interval
+        self.polls = 0
+        self._monitors = {}
+        self._offsets = {}
+        self._samples = {}
+        self._subscribers = {}
+        self._next_subscriber = 0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback: Callable, monitor_id: str = None, events=None) -> int:
+        """
+        Call callback(event, monitor_id, data) for each change
+
+        :param callback: The function to call
+        :param str monitor_id: Only report changes to this monitor, None for all monitors
+        :param events: Only report these events, for example ("message",), None for all events
+        :return: An id which can be passed to unsubscribe()
+        :rtype: int
+        """
+        with self._lock:
+            self._next_subscriber += 1
+            self._subscribers[self._next_subscriber] = (callback, monitor_id, set(events) if events else None)
+            return self._next_subscriber
+
+    def unsubscribe(self, subscription: int):
+        """
+        Stop calling a subscriber
+
+        :param int subscription: The id returned by subscribe()
+        """
+        with self._lock:
+            self._subscribers.pop(subscription, None)
+
+    def monitors(self) -> dict:
+        """
+        Return the latest copy of every monitor, keyed by monitor id
+        """
+        with self._lock:
+            return {monitor_id: dict(monitor) for monitor_id, monitor in self._monitors.items()}
+
+    def samples(self, monitor_id: str) -> list:
+        """
+        Return the most recent timeseries samples of a monitor, oldest first, up to history samples are kept
+
+        :param str monitor_id: The monitor id
+        """
+        with self._lock:
+            return list(self._samples.get(monitor_id, ()))
+
+    def _publish(self, event: str, monitor_id: str, data):
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        for callback, subscribed_monitor, events in subscribers:
+            if subscribed_monitor is not None and subscribed_monitor != monitor_id:
+                continue
+            if events is not None and event not in events:
+                continue
+            try:
+                callback(event, monitor_id, data)
+            except Exception as exception:
+                logger.error(f"Monitor subscriber failed: {exception}")
+
+    def _new_messages(self, monitor_id: str) -> list:
+        offset = self._offsets.get(monitor_id)
+        if offset is None and not self.replay:
+            # start from the messages written after the monitor was first seen
+            self._offsets[monitor_id] = self.client._messages_page_(monitor_id, maximum=1).total
+            return []
+        offset = offset or 0
+        paged_set = self.client._messages_page_(monitor_id, maximum=self.page_size, start=offset)
+        if paged_set.total < offset:
+            # the messages were cleared on the server, read them again from the start
+            offset = 0
+            paged_set = self.client._messages_page_(monitor_id, maximum=self.page_size)
+        messages = list(paged_set.results)
+        while paged_set.has_more:
+            paged_set = self.client._messages_page_(monitor_id, maximum=self.page_size, next_page=paged_set.next_page)
+            messages.extend(paged_set.results)
+        self._offsets[monitor_id] = offset + len(messages)
+        return messages
+
+    def _refresh(self, monitor_id: str, changed: bool) -> tuple:
+        messages = self._new_messages(monitor_id)
+        samples = None
+        if self.timeseries and changed:
+            samples = self.client.timeseries(monitor_id)
+        return monitor_id, messages, samples
+
+    def poll(self) -> int:
+        """
+        Poll the monitors once and call the subscribers with the changes
+
+        :return: The number of changes found
+        :rtype: int
+        """
+        current = {monitor['MonitorId']: monitor for monitor in self.client.monitors(self.status, self.category)}
+        changes = 0
+        refresh = []
+        with self._lock:
+            previous = self._monitors
+            self._monitors = current
+        for monitor_id, monitor in current.items():
+            old = previous.get(monitor_id)
+            if old is None:
+                self._publish("added", monitor_id, monitor)
+                changes += 1
+            elif old != monitor:
+                self._publish("changed", monitor_id, monitor)
+                changes += 1
+            if old != monitor or monitor.get('status') in self.running_states:
+                refresh.append((monitor_id, old != monitor))
+        for monitor_id in previous.keys() - current.keys():
+            self._publish("removed", monitor_id, previous[monitor_id])
+            with self._lock:
+                self._offsets.pop(monitor_id, None)
+                self._samples.pop(monitor_id, None)
+            changes += 1
+
+        for monitor_id, messages, samples in concurrent_map(lambda item: self._refresh(*item), refresh,
+                                                            max_workers=self.max_workers):
+            if samples is not None:
+                with self._lock:
+                    self._samples[monitor_id] = collections.deque(samples, maxlen=self.history)
+            for message in messages:
+                self._publish("message", monitor_id, message)
+            changes += len(messages)
+
+        self.polls += 1
+        if changes:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return changes
+
+    def start(self) -> "MonitorWatcher":
+        """
+        Start polling on a background thread
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="pyPreservica-monitor-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        """
+        Stop polling and wait for the background thread to finish
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except (RuntimeError, HTTPException, requests.RequestException) as exception:
+                logger.error(f"Monitor poll failed: {exception}")
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __str__(self):
+        return f"MonitorWatcher monitors: {len(self._monitors)} polls: {self.polls} interval: {self.interval:.1f}s"
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class MonitorAPI(AuthenticatedAPI):
     """
                A class for the Preservica Repository Process Monitor API
@@ -46,11 +251,12 @@ class MonitorAPI(AuthenticatedAPI):
 
        """
 
-    def _messages_page_(self, monitor_id, maximum: int = 50, next_page: str = None, status: MessageStatus = None) -> PagedSet:
+    def _messages_page_(self, monitor_id, maximum: int = 50, next_page: str = None, status: MessageStatus = None,
+                        start: int = 0) -> PagedSet:
         headers = {HEADER_TOKEN: self.token, 'Content-Type': 'application/json;charset=UTF-8'}
 
         if next_page is None:
-            params = {'monitor': monitor_id, 'start': int(0), 'max': maximum}
+            params = {'monitor': monitor_id, 'start': int(start), 'max': maximum}
             if status:
                 params['status'] = status.value
             request = self.session.get(f'{self.protocol}://{self.server}/api/processmonitor/messages', headers=headers,
@@ -78,7 +284,7 @@ class MonitorAPI(AuthenticatedAPI):
             return PagedSet(messages, has_more, int(total_hits), url)
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
-            return self._messages_page_(monitor_id, maximum, next_page, status)
+            return self._messages_page_(monitor_id, maximum, next_page, status, start)
         else:
             logger.error(request.content.decode('utf-8'))
             raise RuntimeError(request.status_code, "messages failed")
@@ -151,3 +357,24 @@ class MonitorAPI(AuthenticatedAPI):
         else:
             logger.error(request.content.decode('utf-8'))
             raise RuntimeError(request.status_code, "monitors failed")
+
+    def watch(self, status: MonitorStatus = None, category: MonitorCategory = None, min_interval: float = 2,
+              max_interval: float = 60, history: int = 720, replay: bool = False) -> MonitorWatcher:
+        """
+        Return a MonitorWatcher which polls the monitors and reports only what has changed
+
+        Call start() on the watcher to poll on a background thread, or poll() to poll once.
+
+        :param status: Only watch monitors with this status
+        :type status:   MonitorStatus
+        :param category: Only watch monitors in this category
+        :type category:   MonitorCategory
+        :param float min_interval: The number of seconds between polls while the monitors are changing
+        :param float max_interval: The longest time between polls while nothing changes
+        :param int history: The number of timeseries samples kept for each monitor
+        :param bool replay: Report the messages written before a monitor was first seen
+        :return: The watcher
+        :rtype: MonitorWatcher
+        """
+        return MonitorWatcher(self, status, category, min_interval=min_interval, max_interval=max_interval,
+                              history=history, replay=replay)
@@ -9,13 +9,20 @@ licence:    Apache License 2.0
 
 """
 
+import copy
+import csv
+import sqlite3
 import xml.etree.ElementTree
-from typing import Set, Callable
+from typing import Set, Callable, Iterable, Union, Tuple
 
 from pyPreservica.common import *
 
 logger = logging.getLogger(__name__)
 
+POLICY_FIELDS = ('Ref', 'Name', 'Description', 'SecurityTag', 'StartDateField', 'Period', 'PeriodUnit', 'ExpiryAction',
+                 'Restriction', 'Assignable')
+ASSIGNMENT_FIELDS = ('Entity', 'RetentionPolicy', 'StartDate', 'Expired', 'ApiId')
+
 
 class RetentionAssignment:
     def __init__(self, entity_reference: str, policy_reference: str, api_id: str, start_date, expired=False):
@@ -55,16 +62,245 @@ class RetentionPolicy:
         return self.__str__()
 
 
+class RetentionPolicyCatalogue:
+    """
+        A cached index of the retention policies on the server
+
+        The names and references of every policy are loaded with one paged listing and indexed, the full policy is
+        only requested the first time it is used. The index is loaded again once it is older than ttl seconds.
+    """
+
+    def __init__(self, client, ttl: float = 300, max_workers: int = 8):
+        self.client = client
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._by_reference = {}
+        self._by_name = {}
+        self._policies = {}
+        self._loaded = None
+        # changed by refresh and invalidate so a policy requested before then is not cached afterwards
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    def refresh(self):
+        """
+        Load the names and references of the policies from the server, discarding any cached policies
+        """
+        by_reference = {}
+        next_page = None
+        while True:
+            summaries, next_page = self.client._policy_summaries(next_page)
+            by_reference.update(summaries)
+            if next_page is None:
+                break
+        with self._lock:
+            self._by_reference = by_reference
+            # keep the first policy with a duplicated name, which is the one policy_by_name has always returned
+            self._by_name = {}
+            for reference, name in by_reference.items():
+                self._by_name.setdefault(name, reference)
+            self._policies = {}
+            self._loaded = time.monotonic()
+            self._generation += 1
+
+    def invalidate(self):
+        """
+        Discard the index, it is loaded again the next time it is used
+        """
+        with self._lock:
+            self._loaded = None
+            self._generation += 1
+
+    def _index(self) -> dict:
+        with self._lock:
+            if self._loaded is None or time.monotonic() - self._loaded > self.ttl:
+                self.refresh()
+            return self._by_reference
+
+    def _policy(self, reference: str) -> RetentionPolicy:
+        with self._lock:
+            policy = self._policies.get(reference)
+            generation = self._generation
+        if policy is None:
+            policy = self.client.policy(reference)
+            with self._lock:
+                if generation == self._generation:
+                    self._policies[reference] = policy
+        # callers are free to modify the policies they are given, so never hand out the cached instance
+        return copy.copy(policy)
+
+    def policy(self, reference: str) -> Union[RetentionPolicy, None]:
+        """
+        Return a retention policy by reference
+
+        :param str reference: The policy reference
+        :return: The retention policy, None if there is no policy with the reference
+        :rtype: RetentionPolicy
+        """
+        if reference not in self._index():
+            return None
+        return self._policy(reference)
+
+    def policy_by_name(self, name: str) -> Union[RetentionPolicy, None]:
+        """
+        Return a retention policy by name
+
+        :param str name: The policy name
+        :return: The retention policy, None if there is no policy with the name
+        :rtype: RetentionPolicy
+        """
+        self._index()
+        with self._lock:
+            reference = self._by_name.get(name)
+        if reference is None:
+            return None
+        return self._policy(reference)
+
+    def names(self) -> list:
+        """
+        Return the names of all the policies, without requesting the full policies
+        """
+        return list(self._index().values())
+
+    def references(self) -> list:
+        """
+        Return the references of all the policies, without requesting the full policies
+        """
+        return list(self._index().keys())
+
+    def policies(self) -> list:
+        """
+        Return every policy, the policies which are not cached are requested in parallel
+        """
+        return list(concurrent_map(self._policy, self.references(), max_workers=self.max_workers, ordered=True))
+
+    def __len__(self):
+        return len(self._index())
+
+    def __contains__(self, item):
+        index = self._index()
+        return item in index or item in self._by_name
+
+    def __iter__(self):
+        return iter(self.policies())
+
+    def __str__(self):
+        return f"RetentionPolicyCatalogue size: {len(self._by_reference)} cached: {len(self._policies)}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class RetentionReport:
+    """
+        The outcome of a bulk retention assignment
+
+        For a dry run the added and removed lists hold the changes which would have been made.
+    """
+
+    def __init__(self, policy: RetentionPolicy, dry_run: bool):
+        self.policy = policy
+        self.dry_run = dry_run
+        self.assets = 0
+        self.unchanged = 0
+        self.resumed = 0
+        self.added = []
+        self.removed = []
+        self.failed = {}
+        self.start = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        """
+        The number of seconds since the assignment started
+        """
+        return time.monotonic() - self.start
+
+    def write_csv(self, filename: str):
+        """
+        Write the changes to a CSV file with the columns entity, action, policy and detail
+
+        :param str filename: The CSV file to create
+        """
+        with open(filename, 'wt', encoding='utf-8', newline='') as fd:
+            writer = csv.writer(fd)
+            writer.writerow(["entity", "action", "policy", "detail"])
+            for reference in self.added:
+                writer.writerow([reference, "add", self.policy.reference, ""])
+            for assignment in self.removed:
+                writer.writerow([assignment.entity_reference, "remove", assignment.policy_reference, assignment.api_id])
+            for reference, error in self.failed.items():
+                writer.writerow([reference, "failed", self.policy.reference, error])
+
+    def __str__(self):
+        return f"Policy: {self.policy.name} Assets: {self.assets} Unchanged: {self.unchanged} " \
+               f"Added: {len(self.added)} Removed: {len(self.removed)} Resumed: {self.resumed} " \
+               f"Failed: {len(self.failed)}{' (dry run)' if self.dry_run else ''}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class RetentionAPI(AuthenticatedAPI):
 
     def __init__(self, username=None, password=None, tenant=None, server=None, use_shared_secret=False,
-                 two_fa_secret_key: str = None, protocol: str = "https", request_hook: Callable = None, credentials_path: str = 'credentials.properties'):
+                 two_fa_secret_key: str = None, protocol: str = "https", request_hook: Callable = None, credentials_path: str = 'credentials.properties',
+                 transport: TransportConfig = None):
         super().__init__(username, password, tenant, server, use_shared_secret, two_fa_secret_key,
-                         protocol, request_hook, credentials_path)
+                         protocol, request_hook, credentials_path, transport)
 
         if self.major_version < 7 and self.minor_version < 2:
             raise RuntimeError("Retention API is only available when connected to a v6.2 System")
 
+        self._catalogue = None
+
+    def policy_catalogue(self, ttl: float = None, max_workers: int = None) -> RetentionPolicyCatalogue:
+        """
+        Return a cached catalogue of the retention policies
+
+        The catalogue is shared by later calls on this client and is refreshed after ttl seconds, or when a policy
+        is created, updated or deleted through this client.
+
+        :param float ttl: The number of seconds before the list of policies is loaded again, 300 by default
+        :param int max_workers: The maximum number of concurrent requests when fetching every policy, 8 by default
+        :return: The policy catalogue
+        :rtype: RetentionPolicyCatalogue
+        """
+        if self._catalogue is None:
+            self._catalogue = RetentionPolicyCatalogue(self)
+        if ttl is not None:
+            self._catalogue.ttl = ttl
+        if max_workers is not None:
+            self._catalogue.max_workers = max_workers
+        return self._catalogue
+
+    def _invalidate_catalogue(self):
+        if self._catalogue is not None:
+            self._catalogue.invalidate()
+
+    def _policy_summaries(self, next_page: str = None, maximum: int = 250) -> Tuple[dict, Union[str, None]]:
+        """
+        Return one page of the policy listing as a dictionary of reference to name, and the URL of the next page
+        """
+        headers = {HEADER_TOKEN: self.token, 'Content-Type': 'application/xml;charset=UTF-8'}
+        if next_page is None:
+            params = {'start': '0', 'max': str(maximum)}
+            request = self.session.get(f'{self.protocol}://{self.server}/api/entity/retention-policies', params=params,
+                                       headers=headers)
+        else:
+            request = self.session.get(next_page, headers=headers)
+        if request.status_code == requests.codes.ok:
+            entity_response = parse_xml(request.content)
+            summaries = {policy.attrib['ref']: policy.attrib['name']
+                         for policy in find_all(entity_response, f'{{{self.entity_ns}}}RetentionPolicy')}
+            next_url = find_first(entity_response, f'{{{self.entity_ns}}}Next')
+            return summaries, text_of(next_url)
+        elif request.status_code == requests.codes.unauthorized:
+            self.token = self.__token__()
+            return self._policy_summaries(next_page, maximum)
+        else:
+            raise RuntimeError(request.status_code, "policies failed")
+
     def policy(self, reference: str) -> RetentionPolicy:
         """
          Return a retention policy by reference
@@ -80,45 +316,24 @@ class RetentionAPI(AuthenticatedAPI):
         request = self.session.get(f'{self.protocol}://{self.server}/api/entity/retention-policies/{reference}',
                                    headers=headers)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            ref = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy/{{{self.rm_ns}}}Ref').text
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            entity_response = parse_xml(request.content)
+            policy_element = find_first(entity_response, f'{{{self.rm_ns}}}RetentionPolicy')
+            tags = {field: f'{{{self.rm_ns}}}{field}' for field in POLICY_FIELDS}
+            fields = child_fields(policy_element, tags.values())
+            values = {field: text_of(fields[tag]) for field, tag in tags.items()}
+            ref = values['Ref']
             assert ref == reference
-            name = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy/{{{self.rm_ns}}}Name').text
-            rp = RetentionPolicy(name, ref)
-            description = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy/{{{self.rm_ns}}}Description').text
-            rp.description = description
-            security_tag = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy/{{{self.rm_ns}}}SecurityTag').text
-            rp.security_tag = security_tag
-            start_date_field = entity_response.find(
-                f'.//{{{self.rm_ns}}}RetentionPolicy/{{{self.rm_ns}}}StartDateField')
-            if start_date_field is not None:
-                rp.start_date_field = start_date_field.text
-            else:
-                rp.start_date_field = None
-            period = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy/{{{self.rm_ns}}}Period')
-            if period is not None:
-                rp.period = period.text
-            else:
-                rp.period = None
-            period_unit = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy/{{{self.rm_ns}}}PeriodUnit')
-            if period_unit is not None:
-                rp.period_unit = period_unit.text
-            else:
-                rp.period_unit = None
-            expiry_action = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy/{{{self.rm_ns}}}ExpiryAction')
-            if expiry_action is not None:
-                rp.expiry_action = expiry_action.text
-            else:
-                rp.expiry_action = None
-            restriction = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy/{{{self.rm_ns}}}Restriction')
-            if restriction is not None:
-                rp.restriction = restriction.text
-            else:
-                rp.restriction = None
-            assignable = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy/{{{self.rm_ns}}}Assignable')
-            rp.assignable = strtobool(assignable.text)
+            rp = RetentionPolicy(values['Name'], ref)
+            rp.description = values['Description']
+            rp.security_tag = values['SecurityTag']
+            rp.start_date_field = values['StartDateField']
+            rp.period = values['Period']
+            rp.period_unit = values['PeriodUnit']
+            rp.expiry_action = values['ExpiryAction']
+            rp.restriction = values['Restriction']
+            rp.assignable = strtobool(values['Assignable'])
             return rp
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
@@ -146,7 +361,7 @@ class RetentionAPI(AuthenticatedAPI):
             f'{self.protocol}://{self.server}/api/entity/retention-policies/{reference}/assignable',
             headers=headers, data=data)
         if request.status_code == requests.codes.ok:
-            pass
+            self._invalidate_catalogue()
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.assignable_policy(reference, status)
@@ -243,6 +458,7 @@ class RetentionAPI(AuthenticatedAPI):
                                    data=xml_request,
                                    headers=headers)
         if request.status_code == requests.codes.ok:
+            self._invalidate_catalogue()
             return self.policy(reference)
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
@@ -338,10 +554,10 @@ class RetentionAPI(AuthenticatedAPI):
         request = self.session.post(f'{self.protocol}://{self.server}/api/entity/retention-policies', data=xml_request,
                                     headers=headers)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            retention_policy = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy')
-            ref = retention_policy.find(f'.//{{{self.rm_ns}}}Ref').text
+            entity_response = parse_xml(request.content)
+            retention_policy = find_first(entity_response, f'{{{self.rm_ns}}}RetentionPolicy')
+            ref = find_first(retention_policy, f'{{{self.rm_ns}}}Ref').text
+            self._invalidate_catalogue()
             return self.policy(ref)
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
@@ -363,7 +579,7 @@ class RetentionAPI(AuthenticatedAPI):
         request = self.session.delete(f'{self.protocol}://{self.server}/api/entity/retention-policies/{reference}',
                                       headers=headers)
         if request.status_code == requests.codes.no_content:
-            pass
+            self._invalidate_catalogue()
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
             return self.delete_policy(reference)
@@ -375,31 +591,16 @@ class RetentionAPI(AuthenticatedAPI):
         """
          Return a retention policy by name
 
+         The policies are looked up in the cached policy_catalogue()
+
         :param name: The policy name
         :type name: str
 
-        :return: The retention policy
+        :return: The retention policy, None if there is no policy with the name
         :rtype: RetentionPolicy
 
          """
-        headers = {HEADER_TOKEN: self.token, 'Content-Type': 'application/xml;charset=UTF-8'}
-        data = {'start': str(0), 'max': "250"}
-        request = self.session.get(f'{self.protocol}://{self.server}/api/entity/retention-policies', data=data,
-                                   headers=headers)
-        if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            for assignment in entity_response.findall(f'.//{{{self.entity_ns}}}RetentionPolicy'):
-                ref = assignment.attrib['ref']
-                policy_name = assignment.attrib['name']
-                if policy_name == name:
-                    return self.policy(reference=ref)
-        elif request.status_code == requests.codes.unauthorized:
-            self.token = self.__token__()
-            return self.policy_by_name(name)
-        else:
-            raise RuntimeError(request.status_code, "policies failed")
+        return self.policy_catalogue().policy_by_name(name)
 
     def policies(self, maximum: int = 250, next_page: str = None) -> PagedSet:
         """
@@ -421,17 +622,15 @@ class RetentionAPI(AuthenticatedAPI):
             request = self.session.get(next_page, headers=headers)
 
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            logger.debug(xml_response)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            entity_response = parse_xml(request.content)
             result = set()
-            next_url = entity_response.find(f'.//{{{self.entity_ns}}}Paging/{{{self.entity_ns}}}Next')
-            total_results = int(entity_response.find(
-                f'.//{{{self.entity_ns}}}TotalResults').text)
-            for assignment in entity_response.findall(f'.//{{{self.entity_ns}}}RetentionPolicy'):
-                ref = assignment.attrib['ref']
-                name = assignment.attrib['name']
-                result.add(self.policy(reference=ref))
+            next_url = find_first(entity_response, f'{{{self.entity_ns}}}Next')
+            total_results = int(find_first(entity_response, f'{{{self.entity_ns}}}TotalResults').text)
+            references = [assignment.attrib['ref'] for assignment in
+                          find_all(entity_response, f'{{{self.entity_ns}}}RetentionPolicy')]
+            result.update(concurrent_map(self.policy, references))
             has_more = True
             url = None
             if next_url is None:
@@ -472,16 +671,14 @@ class RetentionAPI(AuthenticatedAPI):
             headers=headers, data=xml_request)
 
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            api_id = entity_response.find(f'.//{{{self.rm_ns}}}ApiId').text
-            policy_ref = entity_response.find(f'.//{{{self.rm_ns}}}RetentionPolicy').text
-            entity_ref = entity_response.find(f'.//{{{self.rm_ns}}}Entity').text
-            start_date = entity_response.find(f'.//{{{self.rm_ns}}}StartDate')
-            if start_date is not None:
-                start_date = start_date.text
-            else:
-                start_date = None
+            entity_response = parse_xml(request.content)
+            assignment = find_first(entity_response, f'{{{self.rm_ns}}}RetentionAssignment')
+            fields = child_fields(assignment if assignment is not None else entity_response,
+                                  [f'{{{self.rm_ns}}}{field}' for field in ASSIGNMENT_FIELDS])
+            api_id = text_of(fields[f'{{{self.rm_ns}}}ApiId'])
+            policy_ref = text_of(fields[f'{{{self.rm_ns}}}RetentionPolicy'])
+            entity_ref = text_of(fields[f'{{{self.rm_ns}}}Entity'])
+            start_date = text_of(fields[f'{{{self.rm_ns}}}StartDate'])
             assert entity_ref == entity.reference
             assert policy_ref == policy.reference
             return RetentionAssignment(entity_ref, policy_ref, api_id, start_date)
@@ -535,20 +732,17 @@ class RetentionAPI(AuthenticatedAPI):
             f'{self.protocol}://{self.server}/api/entity/{entity.path}/{entity.reference}/retention-assignments',
             headers=headers)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
+            entity_response = parse_xml(request.content)
             result = set()
-            for assignment in entity_response.findall(f'.//{{{self.rm_ns}}}RetentionAssignment'):
-                entity_ref = assignment.find(f'.//{{{self.rm_ns}}}Entity').text
+            tags = [f'{{{self.rm_ns}}}{field}' for field in ASSIGNMENT_FIELDS]
+            for assignment in find_all(entity_response, f'{{{self.rm_ns}}}RetentionAssignment'):
+                fields = child_fields(assignment, tags)
+                entity_ref = text_of(fields[f'{{{self.rm_ns}}}Entity'])
                 assert entity_ref == entity.reference
-                policy = assignment.find(f'.//{{{self.rm_ns}}}RetentionPolicy').text
-                start_date = assignment.find(f'.//{{{self.rm_ns}}}StartDate')
-                if start_date is not None:
-                    start_date = start_date.text
-                else:
-                    start_date = None
-                expired = bool(assignment.find(f'.//{{{self.rm_ns}}}Expired').text == 'true')
-                api_id = assignment.find(f'.//{{{self.rm_ns}}}ApiId').text
+                policy = text_of(fields[f'{{{self.rm_ns}}}RetentionPolicy'])
+                start_date = text_of(fields[f'{{{self.rm_ns}}}StartDate'])
+                expired = bool(text_of(fields[f'{{{self.rm_ns}}}Expired']) == 'true')
+                api_id = text_of(fields[f'{{{self.rm_ns}}}ApiId'])
                 ra = RetentionAssignment(entity_ref, policy, api_id, start_date, expired)
                 result.add(ra)
             return result
@@ -557,3 +751,100 @@ class RetentionAPI(AuthenticatedAPI):
             return self.assignments(entity)
         else:
             raise RuntimeError(request.status_code, "assignments failed")
+
+    def bulk_assign(self, assets: Union[Iterable[Union[Asset, str]], Folder], policy: Union[RetentionPolicy, str],
+                    replace: bool = False, dry_run: bool = False, max_workers: int = 8, journal: str = None,
+                    callback: Callable = None) -> RetentionReport:
+        """
+        Assign a retention policy to many assets
+
+        The current assignments of each asset are fetched and compared with the target policy, so only the assets
+        which are missing the policy are changed. The assets are processed by a pool of worker threads.
+
+        If a journal file is given, the assets which have been updated are recorded in it. Calling bulk_assign()
+        again with the same journal skips those assets, so an interrupted run can be resumed.
+
+        :param assets: An iterable of Assets or asset references, or a Folder whose assets are all assigned
+        :param policy: The RetentionPolicy or its reference
+        :param bool replace: Remove any other retention policies from the assets after the policy is assigned
+        :param bool dry_run: Report the changes without making them
+        :param int max_workers: The maximum number of concurrent requests
+        :param str journal: A SQLite file used to record the assets which have been updated
+        :param callback: Called with the RetentionReport after each asset
+        :return: The changes made, or the changes which would be made for a dry run
+        :rtype: RetentionReport
+        """
+        if isinstance(policy, str):
+            policy = self.policy(policy)
+        if not policy.assignable:
+            msg = f"Retention policy {policy.name} is not assignable"
+            logger.error(msg)
+            raise RuntimeError(msg)
+
+        if isinstance(assets, Folder):
+            from pyPreservica import EntityAPI
+
+            entity_client = EntityAPI(username=self.username, password=self.password, server=self.server,
+                                      tenant=self.tenant, two_fa_secret_key=self.two_fa_secret_key,
+                                      use_shared_secret=self.shared_secret, protocol=self.protocol,
+                                      transport=self.transport)
+            assets = filter(only_assets, entity_client.parallel_descendants(assets, max_workers=max_workers))
+
+        report = RetentionReport(policy, dry_run)
+        connection = None
+        if journal is not None:
+            connection = sqlite3.connect(journal)
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS assignments (reference TEXT, policy TEXT, "
+                                   "PRIMARY KEY (reference, policy))")
+
+        def pending():
+            for asset in assets:
+                if isinstance(asset, str):
+                    asset = Asset(asset, None)
+                if connection is not None and connection.execute(
+                        "SELECT 1 FROM assignments WHERE reference = ? AND policy = ?",
+                        (asset.reference, policy.reference)).fetchone():
+                    report.resumed += 1
+                    continue
+                yield asset
+
+        def assign(asset: Asset):
+            try:
+                current = self.assignments(asset)
+                others = [a for a in current if a.policy_reference != policy.reference] if replace else []
+                added = not any(a.policy_reference == policy.reference for a in current)
+                if not dry_run:
+                    # assign the new policy before removing the old ones, the asset is never left unprotected
+                    if added:
+                        self.add_assignments(asset, policy)
+                    for assignment in others:
+                        self.remove_assignments(assignment)
+                return asset.reference, added, others, None
+            except (RuntimeError, HTTPException) as exception:
+                return asset.reference, False, [], str(exception)
+
+        try:
+            for reference, added, removed, error in concurrent_map(assign, pending(), max_workers=max_workers):
+                report.assets += 1
+                if error is not None:
+                    logger.error(f"Failed to assign retention policy to {reference}: {error}")
+                    report.failed[reference] = error
+                else:
+                    if added:
+                        report.added.append(reference)
+                    report.removed.extend(removed)
+                    if not added and not removed:
+                        report.unchanged += 1
+                    if connection is not None and not dry_run:
+                        connection.execute("INSERT OR IGNORE INTO assignments VALUES (?, ?)",
+                                           (reference, policy.reference))
+                        if report.assets % 100 == 0:
+                            connection.commit()
+                if callback is not None:
+                    callback(report)
+        finally:
+            if connection is not None:
+                connection.commit()
+                connection.close()
+        return report
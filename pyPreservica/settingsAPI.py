@@ -36,6 +36,7 @@ class SettingsAPI(AuthenticatedAPI):
         protocol: str = "https",
         request_hook: Callable = None,
         credentials_path: str = "credentials.properties",
+        transport: TransportConfig = None,
     ):
         super().__init__(
             username,
@@ -47,6 +48,7 @@ class SettingsAPI(AuthenticatedAPI):
             protocol,
             request_hook,
             credentials_path,
+            transport,
         )
 
         if self.major_version < 7 and self.minor_version < 7:
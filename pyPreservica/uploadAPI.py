@@ -10,9 +10,12 @@ licence:    Apache License 2.0
 
 import csv
 import shutil
+import sqlite3
 import tempfile
 import uuid
 import xml
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from time import sleep
 from xml.dom import minidom
@@ -26,13 +29,12 @@ from botocore.session import get_session
 from boto3.s3.transfer import TransferConfig, S3Transfer
 from botocore.config import Config
 from botocore.credentials import RefreshableCredentials
-from botocore.exceptions import ClientError, NoCredentialsError, PartialCredentialsError
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError, PartialCredentialsError
 from dateutil.tz import tzlocal
 from s3transfer import S3UploadFailedError
 from tqdm import tqdm
 
 from pyPreservica.common import *
-from pyPreservica.common import _make_stored_zipfile
 
 logger = logging.getLogger(__name__)
 
@@ -179,7 +181,110 @@ def __make_generation__(xip, filename, co_ref, generation_label, location=None):
     SubElement(generation, "xip:Properties")
 
 
-def __make_bitstream__(xip, file_name, full_path, callback, location=None):
+class _PackageWriter:
+    """
+    Writes a submission package straight into a zip file
+
+    Content files are streamed into the archive from their original location and metadata.xml is written from
+    memory, so the package does not need a staging folder. Entries are placed under a top level folder named
+    after the package, the same layout shutil.make_archive created from the staging folder.
+    """
+
+    def __init__(self, zip_path, root, compress=True, folders=()):
+        # zip_path can also be a writable stream, in which case nothing is written to disk
+        self.zip_path = zip_path if isinstance(zip_path, (str, os.PathLike)) else None
+        self.root = root
+        self.compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self.zip_file = zipfile.ZipFile(zip_path, "w", compression=self.compression, allowZip64=True)
+        self.names = set()
+        self._folder(root)
+        for folder in folders:
+            self._folder(f"{root}/{folder}")
+
+    def _folder(self, name):
+        parts = name.split("/")
+        for i in range(1, len(parts) + 1):
+            folder = "/".join(parts[:i]) + "/"
+            if folder not in self.names:
+                self.names.add(folder)
+                zip_info = zipfile.ZipInfo(folder, datetime.now().timetuple()[:6])
+                zip_info.external_attr = (0o40775 << 16) | 0x10
+                self.zip_file.writestr(zip_info, b"")
+
+    def open(self, full_path, arcname):
+        name = f"{self.root}/{arcname}"
+        self._folder(name.rsplit("/", 1)[0])
+        self.names.add(name)
+        zip_info = zipfile.ZipInfo.from_file(full_path, name)
+        zip_info.compress_type = self.compression
+        return self.zip_file.open(zip_info, "w")
+
+    def write(self, full_path, arcname):
+        with open(full_path, "rb") as src, self.open(full_path, arcname) as dst:
+            shutil.copyfileobj(src, dst, FIXITY_BLOCK_SIZE)
+
+    def writestr(self, arcname, data: str):
+        zip_info = zipfile.ZipInfo(f"{self.root}/{arcname}", datetime.now().timetuple()[:6])
+        zip_info.compress_type = self.compression
+        zip_info.external_attr = 0o644 << 16
+        self.zip_file.writestr(zip_info, data.encode("utf-8"))
+
+    def close(self):
+        self.zip_file.close()
+
+    def abort(self):
+        try:
+            self.zip_file.close()
+        except (OSError, ValueError, RuntimeError):
+            pass
+        if self.zip_path is not None and os.path.exists(self.zip_path):
+            os.remove(self.zip_path)
+
+
+def __fixity_for_files__(callback, files, writer, max_workers=None):
+    """
+    Compute the fixity values of a list of (source path, package path) pairs and add the files to the package
+
+    When the callback is a MultiFixityCallBack each file is hashed while it is streamed into the package, so it is
+    only read once. Other callbacks are run first, one at a time unless max_workers is given, and the files are
+    then streamed into the package.
+
+    :return: A dict of fixity results by source path
+    """
+    fused = isinstance(callback, MultiFixityCallBack)
+    if max_workers is None:
+        max_workers = 4 if fused else 1
+    # when two sources share a package path the last one wins, as it would with sequential copies
+    package = {}
+    for full_path, arcname in files:
+        package.pop(arcname, None)
+        package[arcname] = full_path
+
+    fixities = {}
+    if fused:
+        for arcname, full_path in package.items():
+            if full_path in fixities:
+                writer.write(full_path, arcname)
+            else:
+                with writer.open(full_path, arcname) as dst:
+                    fixities[full_path] = callback.copy(os.path.basename(full_path), full_path, dst)
+
+    def fixity(full_path):
+        return full_path, callback(os.path.basename(full_path), full_path)
+
+    remaining = [full_path for full_path in dict.fromkeys(f for f, a in files) if full_path not in fixities]
+    if max_workers > 1:
+        fixities.update(concurrent_map(fixity, remaining, max_workers=max_workers))
+    else:
+        fixities.update(fixity(full_path) for full_path in remaining)
+
+    if not fused:
+        for arcname, full_path in package.items():
+            writer.write(full_path, arcname)
+    return fixities
+
+
+def __make_bitstream__(xip, file_name, full_path, callback, location=None, fixity_result=None):
     bitstream = SubElement(xip, 'xip:Bitstream')
     filename_element = SubElement(bitstream, "xip:Filename")
     filename_element.text = file_name
@@ -189,7 +294,8 @@ def __make_bitstream__(xip, file_name, full_path, callback, location=None):
     physical_location = SubElement(bitstream, "xip:PhysicalLocation")
     physical_location.text = location
     fixities = SubElement(bitstream, "xip:Fixities")
-    fixity_result = callback(file_name, full_path)
+    if fixity_result is None:
+        fixity_result = callback(file_name, full_path)
     if type(fixity_result) == tuple:
         fixity = SubElement(fixities, "xip:Fixity")
         fixity_algorithm_ref = SubElement(fixity, "xip:FixityAlgorithmRef")
@@ -504,9 +610,6 @@ def generic_asset_package(preservation_files_dict=None, access_files_dict=None,
     security_tag = kwargs.get('SecurityTag', "open")
     content_type = kwargs.get('CustomType', "")
 
-    if not compress:
-        shutil.register_archive_format(name="szip", function=_make_stored_zipfile, extra_args=None, description="UnCompressed ZIP file")
-
     has_preservation_files = bool((preservation_files_dict is not None) and (len(preservation_files_dict) > 0))
     has_access_files = bool((access_files_dict is not None) and (len(access_files_dict) > 0))
 
@@ -604,107 +707,98 @@ def generic_asset_package(preservation_files_dict=None, access_files_dict=None,
                 access_file_name = os.path.basename(filename)
                 __make_generation__(xip, access_file_name, content_ref, access_generation_label, location)
 
-    if has_preservation_files:
+    if xip is None:
+        return None
 
-        if 'Preservation_files_fixity_callback' in kwargs:
-            callback = kwargs.get('Preservation_files_fixity_callback')
-        else:
-            callback = Sha1FixityCallBack()
-        for representation_name in preservation_representation_refs_dict.keys():
-            location = sanitize(representation_name)
-            preservation_refs_dict = preservation_representation_refs_dict[representation_name]
-            for content_ref, filename in preservation_refs_dict.items():
-                preservation_file_name = os.path.basename(filename)
-                __make_bitstream__(xip, preservation_file_name, filename, callback, location)
+    writer = _PackageWriter(kwargs.get('Package_stream', os.path.join(export_folder, io_ref) + ".zip"), io_ref,
+                            compress)
+    try:
+        fixity_max_workers = kwargs.get('Fixity_max_workers', None)
 
-    if has_access_files:
+        if has_preservation_files:
 
-        if 'Access_files_fixity_callback' in kwargs:
-            callback = kwargs.get('Access_files_fixity_callback')
-        else:
-            callback = Sha1FixityCallBack()
+            if 'Preservation_files_fixity_callback' in kwargs:
+                callback = kwargs.get('Preservation_files_fixity_callback')
+            else:
+                callback = Sha1FixityCallBack()
+            files = []
+            for representation_name in preservation_representation_refs_dict.keys():
+                location = sanitize(representation_name)
+                for filename in preservation_representation_refs_dict[representation_name].values():
+                    files.append((filename, f"{CONTENT_FOLDER}/{location}/{os.path.basename(filename)}"))
+            fixities = __fixity_for_files__(callback, files, writer, fixity_max_workers)
+            for representation_name in preservation_representation_refs_dict.keys():
+                location = sanitize(representation_name)
+                preservation_refs_dict = preservation_representation_refs_dict[representation_name]
+                for content_ref, filename in preservation_refs_dict.items():
+                    preservation_file_name = os.path.basename(filename)
+                    __make_bitstream__(xip, preservation_file_name, filename, callback, location, fixities[filename])
+
+        if has_access_files:
+
+            if 'Access_files_fixity_callback' in kwargs:
+                callback = kwargs.get('Access_files_fixity_callback')
+            else:
+                callback = Sha1FixityCallBack()
+            files = []
+            for representation_name in access_representation_refs_dict.keys():
+                location = sanitize(representation_name)
+                for filename in access_representation_refs_dict[representation_name].values():
+                    files.append((filename, f"{CONTENT_FOLDER}/{location}/{os.path.basename(filename)}"))
+            fixities = __fixity_for_files__(callback, files, writer, fixity_max_workers)
+            for representation_name in access_representation_refs_dict.keys():
+                location = sanitize(representation_name)
+                access_refs_dict = access_representation_refs_dict[representation_name]
+                for content_ref, filename in access_refs_dict.items():
+                    access_file_name = os.path.basename(filename)
+                    __make_bitstream__(xip, access_file_name, filename, callback, location, fixities[filename])
 
-        for representation_name in access_representation_refs_dict.keys():
-            location = sanitize(representation_name)
-            access_refs_dict = access_representation_refs_dict[representation_name]
-            for content_ref, filename in access_refs_dict.items():
-                access_file_name = os.path.basename(filename)
-                __make_bitstream__(xip, access_file_name, filename, callback, location)
-
-    if 'Identifiers' in kwargs:
-        identifier_map = kwargs.get('Identifiers')
-        for identifier_key, identifier_value in identifier_map.items():
-            if identifier_key:
-                if identifier_value:
-                    identifier = SubElement(xip, 'xip:Identifier')
-                    id_type = SubElement(identifier, "xip:Type")
-                    id_type.text = identifier_key
-                    id_value = SubElement(identifier, "xip:Value")
-                    id_value.text = identifier_value
-                    id_io = SubElement(identifier, "xip:Entity")
-                    id_io.text = io_ref
-
-    if 'Asset_Metadata' in kwargs:
-        metadata_map = kwargs.get('Asset_Metadata')
-        for metadata_ns, metadata_path in metadata_map.items():
-            if metadata_ns:
-                if metadata_path:
-                    if os.path.exists(metadata_path) and os.path.isfile(metadata_path):
-                        descriptive_metadata = xml.etree.ElementTree.parse(source=metadata_path)
-                        metadata = SubElement(xip, 'xip:Metadata', {'schemaUri': metadata_ns})
-                        metadata_ref = SubElement(metadata, 'xip:Ref')
-                        metadata_ref.text = str(uuid.uuid4())
-                        entity = SubElement(metadata, 'xip:Entity')
-                        entity.text = io_ref
-                        content = SubElement(metadata, 'xip:Content')
-                        content.append(descriptive_metadata.getroot())
-                    elif isinstance(metadata_path, str):
-                        try:
-                            descriptive_metadata = xml.etree.ElementTree.fromstring(metadata_path)
+        if 'Identifiers' in kwargs:
+            identifier_map = kwargs.get('Identifiers')
+            for identifier_key, identifier_value in identifier_map.items():
+                if identifier_key:
+                    if identifier_value:
+                        identifier = SubElement(xip, 'xip:Identifier')
+                        id_type = SubElement(identifier, "xip:Type")
+                        id_type.text = identifier_key
+                        id_value = SubElement(identifier, "xip:Value")
+                        id_value.text = identifier_value
+                        id_io = SubElement(identifier, "xip:Entity")
+                        id_io.text = io_ref
+
+        if 'Asset_Metadata' in kwargs:
+            metadata_map = kwargs.get('Asset_Metadata')
+            for metadata_ns, metadata_path in metadata_map.items():
+                if metadata_ns:
+                    if metadata_path:
+                        if os.path.exists(metadata_path) and os.path.isfile(metadata_path):
+                            descriptive_metadata = xml.etree.ElementTree.parse(source=metadata_path)
                             metadata = SubElement(xip, 'xip:Metadata', {'schemaUri': metadata_ns})
                             metadata_ref = SubElement(metadata, 'xip:Ref')
                             metadata_ref.text = str(uuid.uuid4())
                             entity = SubElement(metadata, 'xip:Entity')
                             entity.text = io_ref
                             content = SubElement(metadata, 'xip:Content')
-                            content.append(descriptive_metadata)
-                        except RuntimeError:
-                            logging.info(f"Could not parse asset metadata in namespace {metadata_ns}")
-
-    if xip is not None:
-        export_folder = export_folder
-        top_level_folder = os.path.join(export_folder, io_ref)
-        os.mkdir(top_level_folder)
-        inner_folder = os.path.join(top_level_folder, io_ref)
-        os.mkdir(inner_folder)
-        content_folder = os.path.join(inner_folder, CONTENT_FOLDER)
-        os.mkdir(content_folder)
-        metadata_path = os.path.join(inner_folder, "metadata.xml")
-        metadata = open(metadata_path, "wt", encoding='utf-8')
-        metadata.write(prettify(xip))
-        metadata.close()
-        for representation_name in preservation_representation_refs_dict.keys():
-            location = sanitize(representation_name)
-            Path(os.path.join(content_folder, location)).mkdir(parents=True, exist_ok=True)
-            preservation_refs_dict = preservation_representation_refs_dict[representation_name]
-            for content_ref, filename in preservation_refs_dict.items():
-                src_file = filename
-                dst_file = os.path.join(os.path.join(content_folder, location), os.path.basename(filename))
-                shutil.copyfile(src_file, dst_file)
-        for representation_name in access_representation_refs_dict.keys():
-            location = sanitize(representation_name)
-            Path(os.path.join(content_folder, location)).mkdir(parents=True, exist_ok=True)
-            access_refs_dict = access_representation_refs_dict[representation_name]
-            for content_ref, filename in access_refs_dict.items():
-                src_file = filename
-                dst_file = os.path.join(os.path.join(content_folder, location), os.path.basename(filename))
-                shutil.copyfile(src_file, dst_file)
-        if compress:
-            shutil.make_archive(top_level_folder, 'zip', top_level_folder)
-        else:
-            shutil.make_archive(top_level_folder, 'szip', top_level_folder)
-        shutil.rmtree(top_level_folder)
-        return top_level_folder + ".zip"
+                            content.append(descriptive_metadata.getroot())
+                        elif isinstance(metadata_path, str):
+                            try:
+                                descriptive_metadata = xml.etree.ElementTree.fromstring(metadata_path)
+                                metadata = SubElement(xip, 'xip:Metadata', {'schemaUri': metadata_ns})
+                                metadata_ref = SubElement(metadata, 'xip:Ref')
+                                metadata_ref.text = str(uuid.uuid4())
+                                entity = SubElement(metadata, 'xip:Entity')
+                                entity.text = io_ref
+                                content = SubElement(metadata, 'xip:Content')
+                                content.append(descriptive_metadata)
+                            except RuntimeError:
+                                logging.info(f"Could not parse asset metadata in namespace {metadata_ns}")
+
+        writer.writestr("metadata.xml", prettify(xip))
+        writer.close()
+        return writer.zip_path
+    except BaseException:
+        writer.abort()
+        raise
 
 
 def multi_asset_package(asset_file_list=None, export_folder=None, parent_folder=None, compress=True, **kwargs):
@@ -733,125 +827,112 @@ def multi_asset_package(asset_file_list=None, export_folder=None, parent_folder=
     security_tag = kwargs.get('SecurityTag', "open")
     content_type = kwargs.get('CustomType', "")
 
-    if not compress:
-        shutil.register_archive_format("szip", _make_stored_zipfile, None, "UnCompressed ZIP file")
-
     if 'Preservation_files_fixity_callback' in kwargs:
         fixity_callback = kwargs.get('Preservation_files_fixity_callback')
     else:
         fixity_callback = Sha1FixityCallBack()
 
     package_id = str(uuid.uuid4())
-    export_folder = export_folder
-    top_level_folder = os.path.join(export_folder, package_id)
-    os.mkdir(top_level_folder)
-    inner_folder = os.path.join(top_level_folder, package_id)
-    os.mkdir(inner_folder)
-    os.mkdir(os.path.join(inner_folder, CONTENT_FOLDER))
-
-    asset_map = dict()
-    xip = Element('xip:XIP')
-    xip.set('xmlns:xip', 'http://preservica.com/XIP/v6.0')
-    for file in asset_file_list:
-        default_asset_title = os.path.splitext(os.path.basename(file))[0]
-        xip, io_ref = __create_io__(xip, file_name=default_asset_title, parent_folder=parent_folder, **kwargs)
-        asset_map[file] = io_ref
-        representation = SubElement(xip, 'xip:Representation')
-        io_link = SubElement(representation, 'xip:InformationObject')
-        io_link.text = io_ref
-        access_name = SubElement(representation, 'xip:Name')
-        access_name.text = "Preservation"
-        access_type = SubElement(representation, 'xip:Type')
-        access_type.text = "Preservation"
-        content_objects = SubElement(representation, 'xip:ContentObjects')
-        content_object = SubElement(content_objects, 'xip:ContentObject')
-        content_object_ref = str(uuid.uuid4())
-        content_object.text = content_object_ref
+    writer = _PackageWriter(kwargs.get('Package_stream', os.path.join(export_folder, package_id) + ".zip"),
+                            package_id, compress)
+    try:
+        files = [(file, f"{CONTENT_FOLDER}/{os.path.basename(file)}") for file in asset_file_list]
+        fixity_results = __fixity_for_files__(fixity_callback, files, writer, kwargs.get('Fixity_max_workers', None))
 
-        default_content_objects_title = os.path.splitext(os.path.basename(file))[0]
-        content_object = SubElement(xip, 'xip:ContentObject')
-        ref_element = SubElement(content_object, "xip:Ref")
-        ref_element.text = content_object_ref
-        title = SubElement(content_object, "xip:Title")
-        title.text = default_content_objects_title
-        description = SubElement(content_object, "xip:Description")
-        description.text = default_content_objects_title
-        security_tag_element = SubElement(content_object, "xip:SecurityTag")
-        security_tag_element.text = security_tag
-        custom_type = SubElement(content_object, "xip:CustomType")
-        custom_type.text = content_type
-        parent = SubElement(content_object, "xip:Parent")
-        parent.text = io_ref
-
-        generation = SubElement(xip, 'xip:Generation', {"original": "true", "active": "true"})
-        content_object = SubElement(generation, "xip:ContentObject")
-        content_object.text = content_object_ref
-        label = SubElement(generation, "xip:Label")
-        label.text = os.path.splitext(os.path.basename(file))[0]
-        effective_date = SubElement(generation, "xip:EffectiveDate")
-        effective_date.text = datetime.now().isoformat()
-        bitstreams = SubElement(generation, "xip:Bitstreams")
-        bitstream = SubElement(bitstreams, "xip:Bitstream")
-        bitstream.text = os.path.basename(file)
-        SubElement(generation, "xip:Formats")
-        SubElement(generation, "xip:Properties")
-
-        bitstream = SubElement(xip, 'xip:Bitstream')
-        filename_element = SubElement(bitstream, "xip:Filename")
-        filename_element.text = os.path.basename(file)
-        filesize = SubElement(bitstream, "xip:FileSize")
-        file_stats = os.stat(file)
-        filesize.text = str(file_stats.st_size)
-        physical_location = SubElement(bitstream, "xip:PhysicalLocation")
-        fixities = SubElement(bitstream, "xip:Fixities")
-        fixity_result = fixity_callback(filename_element.text, file)
-        if type(fixity_result) == tuple:
-            fixity = SubElement(fixities, "xip:Fixity")
-            fixity_algorithm_ref = SubElement(fixity, "xip:FixityAlgorithmRef")
-            fixity_value = SubElement(fixity, "xip:FixityValue")
-            fixity_algorithm_ref.text = fixity_result[0]
-            fixity_value.text = fixity_result[1]
-        elif type(fixity_result) == dict:
-            for key, val in fixity_result.items():
+        asset_map = dict()
+        xip = Element('xip:XIP')
+        xip.set('xmlns:xip', 'http://preservica.com/XIP/v6.0')
+        for file in asset_file_list:
+            default_asset_title = os.path.splitext(os.path.basename(file))[0]
+            xip, io_ref = __create_io__(xip, file_name=default_asset_title, parent_folder=parent_folder, **kwargs)
+            asset_map[file] = io_ref
+            representation = SubElement(xip, 'xip:Representation')
+            io_link = SubElement(representation, 'xip:InformationObject')
+            io_link.text = io_ref
+            access_name = SubElement(representation, 'xip:Name')
+            access_name.text = "Preservation"
+            access_type = SubElement(representation, 'xip:Type')
+            access_type.text = "Preservation"
+            content_objects = SubElement(representation, 'xip:ContentObjects')
+            content_object = SubElement(content_objects, 'xip:ContentObject')
+            content_object_ref = str(uuid.uuid4())
+            content_object.text = content_object_ref
+
+            default_content_objects_title = os.path.splitext(os.path.basename(file))[0]
+            content_object = SubElement(xip, 'xip:ContentObject')
+            ref_element = SubElement(content_object, "xip:Ref")
+            ref_element.text = content_object_ref
+            title = SubElement(content_object, "xip:Title")
+            title.text = default_content_objects_title
+            description = SubElement(content_object, "xip:Description")
+            description.text = default_content_objects_title
+            security_tag_element = SubElement(content_object, "xip:SecurityTag")
+            security_tag_element.text = security_tag
+            custom_type = SubElement(content_object, "xip:CustomType")
+            custom_type.text = content_type
+            parent = SubElement(content_object, "xip:Parent")
+            parent.text = io_ref
+
+            generation = SubElement(xip, 'xip:Generation', {"original": "true", "active": "true"})
+            content_object = SubElement(generation, "xip:ContentObject")
+            content_object.text = content_object_ref
+            label = SubElement(generation, "xip:Label")
+            label.text = os.path.splitext(os.path.basename(file))[0]
+            effective_date = SubElement(generation, "xip:EffectiveDate")
+            effective_date.text = datetime.now().isoformat()
+            bitstreams = SubElement(generation, "xip:Bitstreams")
+            bitstream = SubElement(bitstreams, "xip:Bitstream")
+            bitstream.text = os.path.basename(file)
+            SubElement(generation, "xip:Formats")
+            SubElement(generation, "xip:Properties")
+
+            bitstream = SubElement(xip, 'xip:Bitstream')
+            filename_element = SubElement(bitstream, "xip:Filename")
+            filename_element.text = os.path.basename(file)
+            filesize = SubElement(bitstream, "xip:FileSize")
+            file_stats = os.stat(file)
+            filesize.text = str(file_stats.st_size)
+            physical_location = SubElement(bitstream, "xip:PhysicalLocation")
+            fixities = SubElement(bitstream, "xip:Fixities")
+            fixity_result = fixity_results[file]
+            if type(fixity_result) == tuple:
                 fixity = SubElement(fixities, "xip:Fixity")
                 fixity_algorithm_ref = SubElement(fixity, "xip:FixityAlgorithmRef")
                 fixity_value = SubElement(fixity, "xip:FixityValue")
-                fixity_algorithm_ref.text = key
-                fixity_value.text = val
-        else:
-            logger.error("Could Not Find Fixity Value")
-            raise RuntimeError("Could Not Find Fixity Value")
+                fixity_algorithm_ref.text = fixity_result[0]
+                fixity_value.text = fixity_result[1]
+            elif type(fixity_result) == dict:
+                for key, val in fixity_result.items():
+                    fixity = SubElement(fixities, "xip:Fixity")
+                    fixity_algorithm_ref = SubElement(fixity, "xip:FixityAlgorithmRef")
+                    fixity_value = SubElement(fixity, "xip:FixityValue")
+                    fixity_algorithm_ref.text = key
+                    fixity_value.text = val
+            else:
+                logger.error("Could Not Find Fixity Value")
+                raise RuntimeError("Could Not Find Fixity Value")
 
-        if 'Identifiers' in kwargs:
-            identifier_map = kwargs.get('Identifiers')
-            if str(file) in identifier_map:
-                identifier_map_values = identifier_map[str(file)]
-                for identifier_key, identifier_value in identifier_map_values.items():
-                    if identifier_key:
-                        if identifier_value:
-                            identifier = SubElement(xip, 'xip:Identifier')
-                            id_type = SubElement(identifier, "xip:Type")
-                            id_type.text = identifier_key
-                            id_value = SubElement(identifier, "xip:Value")
-                            id_value.text = identifier_value
-                            id_io = SubElement(identifier, "xip:Entity")
-                            id_io.text = io_ref
-
-        src_file = file
-        dst_file = os.path.join(os.path.join(inner_folder, CONTENT_FOLDER), os.path.basename(file))
-        shutil.copyfile(src_file, dst_file)
-
-    if xip is not None:
-        metadata_path = os.path.join(inner_folder, "metadata.xml")
-        metadata = open(metadata_path, "wt", encoding='utf-8')
-        metadata.write(prettify(xip))
-        metadata.close()
-        if compress:
-            shutil.make_archive(top_level_folder, 'zip', top_level_folder)
-        else:
-            shutil.make_archive(top_level_folder, 'szip', top_level_folder)
-        shutil.rmtree(top_level_folder)
-        return top_level_folder + ".zip"
+            if 'Identifiers' in kwargs:
+                identifier_map = kwargs.get('Identifiers')
+                if str(file) in identifier_map:
+                    identifier_map_values = identifier_map[str(file)]
+                    for identifier_key, identifier_value in identifier_map_values.items():
+                        if identifier_key:
+                            if identifier_value:
+                                identifier = SubElement(xip, 'xip:Identifier')
+                                id_type = SubElement(identifier, "xip:Type")
+                                id_type.text = identifier_key
+                                id_value = SubElement(identifier, "xip:Value")
+                                id_value.text = identifier_value
+                                id_io = SubElement(identifier, "xip:Entity")
+                                id_io.text = io_ref
+
+        writer.writestr("metadata.xml", prettify(xip))
+        writer.close()
+        return writer.zip_path
+    except BaseException:
+        writer.abort()
+        raise
 
 
 def complex_asset_package(preservation_files_list=None, access_files_list=None, export_folder=None, parent_folder=None,
@@ -900,6 +981,8 @@ def complex_asset_package(preservation_files_list=None, access_files_list=None,
         'Identifiers'                           Map of asset identifiers
         'Preservation_files_fixity_callback'    Callback to allow external generated fixity values
         'Access_files_fixity_callback'          Callback to allow external generated fixity values
+        'Fixity_max_workers'                    Number of files to hash at the same time
+        'Package_stream'                        Write the package zip to this stream instead of the export folder
         'IO_Identifier_callback'                Callback to allow external generated Asset identifier
         'Preservation_Representation_Name'      Name of the Preservation Representation
         'Access_Representation_Name'            Name of the Access Representation
@@ -925,9 +1008,6 @@ def complex_asset_package(preservation_files_list=None, access_files_list=None,
     security_tag = kwargs.get('SecurityTag', "open")
     content_type = kwargs.get('CustomType', "")
 
-    if not compress:
-        shutil.register_archive_format("szip", _make_stored_zipfile, None, "UnCompressed ZIP file")
-
     has_preservation_files = bool((preservation_files_list is not None) and (len(preservation_files_list) > 0))
     has_access_files = bool((access_files_list is not None) and (len(access_files_list) > 0))
 
@@ -1016,71 +1096,61 @@ def complex_asset_package(preservation_files_list=None, access_files_list=None,
             access_file_name = os.path.basename(filename)
             __make_generation__(xip, access_file_name, content_ref, access_generation_label, ACCESS_CONTENT_FOLDER)
 
-    if has_preservation_files:
+    writer = _PackageWriter(kwargs.get('Package_stream', os.path.join(export_folder, io_ref) + ".zip"), io_ref,
+                            compress,
+                            [f"{CONTENT_FOLDER}/{PRESERVATION_CONTENT_FOLDER}", f"{CONTENT_FOLDER}/{ACCESS_CONTENT_FOLDER}"])
+    try:
+        fixity_max_workers = kwargs.get('Fixity_max_workers', None)
 
-        if 'Preservation_files_fixity_callback' in kwargs:
-            callback = kwargs.get('Preservation_files_fixity_callback')
-        else:
-            callback = Sha1FixityCallBack()
+        if has_preservation_files:
 
-        for content_ref, filename in preservation_refs_dict.items():
-            preservation_file_name = os.path.basename(filename)
-            __make_bitstream__(xip, preservation_file_name, filename, callback, PRESERVATION_CONTENT_FOLDER)
+            if 'Preservation_files_fixity_callback' in kwargs:
+                callback = kwargs.get('Preservation_files_fixity_callback')
+            else:
+                callback = Sha1FixityCallBack()
 
-    if has_access_files:
+            files = [(filename, f"{CONTENT_FOLDER}/{PRESERVATION_CONTENT_FOLDER}/{os.path.basename(filename)}")
+                     for filename in preservation_refs_dict.values()]
+            fixities = __fixity_for_files__(callback, files, writer, fixity_max_workers)
+            for content_ref, filename in preservation_refs_dict.items():
+                preservation_file_name = os.path.basename(filename)
+                __make_bitstream__(xip, preservation_file_name, filename, callback, PRESERVATION_CONTENT_FOLDER,
+                                   fixities[filename])
 
-        if 'Access_files_fixity_callback' in kwargs:
-            callback = kwargs.get('Access_files_fixity_callback')
-        else:
-            callback = Sha1FixityCallBack()
+        if has_access_files:
 
-        for content_ref, filename in access_refs_dict.items():
-            access_file_name = os.path.basename(filename)
-            __make_bitstream__(xip, access_file_name, filename, callback, ACCESS_CONTENT_FOLDER)
-
-    if 'Identifiers' in kwargs:
-        identifier_map = kwargs.get('Identifiers')
-        for identifier_key, identifier_value in identifier_map.items():
-            if identifier_key:
-                if identifier_value:
-                    identifier = SubElement(xip, 'xip:Identifier')
-                    id_type = SubElement(identifier, "xip:Type")
-                    id_type.text = identifier_key
-                    id_value = SubElement(identifier, "xip:Value")
-                    id_value.text = identifier_value
-                    id_io = SubElement(identifier, "xip:Entity")
-                    id_io.text = io_ref
-
-    if 'Asset_Metadata' in kwargs:
-        metadata_map = kwargs.get('Asset_Metadata')
-        for metadata_ns, metadata_path in metadata_map.items():
-            if metadata_ns:
-                if metadata_path and isinstance(metadata_path, str):
-                    if os.path.exists(metadata_path) and os.path.isfile(metadata_path):
-                        descriptive_metadata = xml.etree.ElementTree.parse(source=metadata_path)
-                        metadata = SubElement(xip, 'xip:Metadata', {'schemaUri': metadata_ns})
-                        metadata_ref = SubElement(metadata, 'xip:Ref')
-                        metadata_ref.text = str(uuid.uuid4())
-                        entity = SubElement(metadata, 'xip:Entity')
-                        entity.text = io_ref
-                        content = SubElement(metadata, 'xip:Content')
-                        content.append(descriptive_metadata.getroot())
-                    elif isinstance(metadata_path, str):
-                        try:
-                            descriptive_metadata = xml.etree.ElementTree.fromstring(metadata_path)
-                            metadata = SubElement(xip, 'xip:Metadata', {'schemaUri': metadata_ns})
-                            metadata_ref = SubElement(metadata, 'xip:Ref')
-                            metadata_ref.text = str(uuid.uuid4())
-                            entity = SubElement(metadata, 'xip:Entity')
-                            entity.text = io_ref
-                            content = SubElement(metadata, 'xip:Content')
-                            content.append(descriptive_metadata)
-                        except RuntimeError:
-                            logging.info(f"Could not parse asset metadata in namespace {metadata_ns}")
-                if metadata_path and isinstance(metadata_path, list):
-                    for path in metadata_path:
-                        if os.path.exists(path) and os.path.isfile(path):
-                            descriptive_metadata = xml.etree.ElementTree.parse(source=path)
+            if 'Access_files_fixity_callback' in kwargs:
+                callback = kwargs.get('Access_files_fixity_callback')
+            else:
+                callback = Sha1FixityCallBack()
+
+            files = [(filename, f"{CONTENT_FOLDER}/{ACCESS_CONTENT_FOLDER}/{os.path.basename(filename)}")
+                     for filename in access_refs_dict.values()]
+            fixities = __fixity_for_files__(callback, files, writer, fixity_max_workers)
+            for content_ref, filename in access_refs_dict.items():
+                access_file_name = os.path.basename(filename)
+                __make_bitstream__(xip, access_file_name, filename, callback, ACCESS_CONTENT_FOLDER, fixities[filename])
+
+        if 'Identifiers' in kwargs:
+            identifier_map = kwargs.get('Identifiers')
+            for identifier_key, identifier_value in identifier_map.items():
+                if identifier_key:
+                    if identifier_value:
+                        identifier = SubElement(xip, 'xip:Identifier')
+                        id_type = SubElement(identifier, "xip:Type")
+                        id_type.text = identifier_key
+                        id_value = SubElement(identifier, "xip:Value")
+                        id_value.text = identifier_value
+                        id_io = SubElement(identifier, "xip:Entity")
+                        id_io.text = io_ref
+
+        if 'Asset_Metadata' in kwargs:
+            metadata_map = kwargs.get('Asset_Metadata')
+            for metadata_ns, metadata_path in metadata_map.items():
+                if metadata_ns:
+                    if metadata_path and isinstance(metadata_path, str):
+                        if os.path.exists(metadata_path) and os.path.isfile(metadata_path):
+                            descriptive_metadata = xml.etree.ElementTree.parse(source=metadata_path)
                             metadata = SubElement(xip, 'xip:Metadata', {'schemaUri': metadata_ns})
                             metadata_ref = SubElement(metadata, 'xip:Ref')
                             metadata_ref.text = str(uuid.uuid4())
@@ -1088,37 +1158,36 @@ def complex_asset_package(preservation_files_list=None, access_files_list=None,
                             entity.text = io_ref
                             content = SubElement(metadata, 'xip:Content')
                             content.append(descriptive_metadata.getroot())
-
-    if xip is not None:
-        export_folder = export_folder
-        top_level_folder = os.path.join(export_folder, io_ref)
-        os.mkdir(top_level_folder)
-        inner_folder = os.path.join(top_level_folder, io_ref)
-        os.mkdir(inner_folder)
-        content_folder = os.path.join(inner_folder, CONTENT_FOLDER)
-        os.mkdir(content_folder)
-        preservation_content_folder = os.path.join(content_folder, PRESERVATION_CONTENT_FOLDER)
-        os.mkdir(preservation_content_folder)
-        access_content_folder = os.path.join(content_folder, ACCESS_CONTENT_FOLDER)
-        os.mkdir(access_content_folder)
-        metadata_path = os.path.join(inner_folder, "metadata.xml")
-        metadata = open(metadata_path, "wt", encoding='utf-8')
-        metadata.write(prettify(xip))
-        metadata.close()
-        for content_ref, filename in preservation_refs_dict.items():
-            src_file = filename
-            dst_file = os.path.join(preservation_content_folder, os.path.basename(filename))
-            shutil.copyfile(src_file, dst_file)
-        for content_ref, filename in access_refs_dict.items():
-            src_file = filename
-            dst_file = os.path.join(access_content_folder, os.path.basename(filename))
-            shutil.copyfile(src_file, dst_file)
-        if compress:
-            shutil.make_archive(top_level_folder, 'zip', top_level_folder)
-        else:
-            shutil.make_archive(top_level_folder, 'szip', top_level_folder)
-        shutil.rmtree(top_level_folder)
-        return top_level_folder + ".zip"
+                        elif isinstance(metadata_path, str):
+                            try:
+                                descriptive_metadata = xml.etree.ElementTree.fromstring(metadata_path)
+                                metadata = SubElement(xip, 'xip:Metadata', {'schemaUri': metadata_ns})
+                                metadata_ref = SubElement(metadata, 'xip:Ref')
+                                metadata_ref.text = str(uuid.uuid4())
+                                entity = SubElement(metadata, 'xip:Entity')
+                                entity.text = io_ref
+                                content = SubElement(metadata, 'xip:Content')
+                                content.append(descriptive_metadata)
+                            except RuntimeError:
+                                logging.info(f"Could not parse asset metadata in namespace {metadata_ns}")
+                    if metadata_path and isinstance(metadata_path, list):
+                        for path in metadata_path:
+                            if os.path.exists(path) and os.path.isfile(path):
+                                descriptive_metadata = xml.etree.ElementTree.parse(source=path)
+                                metadata = SubElement(xip, 'xip:Metadata', {'schemaUri': metadata_ns})
+                                metadata_ref = SubElement(metadata, 'xip:Ref')
+                                metadata_ref.text = str(uuid.uuid4())
+                                entity = SubElement(metadata, 'xip:Entity')
+                                entity.text = io_ref
+                                content = SubElement(metadata, 'xip:Content')
+                                content.append(descriptive_metadata.getroot())
+
+        writer.writestr("metadata.xml", prettify(xip))
+        writer.close()
+        return writer.zip_path
+    except BaseException:
+        writer.abort()
+        raise
 
 
 def simple_asset_package(preservation_file=None, access_file=None, export_folder=None, parent_folder=None,
@@ -1172,6 +1241,174 @@ def simple_asset_package(preservation_file=None, access_file=None, export_folder
                                  export_folder=export_folder, parent_folder=parent_folder, compress=compress, **kwargs)
 
 
+class _MultipartUploadStream:
+    """
+    A write only stream which uploads the data written to it as the parts of an S3 multipart upload
+
+    Parts are uploaded by a pool of threads while the caller carries on writing. At most max_in_flight parts are
+    held in memory, writes block until an upload finishes when that limit is reached.
+    """
+
+    def __init__(self, client, bucket, key, extra_args=None, part_size=16 * MB, max_in_flight=4, retries=3,
+                 callback=None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(int(part_size), 5 * MB)
+        self.retries = retries
+        self.callback = callback
+        response = client.create_multipart_upload(Bucket=bucket, Key=key, **(extra_args or {}))
+        self.upload_id = response['UploadId']
+        self._buffer = bytearray()
+        self._position = 0
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit(part)
+        return len(data)
+
+    def _submit(self, part: bytes):
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        self._slots.acquire()
+        future = self._pool.submit(self._upload_part, len(self._futures) + 1, part)
+        future.add_done_callback(lambda f: self._slots.release())
+        self._futures.append(future)
+
+    def _upload_part(self, part_number: int, part: bytes) -> dict:
+        attempt = 0
+        while True:
+            try:
+                response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                   PartNumber=part_number, Body=part)
+                break
+            except (BotoCoreError, ClientError) as ex:
+                attempt += 1
+                if attempt > self.retries:
+                    logger.error(ex)
+                    raise ex
+                logger.warning(f"Retrying part {part_number} of {self.key}: {ex}")
+                sleep(2 ** attempt)
+        if self.callback is not None:
+            self.callback(len(part))
+        return {'ETag': response['ETag'], 'PartNumber': part_number}
+
+    def complete(self) -> dict:
+        """
+        Upload the remaining data and complete the multipart upload
+
+        :return: The complete_multipart_upload response
+        """
+        if len(self._buffer) > 0 or len(self._futures) == 0:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        parts = [future.result() for future in self._futures]
+        self._pool.shutdown()
+        return self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                     MultipartUpload={'Parts': parts})
+
+    def abort(self):
+        """
+        Stop the upload and remove the parts already uploaded
+        """
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except (BotoCoreError, ClientError) as ex:
+            logger.error(ex)
+
+
+class _CrawlIndex:
+    """
+    A local SQLite index of the "code" identifiers already in Preservica and a journal of uploaded files
+
+    The index lets crawl_filesystem decide which folders and files are new without a search request for each one, and
+    the journal lets an interrupted crawl carry on without uploading the same files again.
+    The identifiers are loaded from the search index, so entities ingested by other processes in the last few minutes
+    may not be found yet.
+    """
+
+    def __init__(self, path: str = None):
+        self.connection = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS identifiers (code TEXT PRIMARY KEY, reference TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS journal (code TEXT PRIMARY KEY, progress_token TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS prefetched (parent TEXT PRIMARY KEY)")
+
+    def is_prefetched(self, parent_ref: str) -> bool:
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM prefetched WHERE parent = ?", (parent_ref or "",)).fetchone()
+            return row is not None
+
+    def mark_prefetched(self, parent_ref: str):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO prefetched VALUES (?)", (parent_ref or "",))
+
+    def prefetch(self, content_client, parent_ref: str, page_size: int = 1000):
+        """
+        Load the code identifiers of every entity below a folder with one paged search, None for the whole repository
+        """
+        if self.is_prefetched(parent_ref):
+            return
+        filters = {"xip.parent_hierarchy": parent_ref or "", "xip.identifier": ""}
+        rows = []
+        for result in content_client.search_index_filter_list("%", page_size, filters):
+            identifiers = result.get("xip.identifier") or []
+            if isinstance(identifiers, str):
+                identifiers = [identifiers]
+            for identifier in identifiers:
+                # the search index holds each identifier as its type and value separated by a space
+                identifier_type, _, value = str(identifier).partition(" ")
+                if identifier_type == "code" and value:
+                    rows.append((value, result["xip.reference"]))
+            if len(rows) >= 1000:
+                self.add_many(rows)
+                rows = []
+        self.add_many(rows)
+        self.mark_prefetched(parent_ref)
+
+    def add_many(self, rows):
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO identifiers VALUES (?, ?)", rows)
+
+    def reference(self, code: str):
+        with self.lock:
+            row = self.connection.execute("SELECT reference FROM identifiers WHERE code = ?", (code,)).fetchone()
+            return row[0] if row is not None else None
+
+    def exists(self, code: str) -> bool:
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM identifiers WHERE code = ? UNION ALL "
+                                           "SELECT 1 FROM journal WHERE code = ?", (code, code)).fetchone() is not None
+
+    def record(self, codes, progress_token: str = None):
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO journal VALUES (?, ?)",
+                                        [(code, progress_token) for code in codes])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
 def upload_config():
     return transfer_config
 
@@ -1363,58 +1600,39 @@ class UploadAPI(AuthenticatedAPI):
 
     def crawl_filesystem(self, filesystem_path, bucket_name, preservica_parent, callback: bool = False,
                          security_tag: str = "open",
-                         delete_after_upload: bool = True, max_MB_ingested: int = -1):
-
-        from pyPreservica import EntityAPI
-
-        def entity_value(client: EntityAPI, identifier: str) -> Entity:
-            back_off: int = 5
-            while True:
-                try:
-                    entities = client.identifier("code", identifier)
-                    if bool(len(entities) > 0):
-                        return entities.pop()
-                    else:
-                        return None
-                except HTTPException as e:
-                    sleep(back_off)
-                    back_off = back_off * 2
-
-        def entity_exists(client: EntityAPI, identifier: str) -> bool:
-            back_off: int = 5
-            while True:
-                try:
-                    entities = client.identifier("code", identifier)
-                    return bool(len(entities) > 0)
-                except HTTPException as e:
-                    sleep(back_off)
-                    back_off = back_off * 2
-
-        def get_parent(client, identifier, parent_reference):
-            dirname_id: str = str(os.path.dirname(identifier))
-            if not dirname_id:
-                dirname_id = identifier
-            folder = entity_value(client, dirname_id)
-            if folder is not None:
-                folder = client.folder(folder.reference)
-                return folder.reference
-            else:
-                return parent_reference
-
-        def get_folder(client, name, tag, parent_reference, identifier):
-            folder = entity_value(client, identifier)
-            if folder is None:
-                logger.info(f"Creating new folder with name {name}")
-                folder = client.create_folder(name, name, tag, parent_reference)
-                client.add_identifier(folder, "code", identifier)
-            else:
-                logger.info(f"Found existing folder with name {name}")
-            return folder
+                         delete_after_upload: bool = True, max_MB_ingested: int = -1, max_workers: int = 4,
+                         max_package_files: int = -1, max_package_MB: int = -1, index_path: str = None):
+        """
+        Copy a local folder hierarchy into Preservica, creating a folder for each directory and an asset for each file
+
+        Folders and assets are given a "code" identifier of their path relative to the crawled directory, files
+        which already have an asset with the same code are skipped so the crawl can be run again to pick up new files.
+
+        The code identifiers of everything below preservica_parent are loaded into a local SQLite index with one paged
+        search before the crawl starts, and packages are created and uploaded by a pool of max_workers threads.
+        Entities ingested by other processes shortly before the crawl may not be in the search index yet.
+        If index_path is given the index is kept in that file along with a journal of the uploaded files, so an
+        interrupted crawl can be restarted without fetching the identifiers or uploading the same files again.
+
+        :param str filesystem_path: The local directory to crawl
+        :param str bucket_name: The upload location, None to upload directly to Preservica
+        :param str preservica_parent: The reference of the Preservica folder to crawl into, None for the root
+        :param bool callback: Show the upload progress
+        :param str security_tag: The security tag of the new folders and assets
+        :param bool delete_after_upload: Delete the local packages after they have been uploaded
+        :param int max_MB_ingested: Stop after this many MB have been uploaded, -1 for no limit
+        :param int max_workers: The number of packages to create and upload at the same time
+        :param int max_package_files: The maximum number of files in each package, -1 for no limit
+        :param int max_package_MB: The maximum size of each package in MB, -1 for no limit
+        :param str index_path: The SQLite file used to keep the identifier index and journal between runs
+        """
+
+        from pyPreservica import EntityAPI, ContentAPI
 
         entity_client = EntityAPI(username=self.username, password=self.password, server=self.server,
                                   tenant=self.tenant,
                                   two_fa_secret_key=self.two_fa_secret_key, use_shared_secret=self.shared_secret,
-                                  protocol=self.protocol)
+                                  protocol=self.protocol, transport=self.transport)
 
         if preservica_parent:
             parent = entity_client.folder(preservica_parent)
@@ -1423,56 +1641,94 @@ class UploadAPI(AuthenticatedAPI):
         else:
             parent_ref = None
 
-        bytes_ingested = 0
-
-        folder_path = os.path.normpath(filesystem_path)
-
-        for dirname, subdirs, files in os.walk(folder_path):
-            base = os.path.basename(dirname)
-            code = os.path.relpath(dirname, Path(folder_path).parent)
-            p = get_parent(entity_client, code, parent_ref)
-            f = get_folder(entity_client, base, security_tag, p, code)
-            identifiers = dict()
-            for file in list(files):
-                full_path = os.path.join(dirname, file)
-                if os.path.islink(full_path):
-                    logger.info(f"Skipping link {file}")
-                    files.remove(file)
-                    continue
-                asset_code = os.path.join(code, file)
-                if not entity_exists(entity_client, asset_code):
-                    bytes_ingested = bytes_ingested + os.stat(full_path).st_size
-                    logger.info(f"Adding new file: {file} to package ready for upload")
-                    file_identifiers = {"code": asset_code}
-                    identifiers[full_path] = file_identifiers
-                else:
-                    logger.info(f"Skipping file {file} already exists in repository")
-                    files.remove(file)
-
-            if len(files) > 0:
-                full_path_list = [os.path.join(dirname, file) for file in files]
-                package = multi_asset_package(asset_file_list=full_path_list, parent_folder=f, SecurityTag=security_tag,
-                                              Identifiers=identifiers)
-                if callback:
-                    progress_display = UploadProgressConsoleCallback(package)
-                else:
-                    progress_display = None
-
-                if bucket_name is None:
-                    self.upload_zip_package(path_to_zip_package=package, callback=progress_display,
-                                            delete_after_upload=delete_after_upload)
+        if bucket_name is not None:
+            if bucket_name not in [location['containerName'] for location in self.upload_locations()]:
+                msg = f"The upload location {bucket_name} was not found"
+                logger.error(msg)
+                raise RuntimeError(msg)
+
+        index = _CrawlIndex(index_path)
+        if not index.is_prefetched(parent_ref):
+            content_client = ContentAPI(username=self.username, password=self.password, server=self.server,
+                                        tenant=self.tenant, two_fa_secret_key=self.two_fa_secret_key,
+                                        use_shared_secret=self.shared_secret, protocol=self.protocol,
+                                        transport=self.transport)
+            index.prefetch(content_client, parent_ref)
+
+        def packages():
+            bytes_ingested = 0
+            folder_path = os.path.normpath(filesystem_path)
+            for dirname, subdirs, files in os.walk(folder_path):
+                base = os.path.basename(dirname)
+                code = os.path.relpath(dirname, Path(folder_path).parent)
+                folder_ref = index.reference(code)
+                if folder_ref is None:
+                    logger.info(f"Creating new folder with name {base}")
+                    parent_code = os.path.dirname(code)
+                    folder_parent = (index.reference(parent_code) if parent_code else None) or parent_ref
+                    folder = entity_client.create_folder(base, base, security_tag, folder_parent)
+                    entity_client.add_identifier(folder, "code", code)
+                    index.add_many([(code, folder.reference)])
+                    folder_ref = folder.reference
                 else:
-                    self.upload_zip_to_Source(path_to_zip_package=package, container_name=bucket_name,
-                                              show_progress=bool(progress_display is not None),
-                                              delete_after_upload=delete_after_upload)
+                    logger.info(f"Found existing folder with name {base}")
+
+                package_files, identifiers, package_bytes = [], {}, 0
+                for file in files:
+                    full_path = os.path.join(dirname, file)
+                    if os.path.islink(full_path):
+                        logger.info(f"Skipping link {file}")
+                        continue
+                    asset_code = os.path.join(code, file)
+                    if index.exists(asset_code):
+                        logger.info(f"Skipping file {file} already exists in repository")
+                        continue
+                    file_size = os.stat(full_path).st_size
+                    if package_files and (0 < max_package_files <= len(package_files) or
+                                          0 < max_package_MB * MB < package_bytes + file_size):
+                        yield folder_ref, package_files, identifiers, package_bytes
+                        package_files, identifiers, package_bytes = [], {}, 0
+                    logger.info(f"Adding new file: {file} to package ready for upload")
+                    package_files.append(full_path)
+                    identifiers[full_path] = {"code": asset_code}
+                    package_bytes = package_bytes + file_size
+                    bytes_ingested = bytes_ingested + file_size
 
-                logger.info(f"Uploaded " + "{:.1f}".format(bytes_ingested / (1024 * 1024)) + " MB")
+                if package_files:
+                    yield folder_ref, package_files, identifiers, package_bytes
 
                 if max_MB_ingested > 0:
                     if bytes_ingested > (1024 * 1024 * max_MB_ingested):
                         logger.info(f"Reached Max Upload Limit")
                         break
 
+        def upload_package(job):
+            folder_ref, package_files, identifiers, package_bytes = job
+            package = multi_asset_package(asset_file_list=package_files, parent_folder=folder_ref,
+                                          SecurityTag=security_tag, Identifiers=identifiers)
+            if callback:
+                progress_display = UploadProgressConsoleCallback(package)
+            else:
+                progress_display = None
+
+            if bucket_name is None:
+                progress_token = self.upload_zip_package(path_to_zip_package=package, callback=progress_display,
+                                                         delete_after_upload=delete_after_upload)
+            else:
+                progress_token = self.upload_zip_to_Source(path_to_zip_package=package, container_name=bucket_name,
+                                                           show_progress=bool(progress_display is not None),
+                                                           delete_after_upload=delete_after_upload)
+            index.record([value["code"] for value in identifiers.values()], progress_token)
+            return package_bytes
+
+        try:
+            bytes_uploaded = 0
+            for package_bytes in concurrent_map(upload_package, packages(), max_workers=max_workers):
+                bytes_uploaded = bytes_uploaded + package_bytes
+                logger.info(f"Uploaded " + "{:.1f}".format(bytes_uploaded / (1024 * 1024)) + " MB")
+        finally:
+            index.close()
+
     def upload_zip_to_Source(self, path_to_zip_package, container_name, folder=None, delete_after_upload=False,
                              show_progress=False):
 
@@ -1617,24 +1873,10 @@ class UploadAPI(AuthenticatedAPI):
                 if delete_after_upload:
                     os.remove(path_to_zip_package)
 
-    def upload_zip_package(self, path_to_zip_package, folder=None, callback=None, delete_after_upload=False):
+    def _package_upload_client(self):
         """
-        Uploads a zip file package directly to Preservica and starts an ingest workflow
-
-        :param str path_to_zip_package: Path to the package
-        :param Folder folder: The folder to ingest the package into
-        :param Callable callback: Optional callback to allow the callee to monitor the upload progress
-        :param bool delete_after_upload: Delete the local copy of the package after the upload has completed
-
-        :return: preservica-progress-token to allow the workflow progress to be monitored
-        :rtype: str
-
-
-        :raises RuntimeError:
-
-
+        An S3 client for the Preservica package upload endpoint which refreshes its credentials from the access token
         """
-        bucket = f'{self.tenant.lower()}.package.upload'
         endpoint = f'{self.protocol}://{self.server}/api/s3/buckets'
         self.token = self.__token__()
 
@@ -1674,6 +1916,69 @@ class UploadAPI(AuthenticatedAPI):
 
 
         s3_client = autorefresh_session.client('s3', endpoint_url=endpoint, config=config)
+        return s3_client
+
+    def upload_package_stream(self, package_function, folder=None, callback=None, part_size=16 * MB,
+                              max_in_flight=4, **kwargs):
+        """
+        Create a package and upload it to Preservica at the same time, without writing the zip file to local disk
+
+        The package is created by calling package_function, for example complex_asset_package, with the
+        other keyword arguments. The zip is uploaded in parts as it is written, so creating the package and
+        uploading it run at the same time and at most max_in_flight parts of part_size bytes are held in memory.
+
+        :param Callable package_function: The package function, simple_asset_package, complex_asset_package etc
+        :param Folder folder: The folder to ingest the package into, also used as the package parent_folder
+        :param Callable callback: Optional callback called with the number of bytes in each uploaded part
+        :param int part_size: The size of each uploaded part in bytes, the minimum is 5MB
+        :param int max_in_flight: The number of parts which can be uploading at the same time
+
+        :return: preservica-progress-token to allow the workflow progress to be monitored
+        :rtype: str
+        """
+        bucket = f'{self.tenant.lower()}.package.upload'
+        s3_client = self._package_upload_client()
+
+        metadata = {}
+        if folder is not None:
+            if hasattr(folder, "reference"):
+                metadata = {'Metadata': {'structuralobjectreference': folder.reference}}
+            elif isinstance(folder, str):
+                metadata = {'Metadata': {'structuralobjectreference': folder}}
+            kwargs.setdefault('parent_folder', folder)
+
+        key_id = str(uuid.uuid4()) + ".zip"
+        stream = _MultipartUploadStream(s3_client, bucket, key_id, extra_args=metadata, part_size=part_size,
+                                        max_in_flight=max_in_flight, callback=callback)
+        try:
+            package_function(Package_stream=stream, **kwargs)
+            response = stream.complete()
+        except BaseException as ex:
+            stream.abort()
+            logger.error(ex)
+            raise ex
+
+        return response['ResponseMetadata']['HTTPHeaders']['preservica-progress-token']
+
+    def upload_zip_package(self, path_to_zip_package, folder=None, callback=None, delete_after_upload=False):
+        """
+        Uploads a zip file package directly to Preservica and starts an ingest workflow
+
+        :param str path_to_zip_package: Path to the package
+        :param Folder folder: The folder to ingest the package into
+        :param Callable callback: Optional callback to allow the callee to monitor the upload progress
+        :param bool delete_after_upload: Delete the local copy of the package after the upload has completed
+
+        :return: preservica-progress-token to allow the workflow progress to be monitored
+        :rtype: str
+
+
+        :raises RuntimeError:
+
+
+        """
+        bucket = f'{self.tenant.lower()}.package.upload'
+        s3_client = self._package_upload_client()
 
         metadata = {}
         if folder is not None:
@@ -9,15 +9,28 @@ licence:    Apache License 2.0
 
 """
 
+import csv
+import itertools
 import uuid
-import datetime
-from typing import Callable, Generator
+from datetime import timedelta, timezone
+from typing import Callable, Generator, Iterable, Union
 from xml.etree import ElementTree
 
 from pyPreservica.common import *
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 logger = logging.getLogger(__name__)
 
+WORKFLOW_FIELDS = ('Id', 'WorkflowType', 'State', 'DisplayState', 'Started', 'Finished', 'WorkflowContextId',
+                   'WorkflowContextName', 'WorkflowDefinitionTextId', 'WorkflowGroupId', 'ArchivalProcessId')
+
+FINISHED_WORKFLOW_STATES = ('Aborted', 'Completed', 'Finished_Mixed_Outcome', 'Failed')
+
 
 class WorkflowInstance:
     """
@@ -101,10 +114,11 @@ class ProcessAPI(AuthenticatedAPI):
 
     def __init__(self, username: str = None, password: str = None, tenant: str = None, server: str = None,
                  use_shared_secret: bool = False, two_fa_secret_key: str = None,
-                 protocol: str = "https", request_hook: Callable = None, credentials_path: str = 'credentials.properties'):
+                 protocol: str = "https", request_hook: Callable = None, credentials_path: str = 'credentials.properties',
+                 transport: TransportConfig = None):
 
         super().__init__(username, password, tenant, server, use_shared_secret, two_fa_secret_key,
-                         protocol, request_hook, credentials_path)
+                         protocol, request_hook, credentials_path, transport)
         self.base_url = "api/process"
 
 
@@ -177,6 +191,236 @@ class ProcessAPI(AuthenticatedAPI):
 
         return []
 
+class WorkflowJob:
+    """
+        A workflow waiting to be started, or started, by a WorkflowBatch
+    """
+
+    def __init__(self, workflow_context: WorkflowContext, parameters: dict):
+        self.workflow_context = workflow_context
+        self.parameters = parameters
+        self.state = "Queued"
+        self.correlation_id = None
+        self.instance_id = None
+        self.attempts = 0
+        self.error = None
+        self.queued = time.monotonic()
+        self.started = None
+        self.finished = None
+
+    def __str__(self):
+        return f"Workflow:\t\t{self.workflow_context.workflow_name}\n" \
+               f"Instance:\t\t{self.instance_id}\n" \
+               f"State:\t\t\t{self.state}\n" \
+               f"Attempts:\t\t{self.attempts}\n"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class WorkflowBatchStatistics:
+    """
+        Counters and timings for a WorkflowBatch
+
+        The wait is the time from a job being queued to its workflow starting, the run time is the time from the
+        workflow starting to it finishing, as seen by polling.
+    """
+
+    def __init__(self):
+        self.queued = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.refused = 0
+        self.active = 0
+        self.waits = []
+        self.run_times = []
+        self.start = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        """
+        The number of seconds since the batch started
+        """
+        return time.monotonic() - self.start
+
+    @property
+    def throughput(self) -> float:
+        """
+        The number of workflows finished per minute
+        """
+        elapsed = self.elapsed
+        return (self.completed + self.failed) * 60 / elapsed if elapsed > 0 else 0.0
+
+    @staticmethod
+    def _percentile(values: list, percent: float) -> float:
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def latency(self) -> dict:
+        """
+        Return the median, 95th percentile and maximum wait and run times in seconds
+        """
+        return {'wait_p50': self._percentile(self.waits, 50), 'wait_p95': self._percentile(self.waits, 95),
+                'wait_max': max(self.waits, default=0.0), 'run_p50': self._percentile(self.run_times, 50),
+                'run_p95': self._percentile(self.run_times, 95), 'run_max': max(self.run_times, default=0.0)}
+
+    def __str__(self):
+        return f"Queued: {self.queued} Active: {self.active} Started: {self.started} Completed: {self.completed} " \
+               f"Failed: {self.failed} Retried: {self.retried} Refused: {self.refused} ({self.throughput:.1f}/min, " \
+               f"median run {self._percentile(self.run_times, 50):.0f}s)"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class WorkflowBatch:
+    """
+        Starts a large number of workflows without flooding the server
+
+        No more than max_active workflows started by the batch run at the same time, queued workflows are started as
+        the running ones finish. Each running workflow is polled with workflow_instance(), and workflows which fail
+        or could not be started are queued again up to max_retries times. A workflow the server is too busy to accept
+        waits at the front of the queue and does not use up one of its retries.
+    """
+
+    success_states = ("completed", "finished_mixed_outcome")
+    failure_states = ("failed", "aborted", "unknown")
+    refusal_codes = (requests.codes.too_many_requests, requests.codes.bad_gateway,
+                     requests.codes.service_unavailable, requests.codes.gateway_timeout)
+
+    def __init__(self, client, max_active: int = 10, poll_interval: float = 5, max_retries: int = 2,
+                 max_workers: int = 8):
+        self.client = client
+        self.max_active = max(1, int(max_active))
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.max_workers = max_workers
+        self.jobs = []
+        self.statistics = WorkflowBatchStatistics()
+        self._queue = collections.deque()
+        self._active = []
+
+    def add(self, workflow_context: WorkflowContext, **kwargs) -> WorkflowJob:
+        """
+        Queue a workflow to be started
+
+        :param WorkflowContext workflow_context: The workflow context to start
+        :param kwargs: Key/Values to pass to the workflow instance
+        :return: The queued job
+        :rtype: WorkflowJob
+        """
+        job = WorkflowJob(workflow_context, kwargs)
+        self.jobs.append(job)
+        self._queue.append(job)
+        self.statistics.queued += 1
+        return job
+
+    def _retry(self, job: WorkflowJob, state: str):
+        if job.attempts <= self.max_retries:
+            logger.warning(f"Workflow {job.workflow_context.workflow_name} {state}, queued to retry")
+            job.state = "Queued"
+            job.instance_id = None
+            self._queue.append(job)
+            self.statistics.retried += 1
+            self.statistics.queued += 1
+        else:
+            job.state = state
+            job.finished = time.monotonic()
+            self.statistics.failed += 1
+
+    def _start(self, job: WorkflowJob) -> bool:
+        job.correlation_id = str(uuid.uuid4())
+        try:
+            instance_id = self.client._start_workflow(job.workflow_context, job.correlation_id, **job.parameters)
+        except (RuntimeError, HTTPException) as exception:
+            job.error = str(exception)
+            status = exception.args[0] if exception.args else None
+            if status in self.refusal_codes:
+                # the server is busy, the job keeps its place and its retries
+                logger.warning(f"Workflow {job.workflow_context.workflow_name} refused, the server is busy")
+                self._queue.appendleft(job)
+                self.statistics.refused += 1
+                return False
+            logger.error(f"Failed to start workflow {job.workflow_context.workflow_name}: {job.error}")
+            self.statistics.queued -= 1
+            job.attempts += 1
+            self._retry(job, "Failed")
+            return False
+        self.statistics.queued -= 1
+        job.attempts += 1
+        job.instance_id = instance_id
+        job.started = time.monotonic()
+        self.statistics.started += 1
+        self.statistics.waits.append(job.started - job.queued)
+        if job.instance_id is None:
+            # without the instance id the workflow cannot be followed, so the batch cannot limit how many are running
+            job.state = "Started"
+            msg = f"The server did not return the instance of workflow {job.workflow_context.workflow_name}, " \
+                  f"correlation id {job.correlation_id}"
+            logger.error(msg)
+            raise RuntimeError(msg)
+        job.state = "Pending"
+        self._active.append(job)
+        return True
+
+    def _poll(self, job: WorkflowJob):
+        try:
+            return job, self.client.workflow_instance(job.instance_id).state
+        except (RuntimeError, HTTPException) as exception:
+            # a failed poll leaves the job running, it is polled again next time
+            logger.warning(f"Could not fetch workflow instance {job.instance_id}: {exception}")
+            return job, job.state
+
+    def run(self, timeout: float = None, callback: Callable = None) -> WorkflowBatchStatistics:
+        """
+        Start the queued workflows and wait for them to finish
+
+        :param float timeout: Stop starting new workflows and return after this many seconds, None to wait for all
+        :param callback: Called with the WorkflowBatchStatistics after each poll
+        :return: The batch statistics
+        :rtype: WorkflowBatchStatistics
+        :raises RuntimeError: If the server does not return the instance id of a started workflow
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue or self._active:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            while self._queue and len(self._active) < self.max_active:
+                if not self._start(self._queue.popleft()):
+                    # the server refused a workflow, wait before starting any more
+                    break
+            self.statistics.active = len(self._active)
+            time.sleep(self.poll_interval)
+            running = []
+            for job, state in concurrent_map(self._poll, self._active, max_workers=self.max_workers):
+                job.state = state
+                key = str(state).lower()
+                if key in self.success_states:
+                    job.finished = time.monotonic()
+                    self.statistics.completed += 1
+                    self.statistics.run_times.append(job.finished - job.started)
+                elif key in self.failure_states:
+                    self.statistics.run_times.append(time.monotonic() - job.started)
+                    self._retry(job, state)
+                else:
+                    running.append(job)
+            self._active = running
+            self.statistics.active = len(self._active)
+            if callback is not None:
+                callback(self.statistics)
+        return self.statistics
+
+    def __str__(self):
+        return f"WorkflowBatch {self.statistics}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class WorkflowAPI(AuthenticatedAPI):
     """
         A class for calling the Preservica Workflow API
@@ -193,10 +437,11 @@ class WorkflowAPI(AuthenticatedAPI):
 
     def __init__(self, username: str = None, password: str = None, tenant: str = None, server: str = None,
                  use_shared_secret: bool = False, two_fa_secret_key: str = None,
-                 protocol: str = "https", request_hook: Callable = None, credentials_path: str = 'credentials.properties'):
+                 protocol: str = "https", request_hook: Callable = None, credentials_path: str = 'credentials.properties',
+                 transport: TransportConfig = None):
 
         super().__init__(username, password, tenant, server, use_shared_secret, two_fa_secret_key,
-                         protocol, request_hook, credentials_path)
+                         protocol, request_hook, credentials_path, transport)
         self.base_url = "sdb/rest/workflow"
 
     def get_workflow_contexts_by_type(self, workflow_type: str) -> list:
@@ -216,12 +461,12 @@ class WorkflowAPI(AuthenticatedAPI):
         workflow_contexts = []
         request = self.session.get(f'{self.protocol}://{self.server}/{self.base_url}/contexts', headers=headers, params=params)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            contexts = entity_response.findall(f".//{{{NS_WORKFLOW}}}WorkflowContext")
+            entity_response = parse_xml(request.content)
+            contexts = find_all(entity_response, f"{{{NS_WORKFLOW}}}WorkflowContext")
             for context in contexts:
-                wrkfl_id = context.find(f".//{{{NS_WORKFLOW}}}Id").text
-                name = context.find(f".//{{{NS_WORKFLOW}}}Name").text
+                fields = child_fields(context, (f"{{{NS_WORKFLOW}}}Id", f"{{{NS_WORKFLOW}}}Name"))
+                wrkfl_id = fields[f"{{{NS_WORKFLOW}}}Id"].text
+                name = fields[f"{{{NS_WORKFLOW}}}Name"].text
                 workflow_context = WorkflowContext(wrkfl_id, name)
                 workflow_contexts.append(workflow_context)
             return workflow_contexts
@@ -249,12 +494,12 @@ class WorkflowAPI(AuthenticatedAPI):
         workflow_contexts = []
         request = self.session.get(f'{self.protocol}://{self.server}/{self.base_url}/contexts', headers=headers, params=params)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            contexts = entity_response.findall(f".//{{{NS_WORKFLOW}}}WorkflowContext")
+            entity_response = parse_xml(request.content)
+            contexts = find_all(entity_response, f"{{{NS_WORKFLOW}}}WorkflowContext")
             for context in contexts:
-                wrkfl_id = context.find(f".//{{{NS_WORKFLOW}}}Id").text
-                name = context.find(f".//{{{NS_WORKFLOW}}}Name").text
+                fields = child_fields(context, (f"{{{NS_WORKFLOW}}}Id", f"{{{NS_WORKFLOW}}}Name"))
+                wrkfl_id = fields[f"{{{NS_WORKFLOW}}}Id"].text
+                name = fields[f"{{{NS_WORKFLOW}}}Name"].text
                 workflow_context = WorkflowContext(wrkfl_id, name)
                 workflow_contexts.append(workflow_context)
             return workflow_contexts
@@ -281,9 +526,15 @@ class WorkflowAPI(AuthenticatedAPI):
 
         """
 
-        headers = {HEADER_TOKEN: self.token, 'Content-Type': 'application/xml;charset=UTF-8'}
-
         correlation_id = str(uuid.uuid4())
+        self._start_workflow(workflow_context, correlation_id, **kwargs)
+        return correlation_id
+
+    def _start_workflow(self, workflow_context: WorkflowContext, correlation_id: str, **kwargs) -> Union[int, None]:
+        """
+        Start a workflow context and return the id of the new workflow instance, None if the server did not return it
+        """
+        headers = {HEADER_TOKEN: self.token, 'Content-Type': 'application/xml;charset=UTF-8'}
 
         request_payload = xml.etree.ElementTree.Element('StartWorkflowRequest ',
                                                         {"xmlns": "http://workflow.preservica.com"})
@@ -301,14 +552,30 @@ class WorkflowAPI(AuthenticatedAPI):
         request = self.session.post(f'{self.protocol}://{self.server}/{self.base_url}/instances', headers=headers,
                                     data=xml_request)
         if request.status_code == requests.codes.created:
-            return correlation_id
+            try:
+                instance_id = find_first(parse_xml(request.content), f"{{{NS_WORKFLOW}}}Id")
+            except SyntaxError:
+                instance_id = None
+            return int(instance_id.text) if instance_id is not None else None
         if request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
-            return self.start_workflow_instance(workflow_context, **kwargs)
+            return self._start_workflow(workflow_context, correlation_id, **kwargs)
         else:
             logger.error(request.content)
             raise RuntimeError(request.status_code, "start_workflow_instance failed")
 
+    def workflow_batch(self, max_active: int = 10, poll_interval: float = 5, max_retries: int = 2) -> WorkflowBatch:
+        """
+        Return a WorkflowBatch which starts many workflows while limiting how many run at the same time
+
+        :param int max_active: The maximum number of workflows from the batch running at the same time
+        :param float poll_interval: The number of seconds between checks on the running workflows
+        :param int max_retries: The number of times a failed workflow is started again
+        :return: An empty batch, add workflows to it then call run()
+        :rtype: WorkflowBatch
+        """
+        return WorkflowBatch(self, max_active=max_active, poll_interval=poll_interval, max_retries=max_retries)
+
     def terminate_workflow_instance(self, instance_ids):
         """
         Terminate a workflow by its instance id
@@ -349,6 +616,34 @@ class WorkflowAPI(AuthenticatedAPI):
 
         """
 
+        record, xml_response = self._workflow_instance_record(instance_id)
+        w_id = record['Id']
+        assert int(instance_id) == w_id
+        workflow_instance = WorkflowInstance(int(instance_id))
+        if record['Started'] is not None:
+            workflow_instance.started = datetime.strptime(record['Started'], '%Y-%m-%dT%H:%M:%S.%fZ')
+        if record['Finished'] is not None:
+            workflow_instance.finished = datetime.strptime(record['Finished'], '%Y-%m-%dT%H:%M:%S.%fZ')
+
+        workflow_instance.state = record['State']
+        workflow_instance.display_state = record['DisplayState']
+        workflow_instance.archival_process_id = record['ArchivalProcessId']
+        workflow_instance.workflow_group_id = record['WorkflowGroupId']
+        workflow_instance.workflow_context_id = record['WorkflowContextId']
+        workflow_instance.workflow_context_name = record['WorkflowContextName']
+        workflow_instance.workflow_definition_id = record['WorkflowDefinitionTextId']
+
+        workflow_instance.xml_response = xml_response
+
+        return workflow_instance
+
+    def _workflow_instance_record(self, instance_id: int) -> tuple:
+        """
+        Return a workflow instance as a tuple of (record, xml response)
+
+        The record is a dictionary of the WORKFLOW_FIELDS without the WorkflowType, the dates are left as the ISO
+        strings sent by the server
+        """
         headers = {HEADER_TOKEN: self.token}
         params = {"includeErrors": "true"}
         request = self.session.get(f'{self.protocol}://{self.server}/{self.base_url}/instances/{str(instance_id)}',
@@ -356,38 +651,15 @@ class WorkflowAPI(AuthenticatedAPI):
         if request.status_code == requests.codes.ok:
             xml_response = str(request.content.decode('utf-8'))
             logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            w_id = int(entity_response.find(f".//{{{NS_WORKFLOW}}}Id").text)
-            assert instance_id == w_id
-            workflow_instance = WorkflowInstance(int(instance_id))
-            started_element = entity_response.find(f".//{{{NS_WORKFLOW}}}Started")
-            if started_element is not None:
-                if hasattr(started_element, "text"):
-                    workflow_instance.started = datetime.datetime.strptime(started_element.text,
-                                                                           '%Y-%m-%dT%H:%M:%S.%fZ')
-
-            finished_element = entity_response.find(f".//{{{NS_WORKFLOW}}}Finished")
-            if finished_element is not None:
-                if hasattr(finished_element, "text"):
-                    workflow_instance.finished = datetime.datetime.strptime(finished_element.text,
-                                                                            '%Y-%m-%dT%H:%M:%S.%fZ')
-
-            workflow_instance.state = entity_response.find(f".//{{{NS_WORKFLOW}}}State").text
-            workflow_instance.display_state = entity_response.find(f".//{{{NS_WORKFLOW}}}DisplayState").text
-            workflow_instance.archival_process_id = entity_response.find(f".//{{{NS_WORKFLOW}}}ArchivalProcessId").text
-            workflow_instance.workflow_group_id = entity_response.find(f".//{{{NS_WORKFLOW}}}WorkflowGroupId").text
-            workflow_instance.workflow_context_id = entity_response.find(f".//{{{NS_WORKFLOW}}}WorkflowContextId").text
-            workflow_instance.workflow_context_name = entity_response.find(
-                f".//{{{NS_WORKFLOW}}}WorkflowContextName").text
-            workflow_instance.workflow_definition_id = entity_response.find(
-                f".//{{{NS_WORKFLOW}}}WorkflowDefinitionTextId").text
-
-            workflow_instance.xml_response = xml_response
-
-            return workflow_instance
+            entity_response = parse_xml(request.content)
+            tags = {field: f"{{{NS_WORKFLOW}}}{field}" for field in WORKFLOW_FIELDS if field != 'WorkflowType'}
+            fields = child_fields(entity_response, tags.values())
+            record = {field: text_of(fields[tag]) for field, tag in tags.items()}
+            record['Id'] = int(record['Id'])
+            return record, xml_response
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
-            return self.workflow_instance(instance_id)
+            return self._workflow_instance_record(instance_id)
         else:
             logger.error(request.content)
             raise RuntimeError(request.status_code, "workflow_instance")
@@ -422,6 +694,32 @@ class WorkflowAPI(AuthenticatedAPI):
         Suspended, Unknown, or Failed
         :param workflow_type: The Workflow type: Ingest, Access, Transformation or DataManagement
 
+        """
+        total_count, count, records = self._workflow_instance_records(workflow_state, workflow_type, maximum,
+                                                                      start_value, **kwargs)
+        workflow_instances = []
+        for record in records:
+            workflow_instance = WorkflowInstance(record['Id'])
+            if record['Started'] is not None:
+                workflow_instance.started = time.strptime(record['Started'], '%Y-%m-%dT%H:%M:%S.%fZ')
+            if record['Finished'] is not None:
+                workflow_instance.finished = time.strptime(record['Finished'], '%Y-%m-%dT%H:%M:%S.%fZ')
+            workflow_instance.state = record['State']
+            workflow_instance.display_state = record['DisplayState']
+            workflow_instance.archival_process_id = record['ArchivalProcessId']
+            workflow_instance.workflow_group_id = record['WorkflowGroupId']
+            workflow_instance.workflow_context_id = record['WorkflowContextId']
+            workflow_instance.workflow_context_name = record['WorkflowContextName']
+            workflow_instance.workflow_definition_id = record['WorkflowDefinitionTextId']
+            workflow_instances.append(workflow_instance)
+        return tuple((total_count, count, workflow_instances))
+
+    def _workflow_instance_records(self, workflow_state: str, workflow_type: str, maximum: int = 25,
+                                   start_value: int = 0, **kwargs) -> tuple:
+        """
+        Return one page of workflow instances as a tuple of (total count, count, records)
+
+        Each record is a dictionary of the WORKFLOW_FIELDS, the dates are left as the ISO strings sent by the server
         """
 
         headers = {HEADER_TOKEN: self.token}
@@ -457,42 +755,267 @@ class WorkflowAPI(AuthenticatedAPI):
 
         request = self.session.get(f'{self.protocol}://{self.server}/{self.base_url}/instances', headers=headers, params=params)
         if request.status_code == requests.codes.ok:
-            xml_response = str(request.content.decode('utf-8'))
-            logger.debug(xml_response)
-            entity_response = xml.etree.ElementTree.fromstring(xml_response)
-            total_count = int(entity_response.find(f".//{{{NS_WORKFLOW}}}TotalCount").text)
-            count = int(entity_response.find(f".//{{{NS_WORKFLOW}}}Count").text)
-            workflow_instance = entity_response.findall(f".//{{{NS_WORKFLOW}}}WorkflowInstance")
-            workflow_instances = []
-            for instance in workflow_instance:
-                instance_id = instance.find(f".//{{{NS_WORKFLOW}}}Id").text
-                workflow_instance = WorkflowInstance(int(instance_id))
-
-                started_element = instance.find(f".//{{{NS_WORKFLOW}}}Started")
-                if started_element is not None:
-                    if hasattr(started_element, "text"):
-                        workflow_instance.started = time.strptime(started_element.text,
-                                                                               '%Y-%m-%dT%H:%M:%S.%fZ')
-
-                finished_element = instance.find(f".//{{{NS_WORKFLOW}}}Finished")
-                if finished_element is not None:
-                    if hasattr(finished_element, "text"):
-                        workflow_instance.finished = time.strptime(finished_element.text,
-                                                                                '%Y-%m-%dT%H:%M:%S.%fZ')
-
-                workflow_instance.state = instance.find(f".//{{{NS_WORKFLOW}}}State").text
-                workflow_instance.display_state = instance.find(f".//{{{NS_WORKFLOW}}}DisplayState").text
-                workflow_instance.archival_process_id = instance.find(f".//{{{NS_WORKFLOW}}}ArchivalProcessId").text
-                workflow_instance.workflow_group_id = instance.find(f".//{{{NS_WORKFLOW}}}WorkflowGroupId").text
-                workflow_instance.workflow_context_id = instance.find(f".//{{{NS_WORKFLOW}}}WorkflowContextId").text
-                workflow_instance.workflow_context_name = instance.find(f".//{{{NS_WORKFLOW}}}WorkflowContextName").text
-                workflow_instance.workflow_definition_id = instance.find(
-                    f".//{{{NS_WORKFLOW}}}WorkflowDefinitionTextId").text
-                workflow_instances.append(workflow_instance)
-            return tuple((total_count, count, workflow_instances))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(request.content.decode('utf-8'))
+            entity_response = parse_xml(request.content)
+            total_count = int(find_first(entity_response, f"{{{NS_WORKFLOW}}}TotalCount").text)
+            count = int(find_first(entity_response, f"{{{NS_WORKFLOW}}}Count").text)
+            tags = {field: f"{{{NS_WORKFLOW}}}{field}" for field in WORKFLOW_FIELDS if field != 'WorkflowType'}
+            records = []
+            for instance in find_all(entity_response, f"{{{NS_WORKFLOW}}}WorkflowInstance"):
+                fields = child_fields(instance, tags.values())
+                record = {field: text_of(fields[tag]) for field, tag in tags.items()}
+                record['Id'] = int(record['Id'])
+                record['WorkflowType'] = workflow_type
+                records.append(record)
+            return total_count, count, records
         elif request.status_code == requests.codes.unauthorized:
             self.token = self.__token__()
-            return self.__workflow_instances__(workflow_state, workflow_type, maximum, start_value, **kwargs)
+            return self._workflow_instance_records(workflow_state, workflow_type, maximum, start_value, **kwargs)
         else:
             logger.error(request.content)
             raise RuntimeError(request.status_code, "workflow_instances")
+
+    @staticmethod
+    def _date_shards(from_date: datetime, to_date: datetime, shard_days: float) -> list:
+        if from_date is None or not shard_days:
+            return [(from_date, to_date)]
+        end = to_date or datetime.now(timezone.utc)
+        step = timedelta(days=shard_days)
+        shards = []
+        start = from_date
+        while start < end:
+            shards.append((start, min(start + step, end)))
+            start = start + step
+        return shards
+
+    def _workflow_shard(self, shard: tuple, page_size: int, **kwargs) -> tuple:
+        """
+        Fetch every page of one workflow state and type between two dates, return the shard and the records
+
+        If the shard already holds the records of a combination which fitted in one page they are returned as they are
+        """
+        workflow_state, workflow_type, start, end, records = shard
+        if records is not None:
+            return shard, records
+        if start is not None:
+            kwargs['from_date'] = start.isoformat()
+        if end is not None:
+            kwargs['to_date'] = end.isoformat()
+        records = []
+        start_value = 0
+        while True:
+            total_count, count, page = self._workflow_instance_records(workflow_state, workflow_type, page_size,
+                                                                       start_value, **kwargs)
+            records.extend(page)
+            start_value = start_value + count
+            if count == 0 or start_value >= total_count:
+                return shard, records
+
+    def workflow_history(self, from_date: datetime = None, to_date: datetime = None,
+                         workflow_states: Iterable[str] = None, workflow_types: Iterable[str] = None,
+                         shard_days: float = 30, max_workers: int = 8, page_size: int = 100,
+                         **kwargs) -> Generator[dict, None, None]:
+        """
+        Return the workflow instances started between two dates as dictionaries of the WORKFLOW_FIELDS
+
+        The first page of every combination of workflow state and type is requested in parallel. The date range of
+        the combinations with more than one page is then split into shards of shard_days days, which are also
+        fetched in parallel.
+
+        :param datetime from_date: The start of the date range, None for all workflow instances
+        :param datetime to_date: The end of the date range, None for now
+        :param workflow_states: The workflow states to return, all states by default
+        :param workflow_types: The workflow types to return, all types by default
+        :param float shard_days: The number of days in each shard, None to page through each combination in turn
+        :param int max_workers: The number of requests made at the same time
+        :param int page_size: The number of workflow instances requested per page
+        :param kwargs: contextId or creator to filter the workflow instances
+        :return: A generator of workflow instance records
+        :rtype: Generator
+        """
+        if from_date is not None and from_date.tzinfo is None:
+            from_date = from_date.replace(tzinfo=timezone.utc)
+        if to_date is not None and to_date.tzinfo is None:
+            to_date = to_date.replace(tzinfo=timezone.utc)
+        combinations = [(workflow_state, workflow_type) for workflow_state in (workflow_states or self.workflow_states)
+                        for workflow_type in (workflow_types or self.workflow_types)]
+        date_shards = self._date_shards(from_date, to_date, shard_days)
+
+        filters = dict(kwargs)
+        if from_date is not None:
+            filters['from_date'] = from_date.isoformat()
+        if to_date is not None:
+            filters['to_date'] = to_date.isoformat()
+
+        def first_page(combination):
+            return self._workflow_instance_records(combination[0], combination[1], page_size, 0, **filters)
+
+        def shards():
+            for (workflow_state, workflow_type), (total_count, count, records) in zip(
+                    combinations, concurrent_map(first_page, combinations, max_workers=max_workers, ordered=True)):
+                if count >= total_count:
+                    yield workflow_state, workflow_type, from_date, to_date, records
+                else:
+                    for start, end in date_shards:
+                        yield workflow_state, workflow_type, start, end, None
+
+        fetch = functools.partial(self._workflow_shard, page_size=page_size, **kwargs)
+        previous = {}
+        for shard, records in concurrent_map(fetch, shards(), max_workers=max_workers, ordered=True):
+            # the date range of a shard includes its end, so an instance at the boundary is in both shards
+            key = (shard[0], shard[1])
+            boundary = previous.get(key, ())
+            previous[key] = set(record['Id'] for record in records)
+            for record in records:
+                if record['Id'] not in boundary:
+                    yield record
+
+    def export_workflow_history(self, filename: str, from_date: datetime = None, to_date: datetime = None,
+                                workflow_states: Iterable[str] = None, workflow_types: Iterable[str] = None,
+                                output_format: str = None, since_last_run: bool = False, shard_days: float = 30,
+                                max_workers: int = 8, page_size: int = 100, **kwargs) -> int:
+        """
+        Write the workflow instances started between two dates to a file
+
+        The format is one of "jsonl", "csv" or "parquet" and by default is taken from the file extension.
+        A parquet export is a directory which holds one file for each run and needs the pyarrow package.
+
+        With since_last_run the end date of each export is saved next to the file. The next export then starts
+        from that date and adds the new workflow instances to the same file, so a regular audit only requests the
+        instances started since the previous run.
+        The Ids of the instances which had not finished are saved with the end date, the next export requests them
+        again and adds a new record for each one whose state has changed.
+
+        :param str filename: The output file or directory
+        :param datetime from_date: The start of the date range for the first run, None for all workflow instances
+        :param datetime to_date: The end of the date range, None for now
+        :param workflow_states: The workflow states to export, all states by default
+        :param workflow_types: The workflow types to export, all types by default
+        :param str output_format: "jsonl", "csv" or "parquet"
+        :param bool since_last_run: Start from the end date of the previous export of this file
+        :param float shard_days: The number of days in each shard
+        :param int max_workers: The number of shards fetched at the same time
+        :param int page_size: The number of workflow instances requested per page
+        :param kwargs: contextId or creator to filter the workflow instances
+        :return: The number of workflow instances written
+        :rtype: int
+        """
+        if output_format is None:
+            output_format = os.path.splitext(filename)[1].lstrip(".").lower() or "jsonl"
+        if output_format == "json":
+            output_format = "jsonl"
+        if output_format not in ("jsonl", "csv", "parquet"):
+            raise RuntimeError(f"Unknown workflow export format {output_format}")
+        if output_format == "parquet" and pyarrow is None:
+            msg = "Parquet export requires the pyarrow package, install it with: pip install pyarrow"
+            logger.error(msg)
+            raise RuntimeError(msg)
+
+        if to_date is None:
+            to_date = datetime.now(timezone.utc)
+        elif to_date.tzinfo is None:
+            to_date = to_date.replace(tzinfo=timezone.utc)
+        watermark_file = f"{filename.rstrip(os.sep)}.watermark.json"
+        append = False
+        previous = set()
+        unfinished = {}
+        if since_last_run and os.path.isfile(watermark_file):
+            with open(watermark_file, 'rt', encoding='utf-8') as fd:
+                watermark = json.load(fd)
+            from_date = datetime.fromisoformat(watermark['to'])
+            previous = set(watermark.get('boundary', []))
+            unfinished = {int(instance_id): state for instance_id, state in watermark.get('unfinished', {}).items()}
+            append = True
+
+        # instances started at the end date are returned again by the next run, remember them to skip them then
+        stamp = to_date.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+        boundary = []
+        # the instances which have not finished yet, with their workflow type and state when they were last written
+        still_unfinished = {}
+
+        def refresh(item):
+            instance_id, (workflow_type, state) = item
+            try:
+                record, xml_response = self._workflow_instance_record(instance_id)
+            except RuntimeError as exception:
+                if exception.args and exception.args[0] == requests.codes.not_found:
+                    logger.warning(f"Workflow instance {instance_id} no longer exists")
+                    return None
+                raise
+            record['WorkflowType'] = workflow_type
+            return state, record
+
+        def updated_records():
+            for result in concurrent_map(refresh, unfinished.items(), max_workers=max_workers, ordered=True):
+                if result is None:
+                    continue
+                state, record = result
+                if record['State'] not in FINISHED_WORKFLOW_STATES:
+                    still_unfinished[record['Id']] = (record['WorkflowType'], record['State'])
+                if record['State'] != state and (not workflow_states or record['State'] in workflow_states):
+                    yield {field: record[field] for field in WORKFLOW_FIELDS}
+
+        def new_records():
+            for record in self.workflow_history(from_date, to_date, workflow_states, workflow_types, shard_days,
+                                                max_workers, page_size, **kwargs):
+                if record['Id'] in previous:
+                    continue
+                if record['Started'] is not None and record['Started'] >= stamp:
+                    boundary.append(record['Id'])
+                if record['State'] not in FINISHED_WORKFLOW_STATES:
+                    still_unfinished[record['Id']] = (record['WorkflowType'], record['State'])
+                yield record
+
+        records = itertools.chain(updated_records(), new_records())
+
+        count = 0
+        if output_format == "parquet":
+            os.makedirs(filename, exist_ok=True)
+            schema = pyarrow.schema([(field, pyarrow.int64() if field == 'Id' else pyarrow.string())
+                                     for field in WORKFLOW_FIELDS])
+            part = os.path.join(filename, f"part-{to_date.strftime('%Y%m%dT%H%M%S')}.parquet")
+            writer = pyarrow.parquet.ParquetWriter(f"{part}.tmp", schema)
+            try:
+                batch = []
+                for record in records:
+                    batch.append(record)
+                    if len(batch) == 10000:
+                        writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                    count += len(batch)
+                writer.close()
+                os.replace(f"{part}.tmp", part)
+            except BaseException:
+                writer.close()
+                os.remove(f"{part}.tmp")
+                raise
+        else:
+            append = append and os.path.isfile(filename)
+            with open(filename, 'a' if append else 'w', encoding='utf-8', newline='') as output:
+                offset = output.tell()
+                try:
+                    writer = csv.DictWriter(output, fieldnames=WORKFLOW_FIELDS) if output_format == "csv" else None
+                    if writer is not None and not append:
+                        writer.writeheader()
+                    for record in records:
+                        if writer is not None:
+                            writer.writerow(record)
+                        else:
+                            output.write(json.dumps(record) + "\n")
+                        count += 1
+                except BaseException:
+                    # leave the file as it was, so the run can be repeated from the same watermark
+                    output.truncate(offset)
+                    raise
+
+        if since_last_run:
+            with open(f"{watermark_file}.tmp", 'wt', encoding='utf-8') as fd:
+                json.dump({'to': to_date.isoformat(), 'boundary': boundary,
+                           'unfinished': {str(instance_id): state for instance_id, state in still_unfinished.items()}},
+                          fd)
+            os.replace(f"{watermark_file}.tmp", watermark_file)
+        return count
@@ -0,0 +1,122 @@
+"""
+pyPreservica XML parsing module definition
+
+Shared helpers used by the API classes to parse the XML documents returned by the Preservica web services.
+
+Responses are parsed directly from the bytes returned by the server. If the optional lxml package is installed
+it is used to build the document tree, otherwise the standard library ElementTree parser is used.
+
+The entity, async entity, retention and workflow clients parse their responses with these helpers. The admin, upload
+and OPEX modules still use ElementTree directly because they also build the documents they send.
+
+author:     James Carr
+licence:    Apache License 2.0
+
+"""
+
+import threading
+import xml.etree.ElementTree
+from typing import Iterable, Union
+
+try:
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+_use_lxml = lxml is not None
+_parsers = threading.local()
+
+
+def use_lxml(enabled: bool = True) -> bool:
+    """
+    Choose whether responses are parsed with lxml, which must be installed to be enabled
+
+    :param bool enabled: True to parse with lxml, False to use ElementTree
+    :return: True if lxml is now being used
+    :rtype: bool
+    """
+    global _use_lxml
+    _use_lxml = bool(enabled) and lxml is not None
+    return _use_lxml
+
+
+def _lxml_parser():
+    # lxml parsers must not be shared between threads
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        # never fetch a DTD or expand external entities from a server response
+        parser = lxml.etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+        _parsers.parser = parser
+    return parser
+
+
+def parse_xml(document: Union[bytes, str]):
+    """
+    Parse an XML response and return the root element
+
+    Pass the response bytes rather than a decoded string, the parser reads the encoding from the XML declaration.
+
+    :param document: The XML document as bytes or str
+    :return: The root element
+    """
+    if _use_lxml:
+        if isinstance(document, str):
+            document = document.encode("utf-8")
+        return lxml.etree.fromstring(document, _lxml_parser())
+    return xml.etree.ElementTree.fromstring(document)
+
+
+def find_first(element, tag: str):
+    """
+    Return the first element below element with the tag, in document order
+
+    This is the same as element.find(".//tag") without building an ElementPath query
+
+    :param element: The element to search
+    :param str tag: The namespace qualified tag, for example "{http://preservica.com/XIP/v7.0}Ref"
+    :return: The element or None
+    """
+    for match in element.iter(tag):
+        if match is not element:
+            return match
+    return None
+
+
+def find_all(element, tag: str) -> list:
+    """
+    Return every element below element with the tag, in document order
+
+    This is the same as element.findall(".//tag")
+
+    :param element: The element to search
+    :param str tag: The namespace qualified tag
+    :return: A list of elements
+    """
+    return [match for match in element.iter(tag) if match is not element]
+
+
+def child_fields(element, tags: Iterable[str]) -> dict:
+    """
+    Return the first element for each tag, looking at the direct children of element first
+
+    The fields of a Preservica record are almost always its direct children, so they are found with one pass over
+    the children. Tags which are not direct children are then searched for further down the tree.
+
+    :param element: The parent element
+    :param tags: The namespace qualified tags
+    :return: A dictionary of tag to element, None for tags which were not found
+    """
+    children = {}
+    for child in element:
+        children.setdefault(child.tag, child)
+    return {tag: children[tag] if tag in children else find_first(element, tag) for tag in tags}
+
+
+def text_of(element, default=None):
+    """
+    Return the text of an element, or default if the element is None
+
+    :param element: The element or None
+    :param default: The value returned when there is no element
+    """
+    return element.text if element is not None else default
@@ -42,6 +42,11 @@ setup(
     ],
     keywords='Preservica API Preservation',
     install_requires=["requests", "urllib3", "certifi", "boto3>=1.38.0", "botocore>=1.38.0", "s3transfer", "azure-storage-blob", "tqdm", "pyotp", "python-dateutil"],
+    extras_require={
+        'async': ["httpx"],
+        'parquet': ["pyarrow"],
+        'lxml': ["lxml"],
+    },
     project_urls={
         'Documentation': 'https://pypreservica.readthedocs.io',
         'Source': 'https://github.com/carj/pyPreservica',
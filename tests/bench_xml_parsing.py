@@ -0,0 +1,199 @@
+"""
+Micro-benchmark of the XML response parsers over the recorded responses in tests/fixtures
+
+Each response is parsed with a copy of the code the client used before pyPreservica.xmlparser, which decoded the bytes
+and ran a ".//" ElementPath search for every field, and then with the client parsers using ElementTree and, when it
+is installed, lxml.
+
+    python tests/bench_xml_parsing.py
+    python tests/bench_xml_parsing.py --number 500
+
+This file is not collected by pytest.
+"""
+
+import argparse
+import os
+import timeit
+import xml.etree.ElementTree
+
+from pyPreservica import *
+from pyPreservica import xmlparser
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+XIP_NS = "http://preservica.com/XIP/v7.0"
+ENTITY_NS = "http://preservica.com/EntityAPI/v7.0"
+
+XIP = f"{{{XIP_NS}}}"
+ENTITY = f"{{{ENTITY_NS}}}"
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as fd:
+        return fd.read()
+
+
+def before_entity(document: bytes) -> Asset:
+    entity_response = xml.etree.ElementTree.fromstring(document.decode("utf-8"))
+    reference = entity_response.find(f".//{XIP}Ref")
+    title = entity_response.find(f".//{XIP}Title")
+    security_tag = entity_response.find(f".//{XIP}SecurityTag")
+    description = entity_response.find(f".//{XIP}Description")
+    parent = entity_response.find(f".//{XIP}Parent")
+    custom_type = entity_response.find(f".//{XIP}CustomType")
+    fragments = entity_response.findall(f".//{ENTITY}Metadata/{ENTITY}Fragment")
+    metadata = {fragment.text: fragment.attrib["schema"] for fragment in fragments}
+    asset = Asset(reference.text, title.text if hasattr(title, "text") else None,
+                  description.text if hasattr(description, "text") else None, security_tag.text,
+                  parent.text if hasattr(parent, "text") else None, metadata)
+    asset.custom_type = custom_type.text if hasattr(custom_type, "text") else None
+    return asset
+
+
+def before_children(document: bytes) -> PagedSet:
+    entity_response = xml.etree.ElementTree.fromstring(document.decode("utf-8"))
+    children = entity_response.findall(f".//{ENTITY}Child")
+    result = set()
+    next_url = entity_response.find(f".//{ENTITY}Next")
+    total_hits = entity_response.find(f".//{ENTITY}TotalResults")
+    for child in children:
+        if child.attrib["type"] == EntityType.FOLDER.value:
+            result.add(Folder(child.attrib["ref"], child.attrib["title"], None, None, "parent-ref", None))
+        else:
+            result.add(Asset(child.attrib["ref"], child.attrib["title"], None, None, "parent-ref", None))
+    return PagedSet(result, next_url is not None, int(total_hits.text), getattr(next_url, "text", None))
+
+
+def before_generation(document: bytes) -> tuple:
+    entity_response = xml.etree.ElementTree.fromstring(document.decode("utf-8"))
+    ge = entity_response.find(f".//{XIP}Generation")
+    format_group = entity_response.find(f".//{XIP}FormatGroup")
+    effective_date = entity_response.find(f".//{XIP}EffectiveDate")
+    formats_list = []
+    for tech_format in entity_response.findall(f".//{XIP}Formats/{XIP}Format"):
+        format_dict = {"Valid": tech_format.attrib["valid"]}
+        for tag in ("PUID", "Priority", "IdentificationMethod", "FormatName", "FormatVersion"):
+            element = tech_format.find(f".//{XIP}{tag}")
+            format_dict[tag] = element.text if hasattr(element, "text") else None
+        formats_list.append(format_dict)
+    property_set = []
+    for tech_props in entity_response.findall(f".//{XIP}Properties/{XIP}Property"):
+        tech_props_dict = {}
+        for tag in ("PUID", "PropertyName", "Value"):
+            element = tech_props.find(f".//{XIP}{tag}")
+            tech_props_dict[tag] = element.text if hasattr(element, "text") else None
+        property_set.append(tech_props_dict)
+    urls = [bit.text for bit in entity_response.findall(f"./{ENTITY}Bitstreams/{ENTITY}Bitstream")]
+    generation = Generation(strtobool(ge.attrib["original"]), strtobool(ge.attrib["active"]),
+                            format_group.text if hasattr(format_group, "text") else None,
+                            effective_date.text if hasattr(effective_date, "text") else None, [])
+    generation.formats = formats_list
+    generation.properties = property_set
+    return generation, urls
+
+
+def before_bitstream(document: bytes) -> Bitstream:
+    entity_response = xml.etree.ElementTree.fromstring(document.decode("utf-8"))
+    filename = entity_response.find(f".//{XIP}Filename")
+    filesize = entity_response.find(f".//{XIP}FileSize")
+    fixity_values = entity_response.findall(f".//{XIP}Fixity")
+    content = entity_response.find(f".//{ENTITY}Content")
+    fixity = {f[0].text: f[1].text for f in fixity_values}
+    return Bitstream(filename.text if hasattr(filename, "text") else None,
+                     int(filesize.text) if hasattr(filesize, "text") else None, fixity,
+                     content.text if hasattr(content, "text") else None)
+
+
+def before_events(document: bytes) -> PagedSet:
+    entity_response = xml.etree.ElementTree.fromstring(document.decode("utf-8"))
+    result_list = []
+    for event in entity_response.findall(f".//{XIP}Event"):
+        result = {"eventType": event.attrib["type"]}
+        for tag in ("Date", "User", "Ref"):
+            element = event.find(f".//{XIP}{tag}")
+            result[tag] = element.text if hasattr(element, "text") else None
+        for tag in ("WorkflowName", "WorkflowInstanceId", "SerialisedCommand"):
+            element = event.find(f".//{XIP}{tag}")
+            if element is not None:
+                result[tag] = element.text
+        result_list.append(result)
+    next_url = entity_response.find(f".//{ENTITY}Next")
+    total_hits = entity_response.find(f".//{ENTITY}TotalResults")
+    return PagedSet(result_list, next_url is not None, int(total_hits.text), getattr(next_url, "text", None))
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+
+class _Session:
+    def __init__(self, content):
+        self.response = _Response(content)
+
+    def get(self, url, **kwargs):
+        return self.response
+
+
+def client_for(document: bytes = b"") -> EntityAPI:
+    client = EntityAPI.__new__(EntityAPI)
+    client.xip_ns = XIP_NS
+    client.entity_ns = ENTITY_NS
+    client.major_version = 7
+    client.minor_version = 0
+    client.protocol = "https"
+    client.server = "bench"
+    client._token_expires = None
+    client.token = "token"
+    client.session = _Session(document)
+    return client
+
+
+def cases():
+    entity = fixture("entity.xml")
+    children = fixture("children.xml")
+    generation = fixture("generation.xml")
+    bitstream = fixture("bitstream.xml")
+    events = fixture("events.xml")
+    client = client_for()
+    events_client = client_for(events)
+    return [
+        ("entity", lambda: before_entity(entity), lambda: client._entity_from_xml(Asset, entity)),
+        ("children (100)", lambda: before_children(children), lambda: client._children_from_xml(children, "parent-ref")),
+        ("generation", lambda: before_generation(generation),
+         lambda: client._generation_from_xml(generation, "https://bench/generations/1")),
+        ("bitstream", lambda: before_bitstream(bitstream),
+         lambda: client._bitstream_from_xml(bitstream, "https://bench/bitstreams/1")),
+        ("events (100)", lambda: before_events(events), lambda: events_client._all_events_page()),
+    ]
+
+
+def measure(function, number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the XML response parsers")
+    parser.add_argument("--number", type=int, default=200, help="parses per timing run")
+    args = parser.parse_args()
+
+    backends = [False, True] if xmlparser.lxml is not None else [False]
+    previous = xmlparser._use_lxml
+    print(f"{'response':<16}{'before':>12}" + "".join(f"{'etree' if b is False else 'lxml':>18}" for b in backends))
+    try:
+        for name, baseline, parse in cases():
+            before = measure(baseline, args.number)
+            row = f"{name:<16}{before:>10.1f}us"
+            for backend in backends:
+                xmlparser.use_lxml(backend)
+                after = measure(parse, args.number)
+                row += f"{after:>10.1f}us {before / after:>4.1f}x"
+            print(row)
+    finally:
+        xmlparser._use_lxml = previous
+
+
+if __name__ == "__main__":
+    main()
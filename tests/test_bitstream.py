@@ -104,4 +104,17 @@ def test_get_bitstream_locations(setup_data):
     asset = client.asset(ASSET_ID)
     for bs  in client.bitstreams_for_asset(asset):
         locations = client.bitstream_location(bs)
-        assert "Primary Adapter" in locations
\ No newline at end of file
+        assert "Primary Adapter" in locations
+
+def test_get_bitstreams_for_asset_cached(setup_data):
+    client = EntityAPI()
+    asset = client.asset(ASSET_ID)
+    bitstreams = list(client.bitstreams_for_asset(asset))
+    assert len(bitstreams) > 0
+    cached = len(client.bitstream_cache)
+    assert cached >= len(bitstreams)
+    misses = client.bitstream_cache.misses
+    again = list(client.bitstreams_for_asset(asset, max_workers=1))
+    assert [b.filename for b in again] == [b.filename for b in bitstreams]
+    assert client.bitstream_cache.misses == misses
+    assert len(client.bitstream_cache) == cached
@@ -96,3 +96,20 @@ def test_get_children_of_folder_descendants(setup_data):
         assert f.parent == FOLDER_ID
         objs.add(f)
     assert len(objs) == 171
+
+
+def test_get_children_of_folder_parallel(setup_data):
+    client = EntityAPI()
+    objs = set()
+    for f in client.parallel_descendants(FOLDER_ID, max_workers=4):
+        assert f.entity_type == EntityType.ASSET
+        assert f.parent == FOLDER_ID
+        objs.add(f.reference)
+    assert len(objs) == 171
+
+
+def test_get_children_of_folder_parallel_ordered(setup_data):
+    client = EntityAPI()
+    serial = [e.reference for e in client.all_descendants(FOLDER_ID)]
+    parallel = [e.reference for e in client.parallel_descendants(FOLDER_ID, ordered=True)]
+    assert serial == parallel
@@ -180,4 +180,16 @@ def test_search_fields_with_list2(setup_data):
 
     assert len(fields_open) > 0
 
-    assert len(fields_open) == len(results_open)
\ No newline at end of file
+    assert len(fields_open) == len(results_open)
+
+def test_search_index_filter_parquet(setup_data, tmp_path):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    search = ContentAPI()
+    filters = {"xip.security_descriptor": "open", "xip.document_type": "IO", "xip.created": ""}
+    results = list(search.search_index_filter_list(query="%", filter_values=dict(filters)))
+    parquet_file = str(tmp_path / "search.parquet")
+    rows = search.search_index_filter_parquet(query="%", parquet_file=parquet_file, filter_values=dict(filters))
+    assert rows == len(results)
+    table = pyarrow_parquet.read_table(parquet_file)
+    assert table.num_rows == rows
+    assert table.column_names[0] == "xip.reference"
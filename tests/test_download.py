@@ -100,3 +100,13 @@ def test_can_get_large_thumbnail():
     assert os.path.isfile(filename)
     assert os.stat(filename).st_size == 129192
     os.remove(filename)
+
+
+def test_can_download_folder(tmp_path):
+    client = EntityAPI()
+    statistics = client.download_folder(FOLDER_ID, str(tmp_path), max_workers=4)
+    assert statistics.failed == 0
+    assert statistics.downloaded > 0
+    statistics = client.download_folder(FOLDER_ID, str(tmp_path), max_workers=4)
+    assert statistics.downloaded == 0
+    assert statistics.skipped > 0
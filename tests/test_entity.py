@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 import xml
 
@@ -33,6 +34,43 @@ def test_get_asset():
     assert asset.reference == ASSET_ID
 
 
+def test_get_asset_async():
+    async def fetch():
+        async with AsyncEntityAPI(max_concurrency=4) as client:
+            assets = [a async for a in client.map(client.asset, [ASSET_ID, ASSET_ID])]
+            folder = await client.folder(FOLDER_ID)
+            return assets, folder
+    assets, folder = asyncio.run(fetch())
+    assert len(assets) == 2
+    for asset in assets:
+        assert asset.reference == ASSET_ID
+        assert asset.entity_type is EntityType.ASSET
+    assert folder.title == "Amelia Earhart"
+
+
+def test_get_assets_batch():
+    client = EntityAPI()
+    results = list(client.assets([ASSET_ID, "some-bad-reference", ASSET_ID], ordered=True))
+    assert len(results) == 3
+    assert results[0].reference == ASSET_ID
+    assert isinstance(results[1], ReferenceNotFoundException)
+    assert results[1].reference == "some-bad-reference"
+    assert results[2].reference == ASSET_ID
+
+
+def test_get_asset_cached():
+    client = EntityAPI()
+    cache = client.enable_cache(max_size=10, ttl=60)
+    asset = client.asset(ASSET_ID)
+    asset.title = "changed"
+    asset = client.asset(ASSET_ID)
+    assert asset.title == "LC-USZ62-20901"
+    assert cache.hits == 1
+    assert cache.misses == 1
+    client.disable_cache()
+    assert client.cache is None
+
+
 def test_get_asset_custom_type():
     client = EntityAPI()
     asset = client.asset(ASSET_ID)
@@ -0,0 +1,44 @@
+import copy
+import pickle
+
+import pytest
+from pyPreservica import *
+
+
+def test_entities_are_equal_by_reference():
+    asset = Asset("ref-1", "Title", None, "open", "parent-1")
+    same = Asset("ref-1", "Other Title")
+    folder = Folder("ref-1", "Title")
+    assert asset == same
+    assert hash(asset) == hash(same)
+    assert asset != folder
+    assert len({asset, same, folder}) == 2
+    assert asset.path == IO_PATH
+    assert folder.tag == "StructuralObject"
+
+
+def test_entities_have_no_instance_dict():
+    asset = Asset("ref-1", "Title", None, "open", "parent-1")
+    with pytest.raises(AttributeError):
+        asset.unknown = True
+    assert pickle.loads(pickle.dumps(asset)) == asset
+    assert copy.copy(asset).security_tag == "open"
+
+
+def test_entity_table():
+    table = EntityTable([Folder("folder-1", "Folder"), Asset("asset-1", "Asset", None, "open", "folder-1")])
+    assert len(table) == 2
+    assert "asset-1" in table
+    assert Asset("asset-1", "") in table
+    assert Folder("asset-1", "") not in table
+    asset = table.get("asset-1")
+    assert asset.entity_type is EntityType.ASSET
+    assert asset.parent == "folder-1"
+    assert table.row("asset-1") == ("asset-1", EntityType.ASSET, "Asset", "folder-1", "open")
+
+    later = EntityTable(table)
+    later.add(Asset("asset-1", "Asset", None, "closed", "folder-1"))
+    later.add(Asset("asset-2", "New Asset", None, "open", "folder-1"))
+    assert len(later) == 3
+    assert later.changed(table) == {"asset-1"}
+    assert later.references() - table.references() == {"asset-2"}
@@ -0,0 +1,93 @@
+from pyPreservica import *
+
+
+class FakeMonitorClient:
+    """
+    Stands in for MonitorAPI, records every message page requested
+    """
+
+    def __init__(self):
+        self.monitor_list = {}
+        self.message_list = {}
+        self.timeseries_calls = []
+        self.requests = []
+
+    def monitors(self, status=None, category=None):
+        for monitor in self.monitor_list.values():
+            yield dict(monitor)
+
+    def _messages_page_(self, monitor_id, maximum=50, next_page=None, status=None, start=0):
+        if next_page is not None:
+            start = int(next_page)
+        self.requests.append((monitor_id, start, maximum))
+        messages = self.message_list.get(monitor_id, [])
+        page = messages[start:start + maximum]
+        more = start + maximum < len(messages)
+        return PagedSet(page, more, len(messages), str(start + maximum) if more else None)
+
+    def timeseries(self, monitor_id):
+        self.timeseries_calls.append(monitor_id)
+        return [{"step": i} for i in range(len(self.message_list.get(monitor_id, [])))]
+
+
+def test_monitor_watcher_reports_only_changes():
+    client = FakeMonitorClient()
+    client.monitor_list["m1"] = {"MonitorId": "m1", "status": "Running", "progress": 0}
+    client.message_list["m1"] = [{"MessageId": 0}]
+    watcher = MonitorWatcher(client, min_interval=1, max_interval=8, history=3, page_size=2)
+    events = []
+    watcher.subscribe(lambda event, monitor_id, data: events.append((event, monitor_id)))
+    messages = []
+    watcher.subscribe(lambda event, monitor_id, data: messages.append(data["MessageId"]), events=("message",))
+
+    assert watcher.poll() == 1
+    assert events == [("added", "m1")]
+    assert messages == []
+
+    client.message_list["m1"].extend({"MessageId": i} for i in range(1, 6))
+    client.requests.clear()
+    assert watcher.poll() == 5
+    assert messages == [1, 2, 3, 4, 5]
+    assert client.requests[0] == ("m1", 1, 2)
+
+    client.requests.clear()
+    assert watcher.poll() == 0
+    assert messages == [1, 2, 3, 4, 5]
+    assert client.requests == [("m1", 6, 2)]
+    assert watcher.interval == 2
+
+    client.monitor_list["m1"]["progress"] = 50
+    client.monitor_list["m1"]["status"] = "Succeeded"
+    assert watcher.poll() == 1
+    assert events[-1] == ("changed", "m1")
+    assert watcher.interval == 1
+    assert watcher.samples("m1") == [{"step": 3}, {"step": 4}, {"step": 5}]
+
+    client.requests.clear()
+    assert watcher.poll() == 0
+    assert client.requests == []
+
+    del client.monitor_list["m1"]
+    assert watcher.poll() == 1
+    assert events[-1] == ("removed", "m1")
+    assert watcher.monitors() == {}
+
+
+def test_monitor_watcher_replay_and_unsubscribe():
+    client = FakeMonitorClient()
+    client.monitor_list["m1"] = {"MonitorId": "m1", "status": "Running"}
+    client.monitor_list["m2"] = {"MonitorId": "m2", "status": "Running"}
+    client.message_list["m1"] = [{"MessageId": i} for i in range(3)]
+    client.message_list["m2"] = [{"MessageId": i} for i in range(4)]
+    watcher = MonitorWatcher(client, replay=True)
+    messages = []
+    subscription = watcher.subscribe(lambda event, monitor_id, data: messages.append(data["MessageId"]),
+                                     monitor_id="m2", events=("message",))
+
+    watcher.poll()
+    assert messages == [0, 1, 2, 3]
+
+    watcher.unsubscribe(subscription)
+    client.message_list["m2"].append({"MessageId": 4})
+    assert watcher.poll() == 1
+    assert messages == [0, 1, 2, 3]
@@ -12,6 +12,21 @@ def test_get_policy_by_name():
     assert policy.name == "Standard Policy"
 
 
+def test_policy_catalogue():
+    retention = RetentionAPI()
+    catalogue = retention.policy_catalogue()
+    assert "Standard Policy" in catalogue
+    policy = catalogue.policy_by_name("Standard Policy")
+    again = catalogue.policy_by_name("Standard Policy")
+    assert again is not policy
+    assert again.reference == policy.reference
+    policy.name = "Changed"
+    assert catalogue.policy_by_name("Standard Policy").name == "Standard Policy"
+    assert catalogue.policy(policy.reference).name == "Standard Policy"
+    assert len(catalogue.policies()) == len(catalogue)
+    assert catalogue.policy_by_name("No Such Policy") is None
+
+
 def test_get_policies():
     retention = RetentionAPI()
     for p in retention.policies().results:
@@ -124,6 +139,33 @@ def test_add_assignments():
     retention.assignable_policy(policy.reference, False)
 
 
+def test_bulk_assign():
+    retention = RetentionAPI()
+
+    asset_ref = "799b467f-050d-415f-b8ec-7c74b343f628"
+
+    policy = retention.policies().results.pop()
+
+    if not policy.assignable:
+        retention.assignable_policy(policy.reference, True)
+        policy = retention.policy(policy.reference)
+
+    report = retention.bulk_assign([asset_ref], policy, dry_run=True)
+    assert report.added == [asset_ref]
+    assert len(retention.assignments(Asset(asset_ref, None))) == 0
+
+    report = retention.bulk_assign([asset_ref], policy)
+    assert report.added == [asset_ref]
+
+    report = retention.bulk_assign([asset_ref], policy)
+    assert report.unchanged == 1
+
+    for assignment in retention.assignments(Asset(asset_ref, None)):
+        retention.remove_assignments(assignment)
+
+    retention.assignable_policy(policy.reference, False)
+
+
 def test_zdelete_policy():
     retention = RetentionAPI()
     for policy in retention.policies().results:
@@ -0,0 +1,57 @@
+import threading
+
+from pyPreservica import *
+
+
+class FakeSearchResponse:
+    status_code = 200
+
+    def __init__(self, document):
+        self.document = document
+
+    def json(self):
+        return self.document
+
+
+class FakeSearchSession:
+    """
+    Returns pages of search results from a fixed list of references
+    """
+
+    def __init__(self, hits):
+        self.hits = hits
+
+    def post(self, url, data=None, headers=None):
+        start = int(data['start'])
+        page = range(start, min(start + int(data['max']), self.hits))
+        return FakeSearchResponse({'value': {
+            'totalHits': self.hits,
+            'objectIds': [f'sdb:IO|ref-{i}' for i in page],
+            'metadata': [[{'name': 'xip.title', 'value': f'title-{i}'}] for i in page]}})
+
+
+def search_client(hits):
+    client = ContentAPI.__new__(ContentAPI)
+    client.protocol = "https"
+    client.server = "test"
+    client._token = "token"
+    client._token_expires = None
+    client.session = FakeSearchSession(hits)
+    return client
+
+
+def test_search_prefetch_matches_serial():
+    results = {}
+    progress = {}
+    for prefetch in (1, 4):
+        client = search_client(95)
+        values = []
+        threads = set()
+        client.search_callback(lambda value: (values.append(value), threads.add(threading.get_ident())))
+        results[prefetch] = list(client.simple_search_list("%", 10, ["xip.title"], prefetch=prefetch))
+        progress[prefetch] = values
+        assert threads == {threading.get_ident()}
+    assert len(results[1]) == 95
+    assert results[1] == results[4]
+    assert progress[1] == progress[4]
+    assert progress[4] == [f'{i}:95' for i in range(10, 95, 10)] + ['95:95']
@@ -113,6 +113,25 @@ def test_create_simple_package_with_fixities():
     shutil.rmtree(folder)
 
 
+def test_create_simple_package_with_multi_fixity():
+    folder = client.folder(FOLDER_ID)
+    package = simple_asset_package(preservation_file=file, parent_folder=folder,
+                                   Preservation_files_fixity_callback=MultiFixityCallBack(["SHA256", "MD5"]))
+    io_ref = os.path.basename(package).replace(".zip", "")
+    with zipfile.ZipFile(package, "r") as zip_ref:
+        zip_ref.extractall("./test_data/")
+    folder = f"./test_data/{io_ref}"
+    metadata = f"{folder}/metadata.xml"
+    xml_document = xml.etree.ElementTree.parse(metadata)
+    values = {f.find(f'{{{NS}}}FixityAlgorithmRef').text: f.find(f'{{{NS}}}FixityValue').text
+              for f in xml_document.findall(f'.//{{{NS}}}Fixity')}
+    assert values["SHA256"] == FileHash(hashlib.sha256)(file)
+    assert values["MD5"] == FileHash(hashlib.md5)(file)
+    assert FileHash(hashlib.sha256)(f"{folder}/content/p1/{os.path.basename(file)}") == values["SHA256"]
+    xmlschema.validate(metadata, './test_data/XIP-V6.0.xsd')
+    shutil.rmtree(folder)
+
+
 def test_create_complex_package_with_parent():
     folder = client.folder(FOLDER_ID)
     preservation_files_list = [file, file]
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import pytest
 from pyPreservica import *
 
@@ -42,3 +44,12 @@ def test_get_workflow_instances():
     assert len(list(workflow.workflow_instances(workflow_state="Completed", workflow_type="Ingest",  from_date="2025-01-01", to_date="2026-01-01"))) == 423
 
     assert len(list(workflow.workflow_instances(workflow_state="Aborted", workflow_type="Ingest",  from_date="2025-01-01", to_date="2026-01-01"))) == 9
+
+
+def test_get_workflow_history():
+    workflow = WorkflowAPI()
+    history = list(workflow.workflow_history(from_date=datetime(2025, 1, 1), to_date=datetime(2026, 1, 1),
+                                             workflow_states=["Completed", "Aborted"], workflow_types=["Ingest"]))
+    assert len([r for r in history if r['State'] == "Completed"]) == 423
+    assert len([r for r in history if r['State'] == "Aborted"]) == 9
+    assert len(set(r['Id'] for r in history)) == len(history)
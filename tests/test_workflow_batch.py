@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+from pyPreservica import *
+
+
+class FakeWorkflowClient:
+    """
+    Stands in for WorkflowAPI, each workflow reports Active on its first poll and then its final state
+    """
+
+    def __init__(self, final_states):
+        self.final_states = final_states
+        self.polls = {}
+        self.parameters = {}
+        self.running = set()
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def _start_workflow(self, workflow_context, correlation_id, **kwargs):
+        with self.lock:
+            instance_id = len(self.parameters) + 1
+            self.parameters[instance_id] = kwargs
+            self.running.add(instance_id)
+            self.peak = max(self.peak, len(self.running))
+            return instance_id
+
+    def workflow_instance(self, instance_id):
+        with self.lock:
+            self.polls[instance_id] = self.polls.get(instance_id, 0) + 1
+            instance = WorkflowInstance(instance_id)
+            instance.state = "Active"
+            if self.polls[instance_id] > 1:
+                instance.state = self.final_states.get(self.parameters[instance_id]["name"], "Completed")
+                self.running.discard(instance_id)
+            return instance
+
+
+def test_workflow_batch_limits_active_workflows():
+    client = FakeWorkflowClient({"broken": "Failed"})
+    batch = WorkflowBatch(client, max_active=3, poll_interval=0, max_retries=1)
+    context = WorkflowContext("context-id", "Context")
+    for i in range(10):
+        batch.add(context, name=f"workflow-{i}")
+    broken = batch.add(context, name="broken")
+
+    statistics = batch.run()
+
+    assert client.peak <= 3
+    assert statistics.completed == 10
+    assert statistics.failed == 1
+    assert statistics.retried == 1
+    assert broken.attempts == 2
+    assert broken.state == "Failed"
+    assert all(job.state == "Completed" for job in batch.jobs if job is not broken)
+    assert statistics.latency()['run_max'] >= statistics.latency()['run_p50']
+
+
+class BusyWorkflowClient(FakeWorkflowClient):
+    """
+    Refuses the first starts with HTTP 503, as a server with a full queue does
+    """
+
+    def __init__(self, refusals):
+        super().__init__({})
+        self.refusals = refusals
+
+    def _start_workflow(self, workflow_context, correlation_id, **kwargs):
+        if self.refusals > 0:
+            self.refusals -= 1
+            raise RuntimeError(503, "start_workflow_instance failed")
+        return super()._start_workflow(workflow_context, correlation_id, **kwargs)
+
+
+def test_workflow_batch_refusals_do_not_use_retries():
+    client = BusyWorkflowClient(refusals=5)
+    batch = WorkflowBatch(client, max_active=2, poll_interval=0, max_retries=0)
+    context = WorkflowContext("context-id", "Context")
+    for i in range(3):
+        batch.add(context, name=f"workflow-{i}")
+
+    statistics = batch.run()
+
+    assert statistics.refused == 5
+    assert statistics.completed == 3
+    assert statistics.failed == 0
+    assert all(job.attempts == 1 for job in batch.jobs)
+    assert [client.parameters[job.instance_id]["name"] for job in batch.jobs] == ["workflow-0", "workflow-1",
+                                                                                 "workflow-2"]
+
+
+def test_workflow_batch_requires_instance_id():
+    client = FakeWorkflowClient({})
+    client._start_workflow = lambda workflow_context, correlation_id, **kwargs: None
+    batch = WorkflowBatch(client, max_active=2, poll_interval=0)
+    context = WorkflowContext("context-id", "Context")
+    for i in range(3):
+        batch.add(context, name=f"workflow-{i}")
+
+    with pytest.raises(RuntimeError):
+        batch.run()
+    assert batch.statistics.started == 1
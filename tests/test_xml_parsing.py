@@ -0,0 +1,102 @@
+import os
+import xml.etree.ElementTree
+
+import pytest
+from pyPreservica import *
+from pyPreservica import xmlparser
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+XIP_NS = "http://preservica.com/XIP/v7.0"
+ENTITY_NS = "http://preservica.com/EntityAPI/v7.0"
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as fd:
+        return fd.read()
+
+
+@pytest.fixture(params=[False, True], ids=["etree", "lxml"])
+def client(request):
+    if request.param and xmlparser.lxml is None:
+        pytest.skip("lxml is not installed")
+    previous = xmlparser._use_lxml
+    xmlparser.use_lxml(request.param)
+    api = EntityAPI.__new__(EntityAPI)
+    api.xip_ns = XIP_NS
+    api.entity_ns = ENTITY_NS
+    api.major_version = 7
+    api.minor_version = 0
+    yield api
+    xmlparser._use_lxml = previous
+
+
+def test_parse_entity(client):
+    document = fixture("entity.xml")
+    asset = client._entity_from_xml(Asset, document)
+    root = xml.etree.ElementTree.fromstring(document)
+    assert asset.reference == root.find(f'.//{{{XIP_NS}}}Ref').text
+    assert asset.title == root.find(f'.//{{{XIP_NS}}}Title').text
+    assert asset.description == root.find(f'.//{{{XIP_NS}}}Description').text
+    assert asset.security_tag == "open"
+    assert asset.parent == root.find(f'.//{{{XIP_NS}}}Parent').text
+    assert asset.custom_type == "Photograph"
+    fragments = root.findall(f'.//{{{ENTITY_NS}}}Metadata/{{{ENTITY_NS}}}Fragment')
+    assert asset.metadata == {f.text: f.attrib['schema'] for f in fragments}
+
+
+def test_parse_entity_from_string(client):
+    document = fixture("entity.xml")
+    from_string = client._entity_from_xml(Asset, document.decode("utf-8"))
+    from_bytes = client._entity_from_xml(Asset, document)
+    assert str(from_string) == str(from_bytes)
+    assert from_string.metadata == from_bytes.metadata
+
+
+def test_parse_children(client):
+    document = fixture("children.xml")
+    paged_set = client._children_from_xml(document, "parent-ref")
+    root = xml.etree.ElementTree.fromstring(document)
+    children = root.findall(f'.//{{{ENTITY_NS}}}Child')
+    assert len(paged_set.results) == len(children) == 100
+    assert {e.reference for e in paged_set.results} == {c.attrib['ref'] for c in children}
+    folders = {c.attrib['ref'] for c in children if c.attrib['type'] == EntityType.FOLDER.value}
+    assert {e.reference for e in paged_set.results if e.entity_type is EntityType.FOLDER} == folders
+    assert paged_set.total == int(root.find(f'.//{{{ENTITY_NS}}}TotalResults').text)
+    assert paged_set.next_page == root.find(f'.//{{{ENTITY_NS}}}Next').text
+
+
+def test_parse_generation(client):
+    document = fixture("generation.xml")
+    generation, bitstream_urls = client._generation_from_xml(document, "https://server/generations/1")
+    root = xml.etree.ElementTree.fromstring(document)
+    assert generation.original is True
+    assert generation.active is True
+    assert generation.format_group == root.find(f'.//{{{XIP_NS}}}FormatGroup').text
+    assert generation.effective_date == root.find(f'.//{{{XIP_NS}}}EffectiveDate').text
+    assert generation.gen_index == 1
+    assert len(generation.formats) == len(root.findall(f'.//{{{XIP_NS}}}Format'))
+    properties = root.findall(f'.//{{{XIP_NS}}}Property')
+    assert len(generation.properties) == len(properties) == 20
+    assert [p['Value'] for p in generation.properties] == [p.find(f'.//{{{XIP_NS}}}Value').text for p in properties]
+    urls = root.findall(f'.//{{{ENTITY_NS}}}Bitstreams/{{{ENTITY_NS}}}Bitstream')
+    assert bitstream_urls == [u.text for u in urls]
+
+
+def test_parse_bitstream(client):
+    document = fixture("bitstream.xml")
+    bitstream = client._bitstream_from_xml(document, "https://server/bitstreams/1")
+    assert bitstream.filename == "LC-USZ62-20901.tiff"
+    assert bitstream.length == 1790114
+    assert bitstream.bs_index == 1
+    assert set(bitstream.fixity.keys()) == {"SHA1", "SHA256"}
+    assert bitstream.content_url.endswith("/bitstreams/1/content")
+
+
+def test_find_helpers_match_element_path():
+    root = xml.etree.ElementTree.fromstring(fixture("generation.xml"))
+    tag = f'{{{XIP_NS}}}Property'
+    assert xmlparser.find_all(root, tag) == root.findall(f'.//{tag}')
+    assert xmlparser.find_first(root, tag) is root.find(f'.//{tag}')
+    assert xmlparser.find_first(root, f'{{{XIP_NS}}}Missing') is None
+    assert xmlparser.text_of(None, "default") == "default"